@@ -123,12 +123,16 @@ async def get_chats(
             "next_key": 次ページ用のキー
         }
     """
-    result = await ChatService.get_all_chats(
-        tenant_id=tenant_id,
-        user_id=user_id,
-        limit=page_size,
-        last_evaluated_key=next_key
-    )
+    try:
+        result = await ChatService.get_all_chats(
+            tenant_id=tenant_id,
+            user_id=user_id,
+            page_size=max(1, min(page_size, 100)),
+            last_evaluated_key=next_key
+        )
+    except ValueError as e:
+        # 不正なnext_key
+        raise HTTPException(status_code=400, detail=str(e))
     
     return result
 
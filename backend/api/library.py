@@ -6,9 +6,10 @@ library_id/filename ベースの実装
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from datetime import datetime
 import io
+import asyncio
 
 from services.library_service import library_service
 
@@ -21,6 +22,7 @@ class CreateLibraryRequest(BaseModel):
     name: str
     description: Optional[str] = ""
     metadata: Optional[Dict[str, Any]] = None
+    embedding_dimension: Optional[int] = None  # 例: 256/512/1024（省略時はモデルの次元数）
 
 
 class UpdateLibraryRequest(BaseModel):
@@ -28,6 +30,15 @@ class UpdateLibraryRequest(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
+    embedding_dimension: Optional[int] = None  # 縮小のみ（保存済みベクトルを切り詰め）
+
+
+class SearchFilterRequest(BaseModel):
+    """検索フィルタ（指定した条件はすべて満たすファイルのみ検索）"""
+    filenames: Optional[List[str]] = None
+    content_types: Optional[List[str]] = None  # 例: ["application/pdf", "text/*"]
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
 
 
 class SearchRequest(BaseModel):
@@ -35,6 +46,21 @@ class SearchRequest(BaseModel):
     query: str
     top_k: int = 10
     threshold: float = 0.7
+    index_type: Literal["auto", "flat", "ivf"] = "auto"  # auto: IVF構築済みなら使用
+    nprobe: Optional[int] = None  # IVFで走査するリスト数（再現率と速度のトレードオフ）
+    rerank: Optional[bool] = None  # 量子化インデックスの上位候補を元ベクトルで再スコアリング
+    mode: Literal["vector", "keyword", "hybrid"] = "vector"  # keyword: BM25 / hybrid: RRFで統合
+    prefilter: bool = False  # hybrid時、キーワード一致したチャンクのみベクトルで再評価
+    filters: Optional[SearchFilterRequest] = None  # ファイル名・アップロード日時・コンテンツタイプ
+    mmr_lambda: Optional[float] = None  # MMRで多様化（0〜1、1に近いほど関連度重視。vector/hybridのみ）
+    merge_adjacent: bool = False  # 同じファイルの連続したチャンクを1つのパッセージに結合
+    text_format: Literal["full", "snippet"] = "full"  # snippet: 全文の代わりにクエリ周辺の短い範囲と強調位置を返す
+    snippet_chars: int = 160  # スニペットの最大文字数
+
+
+class MultiLibrarySearchRequest(SearchRequest):
+    """複数ライブラリの横断検索リクエスト"""
+    library_ids: List[str]
 
 
 class EmbeddingRequest(BaseModel):
@@ -82,14 +108,21 @@ async def create_library(
 ):
     """新規ライブラリを作成"""
     try:
+        if request.embedding_dimension is not None:
+            from services.embedding_service import embedding_service
+            embedding_service.resolve_dimension(request.embedding_dimension)
+        
         library = await library_service.create_library(
             name=request.name,
             description=request.description,
             metadata=request.metadata,
+            embedding_dimension=request.embedding_dimension,
             tenant_id=tenant_id,
             user_id=user_id
         )
         return library
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -103,11 +136,27 @@ async def update_library(
 ):
     """ライブラリ情報を更新"""
     try:
+        if request.embedding_dimension is not None:
+            from services.embedding_service import embedding_service
+            
+            current = await library_service.get_library(library_id, tenant_id, user_id)
+            if not current:
+                raise HTTPException(status_code=404, detail="Library not found")
+            
+            dimension = embedding_service.resolve_dimension(request.embedding_dimension)
+            current_dimension = embedding_service.resolve_dimension(current.get('embedding_dimension'))
+            if dimension > current_dimension:
+                raise ValueError("embedding_dimension can only be reduced; re-embed the library to increase it")
+            if dimension < current_dimension:
+                # 保存済みベクトルを先頭の次元に切り詰め（再エンベディング不要）
+                await embedding_service.truncate_library_embeddings(library_id, dimension, tenant_id)
+        
         library = await library_service.update_library(
             library_id=library_id,
             name=request.name,
             description=request.description,
             metadata=request.metadata,
+            embedding_dimension=request.embedding_dimension,
             tenant_id=tenant_id,
             user_id=user_id
         )
@@ -116,6 +165,8 @@ async def update_library(
         return library
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -129,6 +180,11 @@ async def delete_library(
     """ライブラリとその全ファイルを削除"""
     try:
         result = await library_service.delete_library(library_id, tenant_id, user_id)
+        
+        # ロード済みインデックスを破棄
+        from services.embedding_service import embedding_service
+        embedding_service.drop_library_index(library_id, tenant_id)
+        
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -327,50 +383,6 @@ async def extract_text(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# エンベディング処理の共通関数
-async def _process_file_embedding(
-    library_id: str,
-    filename: str,
-    file_data: Dict[str, Any],
-    tenant_id: str,
-    user_id: str
-) -> Dict[str, Any]:
-    """ファイルのエンベディング処理を実行（共通処理）"""
-    from services.embedding_service import embedding_service
-    from services.document_extractor import document_extractor
-    
-    # コンテンツを取得
-    content = file_data.get('content')
-    if isinstance(content, str):
-        content = content.encode('utf-8')
-    
-    # テキスト抽出
-    extract_result = await document_extractor.extract_text(content, filename)
-    
-    if not extract_result.success or not extract_result.text:
-        return {
-            "filename": filename,
-            "status": "failed",
-            "reason": "Text extraction failed"
-        }
-    
-    # エンベディング処理
-    process_result = await embedding_service.process_file(
-        library_id=library_id,
-        filename=filename,
-        text=extract_result.text,
-        tenant_id=tenant_id,
-        user_id=user_id
-    )
-    
-    return {
-        "filename": filename,
-        "status": "success" if process_result.get('success') else "failed",
-        "chunk_count": process_result.get('chunk_count', 0),
-        "success": process_result.get('success', False)
-    }
-
-
 # エンベディング管理エンドポイント
 @router.post("/libraries/{library_id}/embeddings")
 async def start_embeddings(
@@ -379,48 +391,27 @@ async def start_embeddings(
     tenant_id: str = "default_tenant",
     user_id: str = "default_user"
 ):
-    """ライブラリ全体のエンベディングを開始"""
+    """ライブラリ全体のエンベディングジョブを投入（処理はバックグラウンドのワーカーで実行）"""
     try:
+        from services.embedding_job_service import embedding_job_service
+        
         # ライブラリ詳細を取得
         library = await library_service.get_library(library_id, tenant_id, user_id)
         if not library:
             raise HTTPException(status_code=404, detail="Library not found")
         
-        results = []
+        jobs = []
+        skipped = []
         files = library.get('files', [])
         
-        # 各ファイルに対してエンベディング処理を実行
         for file_info in files:
-            filename = file_info['filename']
+            filename = file_info['name']
             
             # 強制更新またはエンベディングが存在しない場合のみ処理
             if request.force_update or file_info.get('embedding_status') != 'completed':
-                # ファイルコンテンツを取得
-                file_data = await library_service.get_file(
-                    library_id=library_id,
-                    filename=filename,
-                    tenant_id=tenant_id,
-                    user_id=user_id
-                )
-                
-                if file_data:
-                    # 共通処理を呼び出し
-                    result = await _process_file_embedding(
-                        library_id=library_id,
-                        filename=filename,
-                        file_data=file_data,
-                        tenant_id=tenant_id,
-                        user_id=user_id
-                    )
-                    results.append(result)
-                else:
-                    results.append({
-                        "filename": filename,
-                        "status": "failed",
-                        "reason": "File not found"
-                    })
+                jobs.append(await embedding_job_service.enqueue(library_id, filename, tenant_id, user_id))
             else:
-                results.append({
+                skipped.append({
                     "filename": filename,
                     "status": "skipped",
                     "reason": "Already embedded"
@@ -428,12 +419,12 @@ async def start_embeddings(
         
         return {
             "library_id": library_id,
-            "status": "completed",
-            "message": "Embedding processing completed",
-            "results": results,
-            "processed_files": len([r for r in results if r['status'] == 'success']),
-            "skipped_files": len([r for r in results if r['status'] == 'skipped']),
-            "failed_files": len([r for r in results if r['status'] == 'failed']),
+            "status": "queued" if jobs else "completed",
+            "message": "Embedding jobs queued",
+            "jobs": jobs,
+            "results": skipped,
+            "queued_files": len(jobs),
+            "skipped_files": len(skipped),
             "total_files": len(files)
         }
         
@@ -449,31 +440,57 @@ async def get_embedding_status(
     tenant_id: str = "default_tenant",
     user_id: str = "default_user"
 ):
-    """エンベディング処理状況を確認"""
+    """エンベディング処理状況を確認（ジョブとファイルのレコードから集計）"""
     try:
+        from services.embedding_job_service import embedding_job_service
+        
         library = await library_service.get_library(library_id, tenant_id, user_id)
         if not library:
             raise HTTPException(status_code=404, detail="Library not found")
         
-        # エンベディング情報を集計
-        from services.embedding_service import embedding_service
-        embeddings_by_file = await embedding_service.load_embeddings(library_id, tenant_id)
+        jobs = await embedding_job_service.get_library_jobs(library_id, tenant_id, user_id)
+        job_counts: Dict[str, int] = {}
+        for job in jobs:
+            job_counts[job['status']] = job_counts.get(job['status'], 0) + 1
+        
+        embedded = [f for f in library.get('files', []) if f.get('embedding_status') == 'completed']
+        total_chunks = sum(f.get('chunk_count', 0) for f in embedded)
         
-        total_chunks = sum(len(embs) for embs in embeddings_by_file.values())
-        embedded_files = len(embeddings_by_file)
+        if job_counts.get('queued') or job_counts.get('running'):
+            status = "processing"
+        else:
+            status = "completed" if embedded else "idle"
         
         return {
-            "status": "completed" if embedded_files > 0 else "idle",
+            "status": status,
             "total_chunks": total_chunks,
-            "embedded_files": embedded_files,
-            "files_with_embeddings": list(embeddings_by_file.keys()),
+            "embedded_files": len(embedded),
+            "files_with_embeddings": [f['name'] for f in embedded],
             "last_updated": library.get('updated_at'),
-            "vector_count": total_chunks
+            "vector_count": total_chunks,
+            "job_counts": job_counts,
+            "jobs": jobs
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/embeddings/cache/stats")
+async def get_embedding_cache_stats():
+    """エンベディングキャッシュのヒット/ミス統計を取得（queryは検索クエリのキャッシュ）"""
+    from services.embedding_service import embedding_service
+    return {**embedding_service.cache.get_stats(), "query": embedding_service.query_cache.get_stats()}
+
+
+@router.get("/embeddings/indexes/stats")
+async def get_embedding_index_stats():
+    """検索インデックスの常駐状況・ヒット率・ロード時間の統計を取得"""
+    from services.embedding_service import embedding_service
+    return embedding_service.residency.get_stats()
+
+
 @router.post("/libraries/{library_id}/files/{filename}/embeddings")
 async def update_file_embeddings(
     library_id: str,
@@ -481,37 +498,23 @@ async def update_file_embeddings(
     tenant_id: str = "default_tenant",
     user_id: str = "default_user"
 ):
-    """特定ファイルのエンベディングを更新"""
+    """特定ファイルのエンベディングジョブを投入"""
     try:
-        # ファイルコンテンツを取得
-        file_data = await library_service.get_file(
-            library_id=library_id,
-            filename=filename,
-            tenant_id=tenant_id,
-            user_id=user_id
-        )
+        from services.embedding_job_service import embedding_job_service
         
-        if not file_data:
+        library = await library_service.get_library(library_id, tenant_id, user_id)
+        if not library:
+            raise HTTPException(status_code=404, detail="Library not found")
+        if not any(f.get('name') == filename for f in library.get('files', [])):
             raise HTTPException(status_code=404, detail="File not found")
         
-        # 共通処理を呼び出し
-        result = await _process_file_embedding(
-            library_id=library_id,
-            filename=filename,
-            file_data=file_data,
-            tenant_id=tenant_id,
-            user_id=user_id
-        )
-        
-        if result['status'] == 'failed':
-            raise HTTPException(status_code=400, detail=result.get('reason', 'Embedding processing failed'))
+        job = await embedding_job_service.enqueue(library_id, filename, tenant_id, user_id)
         
         return {
-            "message": "File embedding updated successfully",
+            "message": "File embedding job queued",
             "filename": filename,
             "library_id": library_id,
-            "chunk_count": result.get('chunk_count', 0),
-            "success": result.get('success', False)
+            "job": job
         }
         
     except HTTPException:
@@ -529,13 +532,11 @@ async def delete_file_embeddings(
 ):
     """特定ファイルのエンベディングを削除"""
     try:
-        # エンベディングファイルを削除
-        from services.storage_service import storage_service
+        # エンベディングファイルを削除（ストレージとロード済みインデックス）
+        from services.embedding_service import embedding_service
         from services.kvm_service import kvm_service
         
-        # ストレージから削除
-        storage_key = f"{tenant_id}/library/{library_id}/embeddings/{filename}.json"
-        await storage_service.delete_object(storage_key)
+        await embedding_service.delete_file_embeddings(library_id, filename, tenant_id)
         
         # KVMのステータスを更新
         pk = f"TENANT#{tenant_id}#USER#{user_id}"
@@ -558,6 +559,49 @@ async def delete_file_embeddings(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _search_filter(request: SearchRequest):
+    """リクエストの検索フィルタをサービス層の形式に変換"""
+    if request.filters is None:
+        return None
+    from services.search_filter import SearchFilter
+    filters = request.filters
+    return SearchFilter(
+        filenames=filters.filenames,
+        content_types=filters.content_types,
+        uploaded_after=filters.uploaded_after.isoformat() if filters.uploaded_after else None,
+        uploaded_before=filters.uploaded_before.isoformat() if filters.uploaded_before else None
+    )
+
+
+def _format_search_result(result, request: Optional[SearchRequest] = None) -> dict:
+    """検索結果をレスポンス用の辞書に整形（スニペット形式の場合、全文はチャンク取得APIで遅延取得する）"""
+    from services.chunker import chunk_location
+    from services.snippet import make_snippet
+    
+    formatted = {
+        "filename": result.filename,
+        "uploaded_at": result.uploaded_at,
+        "content_type": result.content_type,
+        "chunk": result.text,
+        "score": result.score,
+        "vector_score": result.vector_score,
+        "keyword_score": result.keyword_score,
+        "metadata": {
+            "chunk_id": result.chunk_id,
+            "chunk_index": result.metadata.get('chunk_index', 0),
+            "start_position": result.metadata.get('start_position', 0),
+            "end_position": result.metadata.get('end_position', 0),
+            "merged_chunk_ids": result.metadata.get('merged_chunk_ids'),
+            "location": chunk_location(result.metadata)  # ページ・スライド・シート・テーブルの位置
+        }
+    }
+    if request is not None and request.text_format == "snippet":
+        del formatted["chunk"]
+        formatted["snippet"] = make_snippet(result.text, request.query, request.snippet_chars)
+        formatted["chunk_length"] = len(result.text)
+    return formatted
+
+
 @router.post("/libraries/{library_id}/search")
 async def search_library(
     library_id: str,
@@ -565,7 +609,7 @@ async def search_library(
     tenant_id: str = "default_tenant",
     user_id: str = "default_user"
 ):
-    """ライブラリ内をベクトル検索（RAG用）"""
+    """ライブラリ内をベクトル・キーワード検索（RAG用）"""
     try:
         # ライブラリの存在確認
         library = await library_service.get_library(library_id, tenant_id, user_id)
@@ -580,23 +624,20 @@ async def search_library(
             query=request.query,
             top_k=request.top_k,
             threshold=request.threshold,
-            tenant_id=tenant_id
+            tenant_id=tenant_id,
+            index_type=request.index_type,
+            nprobe=request.nprobe,
+            rerank=request.rerank,
+            dimension=library.get('embedding_dimension'),
+            mode=request.mode,
+            prefilter=request.prefilter,
+            filters=_search_filter(request),
+            mmr_lambda=request.mmr_lambda,
+            merge_adjacent=request.merge_adjacent
         )
         
         # 結果を整形
-        results = []
-        for result in search_results:
-            results.append({
-                "filename": result.filename,
-                "chunk": result.text,
-                "score": result.score,
-                "metadata": {
-                    "chunk_id": result.chunk_id,
-                    "chunk_index": result.metadata.get('chunk_index', 0),
-                    "start_position": result.metadata.get('start_position', 0),
-                    "end_position": result.metadata.get('end_position', 0)
-                }
-            })
+        results = [_format_search_result(result, request) for result in search_results]
         
         return {
             "results": results,
@@ -604,10 +645,124 @@ async def search_library(
             "library_id": library_id,
             "result_count": len(results),
             "top_k": request.top_k,
-            "threshold": request.threshold
+            "threshold": request.threshold,
+            "index_type": request.index_type,
+            "nprobe": request.nprobe,
+            "mode": request.mode
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/libraries/{library_id}/files/{filename}/chunks/{chunk_id}")
+async def get_chunk(
+    library_id: str,
+    filename: str,
+    chunk_id: str,
+    chunk_index: Optional[int] = None,
+    tenant_id: str = "default_tenant",
+    user_id: str = "default_user"
+):
+    """チャンクの全文を取得（スニペット形式の検索結果から遅延取得。chunk_indexは検索結果の値）"""
+    try:
+        library = await library_service.get_library(library_id, tenant_id, user_id)
+        if not library:
+            raise HTTPException(status_code=404, detail="Library not found")
+        
+        from services.embedding_service import embedding_service
+        from services.chunker import chunk_location
+        
+        chunk = await embedding_service.get_chunk(
+            library_id=library_id,
+            filename=filename,
+            chunk_id=chunk_id,
+            tenant_id=tenant_id,
+            chunk_index=chunk_index
+        )
+        if chunk is None:
+            raise HTTPException(status_code=404, detail="Chunk not found")
+        
+        return {
+            "library_id": library_id,
+            "filename": filename,
+            "chunk_id": chunk_id,
+            "chunk": chunk['text'],
+            "metadata": chunk['metadata'],
+            "location": chunk_location(chunk['metadata'])
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/libraries/search")
+async def search_libraries(
+    request: MultiLibrarySearchRequest,
+    tenant_id: str = "default_tenant",
+    user_id: str = "default_user"
+):
+    """複数ライブラリを横断検索（クエリのエンベディングは1回だけ作成し、結果を1つの順位に統合）"""
+    try:
+        library_ids = list(dict.fromkeys(request.library_ids))
+        if not library_ids:
+            raise HTTPException(status_code=400, detail="library_ids is required")
+        
+        # ライブラリの存在確認
+        libraries = await asyncio.gather(*[
+            library_service.get_library(library_id, tenant_id, user_id) for library_id in library_ids
+        ])
+        missing = [library_id for library_id, library in zip(library_ids, libraries) if not library]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Library not found: {', '.join(missing)}")
+        
+        from services.embedding_service import embedding_service
+        
+        search_results = await embedding_service.search_libraries(
+            libraries=[
+                (library_id, library.get('embedding_dimension'))
+                for library_id, library in zip(library_ids, libraries)
+            ],
+            query=request.query,
+            top_k=request.top_k,
+            threshold=request.threshold,
+            tenant_id=tenant_id,
+            index_type=request.index_type,
+            nprobe=request.nprobe,
+            rerank=request.rerank,
+            mode=request.mode,
+            prefilter=request.prefilter,
+            filters=_search_filter(request),
+            mmr_lambda=request.mmr_lambda,
+            merge_adjacent=request.merge_adjacent
+        )
+        
+        results = [
+            {"library_id": result.library_id, **_format_search_result(result, request)}
+            for result in search_results
+        ]
+        
+        return {
+            "results": results,
+            "query": request.query,
+            "library_ids": library_ids,
+            "result_count": len(results),
+            "top_k": request.top_k,
+            "threshold": request.threshold,
+            "index_type": request.index_type,
+            "nprobe": request.nprobe,
+            "mode": request.mode
         }
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
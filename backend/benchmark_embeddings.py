@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+エンベディングの取り込み・検索のベンチマーク
+ローカルのエンベディング実装（EMBEDDING_PROVIDER=local）で、APIなしに
+チャンク化 → エンベディング → 保存 → 検索 を通しで計測する
+
+使い方:
+    python benchmark_embeddings.py
+    python benchmark_embeddings.py --files 20 --chars 200000 --queries 200 --latency-ms 80 --error-rate 0.02
+    python benchmark_embeddings.py --provider azure --files 2   # 実際のAPIで計測（課金に注意）
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込み（サービスの初期化前）
+load_dotenv()
+
+WORDS = ["会議室", "予約", "申請", "承認", "経費", "精算", "出張", "規程", "手順", "システム",
+         "契約", "更新", "保守", "障害", "対応", "報告", "製品", "仕様", "設計", "試験"]
+
+
+def make_document(rng: random.Random, chars: int) -> str:
+    """語をランダムに並べたテスト用の文書"""
+    sentences = []
+    size = 0
+    while size < chars:
+        sentence = "".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + rng.choice(["。", "。", "！", "\n"])
+        sentences.append(sentence)
+        size += len(sentence)
+    return "".join(sentences)
+
+
+def percentile(values, ratio: float) -> float:
+    """パーセンタイル（最近傍）"""
+    ordered = sorted(values) or [0.0]
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="エンベディングの取り込み・検索を計測")
+    parser.add_argument('--provider', default='local', choices=['local', 'azure', 'openai'], help='エンベディングのバックエンド')
+    parser.add_argument('--tenant', default='benchmark_tenant', help='テナントID（計測用のデータを書き込む）')
+    parser.add_argument('--library', default='benchmark_library', help='ライブラリID')
+    parser.add_argument('--files', type=int, default=10, help='取り込むファイル数')
+    parser.add_argument('--chars', type=int, default=100000, help='1ファイルの文字数')
+    parser.add_argument('--queries', type=int, default=100, help='検索回数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時に取り込むファイル数・同時検索数')
+    parser.add_argument('--mode', default='vector', choices=['vector', 'keyword', 'hybrid'], help='検索モード')
+    parser.add_argument('--dimension', type=int, help='ライブラリの次元数')
+    parser.add_argument('--latency-ms', type=float, help='ローカル実装の1リクエストあたりの遅延')
+    parser.add_argument('--latency-per-input-ms', type=float, help='ローカル実装の1入力あたりの遅延')
+    parser.add_argument('--error-rate', type=float, help='ローカル実装の一時的エラーの発生率')
+    parser.add_argument('--rate-limit-rate', type=float, help='ローカル実装のレート制限の発生率')
+    parser.add_argument('--seed', type=int, default=0, help='文書・クエリ・エラー注入の乱数シード')
+    parser.add_argument('--keep', action='store_true', help='計測後にデータを削除しない')
+    args = parser.parse_args()
+
+    os.environ['EMBEDDING_PROVIDER'] = args.provider
+    os.environ['EMBEDDING_LOCAL_SEED'] = str(args.seed)
+    for name, value in (
+        ('EMBEDDING_LOCAL_LATENCY_MS', args.latency_ms),
+        ('EMBEDDING_LOCAL_LATENCY_PER_INPUT_MS', args.latency_per_input_ms),
+        ('EMBEDDING_LOCAL_ERROR_RATE', args.error_rate),
+        ('EMBEDDING_LOCAL_RATE_LIMIT_RATE', args.rate_limit_rate),
+    ):
+        if value is not None:
+            os.environ[name] = str(value)
+    # 同じ文書の再計測でもAPI（ローカル実装）を呼ぶようにキャッシュは使わない
+    os.environ['EMBEDDING_CACHE_ENABLED'] = 'false'
+    os.environ['EMBEDDING_QUERY_CACHE_ENABLED'] = 'false'
+
+    from services.embedding_service import embedding_service
+    from services.storage_service import storage_service
+
+    rng = random.Random(args.seed)
+    documents = {f"bench_{i:04d}.txt": make_document(rng, args.chars) for i in range(args.files)}
+    total_chars = sum(len(text) for text in documents.values())
+    print(f"[INFO] provider={args.provider} model={embedding_service.embedding_model} "
+          f"files={args.files} chars={total_chars:,}")
+
+    # 取り込み（ファイル単位で並列）
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def ingest(filename: str, text: str) -> int:
+        async def parts():
+            yield text
+
+        async with semaphore:
+            result = await embedding_service.process_file_stream(
+                library_id=args.library,
+                filename=filename,
+                parts=parts(),
+                tenant_id=args.tenant,
+                dimension=args.dimension
+            )
+        return result.get('chunk_count', 0)
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *[ingest(name, text) for name, text in documents.items()], return_exceptions=True
+    )
+    ingest_seconds = time.perf_counter() - start
+    chunks = sum(outcome for outcome in outcomes if not isinstance(outcome, BaseException))
+    failed_files = sum(1 for outcome in outcomes if isinstance(outcome, BaseException))
+    print(f"取り込み: {chunks:,} chunks in {ingest_seconds:.2f}s "
+          f"({chunks / ingest_seconds:,.0f} chunks/s, {total_chars / ingest_seconds:,.0f} chars/s), "
+          f"失敗 {failed_files} files")
+
+    # 検索（初回はインデックスのロードを含むため別に計測）
+    queries = [" ".join(rng.sample(WORDS, 2)) for _ in range(args.queries)]
+    latencies = []
+    failures = []
+
+    async def search(query: str):
+        async with semaphore:
+            began = time.perf_counter()
+            try:
+                await embedding_service.search(
+                    library_id=args.library,
+                    query=query,
+                    top_k=10,
+                    threshold=0.0,
+                    tenant_id=args.tenant,
+                    dimension=args.dimension,
+                    mode=args.mode
+                )
+            except Exception as e:
+                # クエリのエンベディングはリトライしないため、注入したエラーはそのまま失敗になる
+                failures.append(type(e).__name__)
+                return
+            latencies.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    await search(queries[0])
+    print(f"初回検索（インデックスのロードを含む）: {(time.perf_counter() - began) * 1000:.1f}ms")
+
+    latencies.clear()
+    failures.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*[search(query) for query in queries])
+    search_seconds = time.perf_counter() - start
+    print(f"検索: {len(queries)} queries in {search_seconds:.2f}s ({len(queries) / search_seconds:,.1f} qps), "
+          f"p50={percentile(latencies, 0.5) * 1000:.1f}ms p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms, 失敗 {len(failures)} queries")
+
+    provider = embedding_service.provider
+    if hasattr(provider, 'calls'):
+        print(f"エンベディング呼び出し: {provider.calls} requests, {provider.inputs} inputs")
+
+    if not args.keep:
+        prefix = f"{args.tenant}/library/{args.library}/"
+        result = await storage_service.list_objects(prefix=prefix)
+        for obj in result.get('objects', []):
+            await storage_service.delete_object(obj['key'])
+        embedding_service.drop_library_index(args.library, args.tenant)
+        print(f"[INFO] Deleted benchmark data under {prefix}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -58,6 +58,34 @@ app.include_router(agent.router, prefix="/api/agent", tags=["agent"])
 app.include_router(webcrawl.router, prefix="/api/webcrawl", tags=["webcrawl"])
 app.include_router(websocket.router, prefix="/ws", tags=["websocket"])
 
+# エンベディングジョブのワーカー（未完了ジョブは起動時に再投入）
+@app.on_event("startup")
+async def start_embedding_jobs():
+    from services.embedding_job_service import embedding_job_service
+    await embedding_job_service.start()
+
+@app.on_event("shutdown")
+async def stop_embedding_jobs():
+    from services.embedding_job_service import embedding_job_service
+    await embedding_job_service.stop()
+
+# 検索インデックスの事前ロードと検索回数の保存
+@app.on_event("startup")
+async def start_index_residency():
+    from services.embedding_service import embedding_service
+    await embedding_service.start_residency()
+
+@app.on_event("shutdown")
+async def stop_index_residency():
+    from services.embedding_service import embedding_service
+    await embedding_service.stop_residency()
+
+# KVMの共有接続を閉じる
+@app.on_event("shutdown")
+async def close_kvm_service():
+    from services.kvm_service import kvm_service
+    await kvm_service.close()
+
 # Root endpoint
 @app.get("/")
 async def root():
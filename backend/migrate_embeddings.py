@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+エンベディング保存形式の移行コマンド
+旧形式（インデント付きJSON）のエンベディングを .npy + サイドカー形式に変換する
+
+使い方:
+    python migrate_embeddings.py --tenant default_tenant
+    python migrate_embeddings.py --tenant default_tenant --library lib_xxx --dtype float16
+"""
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+# 環境変数を読み込み（サービスの初期化前）
+load_dotenv()
+
+
+async def find_libraries(tenant_id: str):
+    """旧形式のエンベディングを持つライブラリIDを列挙"""
+    from services.storage_service import storage_service
+    from services import embedding_format
+
+    prefix = f"{tenant_id}/library/"
+    result = await storage_service.list_objects(prefix=prefix)
+
+    library_ids = set()
+    for obj in result.get('objects', []):
+        parts = obj['key'][len(prefix):].split('/')
+        if len(parts) < 3 or parts[1] != 'embeddings':
+            continue
+        key = obj['key']
+        if key.endswith(embedding_format.LEGACY_SUFFIX) and not key.endswith(embedding_format.META_SUFFIX):
+            library_ids.add(parts[0])
+
+    return sorted(library_ids)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="エンベディングをバイナリ形式に移行")
+    parser.add_argument('--tenant', default='default_tenant', help='テナントID')
+    parser.add_argument('--library', action='append', help='ライブラリID（複数指定可、省略時は全ライブラリ）')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], help='保存する型')
+    args = parser.parse_args()
+
+    if args.dtype:
+        os.environ['EMBEDDING_STORAGE_DTYPE'] = args.dtype
+
+    from services.embedding_service import embedding_service
+
+    library_ids = args.library or await find_libraries(args.tenant)
+    if not library_ids:
+        print("移行対象のライブラリはありません")
+        return
+
+    total_files = 0
+    for library_id in library_ids:
+        result = await embedding_service.migrate_library(library_id, args.tenant)
+        total_files += result['migrated_files']
+        print(f"[{library_id}] {result['migrated_files']} files migrated")
+        for file_result in result['files']:
+            print(
+                f"  - {file_result['filename']}: {file_result['chunk_count']} chunks, "
+                f"{file_result['json_size']:,} -> {file_result['binary_size']:,} bytes"
+            )
+
+    print(f"完了: {len(library_ids)} libraries, {total_files} files")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
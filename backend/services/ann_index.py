@@ -0,0 +1,165 @@
+"""
+近似最近傍（ANN）インデックス
+IVF-flat: k-meansの粗量子化器でベクトルをリストに振り分け、検索時はnprobe個のリストだけを走査する
+
+ストレージ構成:
+- {tenant}/library/{library_id}/embeddings/_index/ivf.npz
+    centroids     (nlist, D) float32  正規化済みセントロイド
+    file_names    (F,) str            ファイル名
+    file_offsets  (F+1,) int64        assignmentsのファイル別区切り
+    assignments   (N,) int32          チャンクごとのリスト番号（サイドカーの行順）
+"""
+
+import io
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+IVF_INDEX_KEY = "_index/ivf.npz"
+
+
+def default_list_count(vector_count: int) -> int:
+    """ベクトル数に応じたリスト数（約√N）"""
+    return int(min(4096, max(1, np.sqrt(vector_count))))
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """
+    各ベクトルを最も近いセントロイドに割り当て
+
+    Args:
+        vectors: (N, D) 正規化済みベクトル
+        centroids: (nlist, D) 正規化済みセントロイド
+        batch_size: 一度に処理する行数
+
+    Returns:
+        (N,) int32 リスト番号
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        block = vectors[start:start + batch_size]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    n_lists: int,
+    iterations: int = 10,
+    max_training_points: int = 65536,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    球面k-meansでセントロイドを学習（大規模ライブラリはサンプリングして学習）
+
+    Args:
+        vectors: (N, D) 正規化済みベクトル
+        n_lists: リスト数
+        iterations: 反復回数
+        max_training_points: 学習に使う最大点数
+        seed: 乱数シード
+
+    Returns:
+        (nlist, D) 正規化済みセントロイド
+    """
+    rng = np.random.default_rng(seed)
+    n_lists = max(1, min(n_lists, len(vectors)))
+
+    if len(vectors) > max_training_points:
+        sample = vectors[rng.choice(len(vectors), max_training_points, replace=False)]
+    else:
+        sample = vectors
+
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+
+        # 各リストのベクトル和 → 正規化で新しいセントロイド
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        # 空のリストはランダムな点で埋め直す
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def encode_ivf(centroids: np.ndarray, assignments_by_file: Dict[str, np.ndarray]) -> bytes:
+    """
+    IVFインデックスを .npz にエンコード
+
+    Args:
+        centroids: (nlist, D) セントロイド
+        assignments_by_file: ファイル名 -> リスト番号の配列
+
+    Returns:
+        .npz のバイト列
+    """
+    file_names = list(assignments_by_file.keys())
+    offsets = np.zeros(len(file_names) + 1, dtype=np.int64)
+    blocks = []
+    for i, name in enumerate(file_names):
+        block = np.asarray(assignments_by_file[name], dtype=np.int32)
+        blocks.append(block)
+        offsets[i + 1] = offsets[i] + len(block)
+
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        centroids=np.asarray(centroids, dtype=np.float32),
+        file_names=np.array(file_names, dtype=str),
+        file_offsets=offsets,
+        assignments=np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int32)
+    )
+    return buffer.getvalue()
+
+
+def decode_ivf(content: bytes) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    .npz からIVFインデックスをデコード
+
+    Args:
+        content: .npz のバイト列
+
+    Returns:
+        (セントロイド, ファイル名 -> リスト番号の配列)
+    """
+    with np.load(io.BytesIO(content), allow_pickle=False) as data:
+        centroids = data["centroids"].astype(np.float32)
+        file_names = [str(name) for name in data["file_names"]]
+        offsets = data["file_offsets"]
+        assignments = data["assignments"]
+
+    assignments_by_file = {
+        name: assignments[offsets[i]:offsets[i + 1]]
+        for i, name in enumerate(file_names)
+    }
+    return centroids, assignments_by_file
+
+
+def probe_lists(query: np.ndarray, centroids: np.ndarray, nprobe: int) -> np.ndarray:
+    """
+    クエリに近いnprobe個のリスト番号を取得
+
+    Args:
+        query: 正規化済みクエリベクトル
+        centroids: (nlist, D) セントロイド
+        nprobe: 走査するリスト数
+
+    Returns:
+        リスト番号の配列
+    """
+    scores = centroids @ query
+    nprobe = max(1, min(nprobe, len(centroids)))
+    if nprobe >= len(centroids):
+        return np.arange(len(centroids))
+    return np.argpartition(-scores, nprobe - 1)[:nprobe]
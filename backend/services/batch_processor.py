@@ -99,16 +99,16 @@ class BatchProcessor:
         # 実際の実装ではKVMから対象ユーザーリストを取得
         pk = f"TENANT#{self.tenant_id}"
         users = await kvm_service.query(pk=pk, sk_prefix="USER#")
+        user_ids = [user_item.get('SK', '').replace('USER#', '') for user_item in users]
+        user_ids = [user_id for user_id in user_ids if user_id]
         
-        for user_item in users:
-            user_id = user_item.get('SK', '').replace('USER#', '')
-            if not user_id:
-                continue
-            
-            # ユーザーの全チャットルームを取得
-            user_pk = f"TENANT#{self.tenant_id}#USER#{user_id}"
-            rooms = await kvm_service.query(pk=user_pk, sk_prefix="CHAT#")
-            
+        # ユーザーの全チャットルームを並行して取得
+        rooms_by_user = await asyncio.gather(*[
+            kvm_service.query(pk=f"TENANT#{self.tenant_id}#USER#{user_id}", sk_prefix="CHAT#")
+            for user_id in user_ids
+        ])
+        
+        for user_id, rooms in zip(user_ids, rooms_by_user):
             for room_item in rooms:
                 room_id = room_item.get('SK', '').replace('CHAT#', '')
                 if not room_id:
@@ -76,7 +76,7 @@ class ChatService:
             tenant_id: テナントID
             user_id: ユーザーID
             page_size: 1ページあたりの件数（デフォルト50、最大100）
-            last_evaluated_key: 前回の最後のキー（カーソル）
+            last_evaluated_key: 前回のレスポンスのnext_key（カーソル）
         
         Returns:
             {
@@ -91,13 +91,15 @@ class ChatService:
         pk = f"TENANT#{tenant_id}#USER#{user_id}"
         sk_prefix = "CHAT#"
         
-        # KVMからクエリ（新しい順）
-        chat_items = await kvm_service.query(
+        # KVMから1ページ分をクエリ（新しい順）
+        page = await kvm_service.query_page(
             pk=pk,
             sk_prefix=sk_prefix,
-            limit=page_size,
-            scan_forward=False  # 新しい順（SKの降順）
+            page_size=page_size,
+            scan_forward=False,  # 新しい順（SKの降順）
+            start_key=last_evaluated_key
         )
+        chat_items = page['items']
         
         # チャット情報を整形
         chats = []
@@ -136,8 +138,8 @@ class ChatService:
         # カーソルベースページネーションレスポンス
         return {
             'chats': chats,
-            'has_more': len(chat_items) == page_size,
-            'next_key': chat_items[-1].get('SK', '') if len(chat_items) == page_size and chat_items else None
+            'has_more': page['next_key'] is not None,
+            'next_key': page['next_key']
         }
     
     @staticmethod
@@ -356,13 +358,13 @@ class ChatService:
                 sk=sk,
                 updates={
                     'updated_at': timestamp.isoformat(),
-                    'message_count': 1,  # インクリメント
                     'last_message': {
                         'text': preview_text,
                         'timestamp': timestamp.isoformat(),
                         'role': role
                     }
-                }
+                },
+                increments={'message_count': 1}  # サーバー側でアトミックにインクリメント
             )
             
             if not update_result['success']:
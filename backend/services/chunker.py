@@ -0,0 +1,227 @@
+"""
+テキストのチャンク化
+エンベディングモデルの推定トークン数でチャンクの大きさを決め、句読点で区切る
+
+- 窓の推定トークン数は文字列のC実装（encode）で数え、窓を広げる/戻す量は残り予算から
+  まとめて決める（各文字を定数回しか見ないためテキスト長に対して線形時間）
+- チャンクはジェネレーターで順に返す
+- 構造単位（ページ・スライド・シート・テーブル）の境界をまたぐチャンクは作らず、
+  チャンクのmetadataに単位の位置（page / slide / sheet / table）を記録する
+"""
+
+import hashlib
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, Optional
+
+
+# トークン数の概算（ASCIIは約4文字/トークン、日本語等は約1文字/トークン）を
+# 1/4トークン単位の整数重みで扱う
+ASCII_WEIGHT = 1
+OTHER_WEIGHT = 4
+WEIGHT_SCALE = 4
+
+# 区切りに使う句読点（優先順。前のものが窓内にあればそれで区切る）
+PUNCTUATIONS = ['。', '．', '！', '？', '\n\n', '\n']
+
+# チャンクのmetadataに記録する構造単位の位置
+LOCATION_KEYS = ("page", "slide", "sheet", "table")
+
+
+@dataclass
+class ChunkResult:
+    """チャンク化の結果"""
+    chunk_id: str
+    text: str
+    position: int
+    metadata: Dict[str, Any]
+
+
+@dataclass
+class TextSegment:
+    """
+    抽出したテキストの断片（document_extractor.iter_segments の出力）
+    textを順に連結すると抽出テキスト全体になる
+    """
+    text: str
+    location: Optional[Dict[str, Any]] = None  # 構造単位の先頭の断片のみ（例: {"page": 3}）。Noneは直前の単位の続き
+
+
+def chunk_location(metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """チャンクのmetadataから構造単位の位置を取り出す（記録がなければNone）"""
+    location = {key: metadata[key] for key in LOCATION_KEYS if metadata.get(key) is not None}
+    return location or None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数を概算（ASCIIは約4文字/トークン、日本語等は約1文字/トークン）
+
+    Args:
+        text: テキスト
+
+    Returns:
+        推定トークン数
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + 1
+
+
+def _weight(text: str, start: int, end: int) -> int:
+    """text[start:end] の推定トークン数（1/4トークン単位）"""
+    segment = text[start:end]
+    ascii_chars = len(segment.encode('ascii', 'ignore'))
+    return ascii_chars * ASCII_WEIGHT + (len(segment) - ascii_chars) * OTHER_WEIGHT
+
+
+def _window_end(text: str, start: int, budget: int) -> int:
+    """
+    start から推定トークン数が budget 以下に収まる最長の終了位置
+
+    1文字の重みは最大OTHER_WEIGHTなので、残り予算 // OTHER_WEIGHT 文字はまとめて追加できる。
+    残り予算は毎回1/4以上減るため、繰り返しは予算の対数回で終わる
+    """
+    length = len(text)
+    if text[start:start + budget].isascii():
+        return min(start + budget, length)  # 英文のみの窓は重みを数えずに決まる
+    end = start
+    remaining = budget
+    while remaining >= OTHER_WEIGHT and end < length:
+        step = min(remaining // OTHER_WEIGHT, length - end)
+        remaining -= _weight(text, end, end + step)
+        end += step
+    while end < length and remaining >= ASCII_WEIGHT and ord(text[end]) < 128:
+        remaining -= ASCII_WEIGHT
+        end += 1
+    return end
+
+
+def _overlap_start(text: str, start: int, end: int, overlap: int) -> int:
+    """end から遡って推定トークン数が overlap 以上になる最大の開始位置（start より前には戻らない）"""
+    if text[max(end - overlap, start):end].isascii():
+        return max(end - overlap, start)
+    position = end
+    remaining = overlap
+    while remaining >= OTHER_WEIGHT and position > start:
+        step = min(remaining // OTHER_WEIGHT, position - start)
+        remaining -= _weight(text, position - step, position)
+        position -= step
+    while remaining > 0 and position > start:
+        position -= 1
+        remaining -= _weight(text, position, position + 1)
+    return position
+
+
+class StreamingChunker:
+    """
+    テキスト断片を受け取りながらチャンクを切り出す
+    - チャンクは推定トークン数がchunk_tokens以下になる範囲で、句読点で区切る
+    - 次のチャンクは前のチャンクの末尾overlap_tokens分から始める
+    - 未確定の末尾だけをバッファに保持するため、メモリはチャンクサイズ程度で一定
+    - 断片の分け方に関係なく、テキスト全体を一度に渡した場合と同じチャンクになる
+    - feed_segment で新しい構造単位が始まると、それまでのテキストを区切ってからチャンク化を続ける
+    - 総チャンク数は最後まで確定しないため metadata の total_chunks は0のまま
+    """
+
+    def __init__(self, filename: str, chunk_tokens: int, overlap_tokens: int):
+        self.filename = filename
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self._buffer = ""
+        self._offset = 0  # バッファ先頭のテキスト内位置
+        self._position = 0
+        self._chunk_index = 0
+        self._location: Dict[str, Any] = {}  # 現在の構造単位の位置
+
+    def feed(self, text: str) -> Iterator[ChunkResult]:
+        """断片を追加し、確定したチャンクを返す"""
+        self._buffer += text
+        return self._drain(final=False)
+
+    def feed_segment(self, segment: TextSegment) -> Iterator[ChunkResult]:
+        """構造単位つきの断片を追加し、確定したチャンクを返す"""
+        tail = []
+        if segment.location is not None:
+            # 前の単位の残りはバッファ内（チャンク程度）に収まっているため、単位を切り替える前に確定させる
+            tail = list(self._drain(final=True))
+            self._location = dict(segment.location)
+        return itertools.chain(tail, self.feed(segment.text))
+
+    def finish(self) -> Iterator[ChunkResult]:
+        """入力の終わり（残りのチャンクを返す）"""
+        return self._drain(final=True)
+
+    def _drain(self, final: bool) -> Iterator[ChunkResult]:
+        buffer = self._buffer
+        budget = max(self.chunk_tokens, 1) * WEIGHT_SCALE
+        overlap = max(self.overlap_tokens, 0) * WEIGHT_SCALE
+        length = len(buffer)
+        text_length = self._offset + length
+
+        while self._position < text_length:
+            start = self._position - self._offset
+
+            # 推定トークン数が予算に収まる最長の窓
+            end = _window_end(buffer, start, budget)
+            if not final and end >= length:
+                break  # 後続の断片で終了位置が変わりうる場合は待つ
+
+            # 文の途中で切れないように調整（優先順の句読点のうち窓内で最後のもの）
+            if self._offset + end < text_length:
+                for punct in PUNCTUATIONS:
+                    last_punct = buffer.rfind(punct, start, end)
+                    if last_punct != -1:
+                        end = last_punct + len(punct)
+                        break
+            end_position = self._offset + end
+
+            # チャンクを作成
+            chunk_text = buffer[start:end].strip()
+            if chunk_text:  # 空のチャンクは無視
+                chunk_id = hashlib.md5(
+                    f"{self.filename}_{self._chunk_index}_{chunk_text[:50]}".encode()
+                ).hexdigest()[:12]
+
+                yield ChunkResult(
+                    chunk_id=chunk_id,
+                    text=chunk_text,
+                    position=self._chunk_index,
+                    metadata={
+                        "filename": self.filename,
+                        "start_position": self._position,
+                        "end_position": end_position,
+                        "chunk_index": self._chunk_index,
+                        "total_chunks": 0,  # 後で更新
+                        **self._location
+                    }
+                )
+                self._chunk_index += 1
+
+            # 次の開始位置（末尾からoverlap_tokens分戻る、後戻りはしない。テキストの末尾まで来たら終わり）
+            position = self._offset + _overlap_start(buffer, start, end, overlap)
+            if position <= self._position or end_position >= text_length:
+                position = end_position
+            self._position = position
+
+        # 確定済みの部分をバッファから捨てる
+        if self._position > self._offset:
+            self._buffer = self._buffer[self._position - self._offset:]
+            self._offset = self._position
+
+
+def iter_chunks(text: str, filename: str, chunk_tokens: int, overlap_tokens: int) -> Iterator[ChunkResult]:
+    """
+    テキスト全体をチャンクに分割（ジェネレーター）
+
+    Args:
+        text: 分割するテキスト
+        filename: ファイル名
+        chunk_tokens: チャンクあたりの最大推定トークン数
+        overlap_tokens: チャンク間で重複させる推定トークン数
+
+    Returns:
+        チャンクのイテレーター（total_chunksは0のまま）
+    """
+    chunker = StreamingChunker(filename, chunk_tokens, overlap_tokens)
+    yield from chunker.feed(text)
+    yield from chunker.finish()
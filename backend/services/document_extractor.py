@@ -12,13 +12,15 @@
 
 import os
 import io
-from typing import Optional, List, Union
+import asyncio
+from typing import Optional, List, Union, Iterator, AsyncIterator
 from dataclasses import dataclass
 import PyPDF2
 import docx
 import openpyxl
 from pptx import Presentation
 from utils.logger import api_logger
+from services.chunker import TextSegment
 
 
 @dataclass
@@ -88,6 +90,81 @@ class DocumentExtractor:
                 error=str(e)
             )
     
+    @staticmethod
+    async def iter_text(content: bytes, filename: str) -> AsyncIterator[str]:
+        """
+        ファイルからテキストをページ・スライド・シート行単位で逐次抽出
+        連結すると extract_text と同じテキストになる（全文を一度に保持しない）
+        
+        Args:
+            content: ファイルのバイナリコンテンツ
+            filename: ファイル名（拡張子判定用）
+            
+        Yields:
+            テキストの断片
+        """
+        async for segment in DocumentExtractor.iter_segments(content, filename):
+            yield segment.text
+    
+    @staticmethod
+    async def iter_segments(content: bytes, filename: str) -> AsyncIterator[TextSegment]:
+        """
+        iter_text と同じ断片を、ページ・スライド・シート・テーブルの位置つきで逐次抽出
+        各構造単位の先頭の断片に location（例: {"page": 3}）が付く
+        
+        Args:
+            content: ファイルのバイナリコンテンツ
+            filename: ファイル名（拡張子判定用）
+            
+        Yields:
+            テキストの断片
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        parts = DocumentExtractor._iter_segments(content, ext)
+        loop = asyncio.get_event_loop()
+        done = object()
+        step = None
+        
+        try:
+            while True:
+                # パース処理はCPU負荷が高いため1断片ずつスレッドで実行（消費側が遅ければ抽出も止まる）
+                # 取り消されてもスレッドの処理は止まらないため、完了を待てるようshieldで保持する
+                step = loop.run_in_executor(None, next, parts, done)
+                part = await asyncio.shield(step)
+                if part is done:
+                    break
+                yield part
+        finally:
+            # 実行中のジェネレータは閉じられないため、スレッドのnextが終わってから閉じる
+            if step is not None and not step.done():
+                await asyncio.wait([step])
+            parts.close()
+    
+    @staticmethod
+    def _iter_segments(content: bytes, ext: str) -> Iterator[TextSegment]:
+        """拡張子に応じたテキスト断片のジェネレータ"""
+        if ext == '.pdf':
+            yield from DocumentExtractor._pdf_parts(PyPDF2.PdfReader(io.BytesIO(content)))
+        elif ext == '.txt':
+            yield from DocumentExtractor._txt_parts(DocumentExtractor._decode_txt(content))
+        elif ext == '.docx':
+            yield from DocumentExtractor._docx_parts(docx.Document(io.BytesIO(content)))
+        elif ext == '.xlsx':
+            workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            try:
+                yield from DocumentExtractor._xlsx_parts(workbook)
+            finally:
+                workbook.close()
+        elif ext == '.pptx':
+            yield from DocumentExtractor._pptx_parts(Presentation(io.BytesIO(content)))
+        else:
+            raise ValueError(f'Unsupported file type: {ext}')
+    
+    @staticmethod
+    def _join(segments: Iterator[TextSegment]) -> str:
+        """断片を連結して全文にする"""
+        return ''.join(segment.text for segment in segments)
+    
     @staticmethod
     async def _extract_pdf(content: bytes) -> ExtractionResult:
         """PDFからテキストを抽出"""
@@ -95,15 +172,9 @@ class DocumentExtractor:
             pdf_file = io.BytesIO(content)
             pdf_reader = PyPDF2.PdfReader(pdf_file)
             
-            text_parts = []
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(f"--- ページ {page_num + 1} ---\n{page_text}")
-            
             return ExtractionResult(
                 success=True,
-                text='\n\n'.join(text_parts),
+                text=DocumentExtractor._join(DocumentExtractor._pdf_parts(pdf_reader)),
                 metadata=DocumentMetadata(
                     format='PDF',
                     page_count=len(pdf_reader.pages)
@@ -113,28 +184,26 @@ class DocumentExtractor:
             api_logger.error(f"PDF extraction error: {str(e)}")
             raise
     
+    @staticmethod
+    def _pdf_parts(pdf_reader) -> Iterator[TextSegment]:
+        """PDFのページ単位の断片"""
+        separator = ''
+        for page_num, page in enumerate(pdf_reader.pages):
+            page_text = page.extract_text()
+            if page_text:
+                yield TextSegment(
+                    f"{separator}--- ページ {page_num + 1} ---\n{page_text}",
+                    location={"page": page_num + 1}
+                )
+                separator = '\n\n'
+    
     @staticmethod
     async def _extract_txt(content: bytes) -> ExtractionResult:
         """テキストファイルからテキストを抽出"""
         try:
-            # 日本語対応のエンコーディングを優先的に試す
-            encodings = ['utf-8', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp']
-            text = None
-            
-            for encoding in encodings:
-                try:
-                    text = content.decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if text is None:
-                # フォールバック: エラーを無視してデコード
-                text = content.decode('utf-8', errors='ignore')
-            
             return ExtractionResult(
                 success=True,
-                text=text,
+                text=DocumentExtractor._decode_txt(content),
                 metadata=DocumentMetadata(
                     format='TXT',
                     size=len(content)
@@ -144,6 +213,27 @@ class DocumentExtractor:
             api_logger.error(f"TXT extraction error: {str(e)}")
             raise
     
+    @staticmethod
+    def _decode_txt(content: bytes) -> str:
+        """テキストファイルをデコード"""
+        # 日本語対応のエンコーディングを優先的に試す
+        encodings = ['utf-8', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp']
+        
+        for encoding in encodings:
+            try:
+                return content.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+        
+        # フォールバック: エラーを無視してデコード
+        return content.decode('utf-8', errors='ignore')
+    
+    @staticmethod
+    def _txt_parts(text: str, part_size: int = 65536) -> Iterator[TextSegment]:
+        """テキストを一定文字数ごとの断片に分割（構造単位なし）"""
+        for start in range(0, len(text), part_size):
+            yield TextSegment(text[start:start + part_size])
+    
     @staticmethod
     async def _extract_docx(content: bytes) -> ExtractionResult:
         """DOCXからテキストを抽出"""
@@ -151,28 +241,9 @@ class DocumentExtractor:
             docx_file = io.BytesIO(content)
             doc = docx.Document(docx_file)
             
-            text_parts = []
-            
-            # 段落を抽出
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    text_parts.append(para.text)
-            
-            # テーブルを抽出
-            for table in doc.tables:
-                table_text = []
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        row_text.append(cell.text.strip())
-                    if any(row_text):
-                        table_text.append(' | '.join(row_text))
-                if table_text:
-                    text_parts.append('\n'.join(table_text))
-            
             return ExtractionResult(
                 success=True,
-                text='\n\n'.join(text_parts),
+                text=DocumentExtractor._join(DocumentExtractor._docx_parts(doc)),
                 metadata=DocumentMetadata(
                     format='DOCX',
                     paragraph_count=len(doc.paragraphs),
@@ -183,46 +254,72 @@ class DocumentExtractor:
             api_logger.error(f"DOCX extraction error: {str(e)}")
             raise
     
+    @staticmethod
+    def _docx_parts(doc) -> Iterator[TextSegment]:
+        """DOCXの段落・テーブル単位の断片（テーブルはそれぞれ1つの構造単位）"""
+        separator = ''
+        
+        # 段落を抽出
+        for para in doc.paragraphs:
+            if para.text.strip():
+                yield TextSegment(separator + para.text)
+                separator = '\n\n'
+        
+        # テーブルを抽出
+        for table_num, table in enumerate(doc.tables, 1):
+            table_text = []
+            for row in table.rows:
+                row_text = []
+                for cell in row.cells:
+                    row_text.append(cell.text.strip())
+                if any(row_text):
+                    table_text.append(' | '.join(row_text))
+            if table_text:
+                yield TextSegment(separator + '\n'.join(table_text), location={"table": table_num})
+                separator = '\n\n'
+    
     @staticmethod
     async def _extract_xlsx(content: bytes) -> ExtractionResult:
         """XLSXからテキストを抽出"""
         try:
             xlsx_file = io.BytesIO(content)
-            workbook = openpyxl.load_workbook(xlsx_file, data_only=True)
-            
-            text_parts = []
+            workbook = openpyxl.load_workbook(xlsx_file, read_only=True, data_only=True)
             
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                sheet_data = []
-                
-                sheet_data.append(f"=== シート: {sheet_name} ===")
-                
-                # 各行のデータを抽出
-                for row in sheet.iter_rows():
-                    row_data = []
-                    for cell in row:
-                        if cell.value is not None:
-                            row_data.append(str(cell.value))
-                    if row_data:
-                        sheet_data.append(' | '.join(row_data))
-                
-                if len(sheet_data) > 1:  # ヘッダー以外にデータがある場合
-                    text_parts.append('\n'.join(sheet_data))
-            
-            return ExtractionResult(
-                success=True,
-                text='\n\n'.join(text_parts),
-                metadata=DocumentMetadata(
-                    format='XLSX',
-                    sheet_count=len(workbook.sheetnames),
-                    sheet_names=list(workbook.sheetnames)
+            try:
+                return ExtractionResult(
+                    success=True,
+                    text=DocumentExtractor._join(DocumentExtractor._xlsx_parts(workbook)),
+                    metadata=DocumentMetadata(
+                        format='XLSX',
+                        sheet_count=len(workbook.sheetnames),
+                        sheet_names=list(workbook.sheetnames)
+                    )
                 )
-            )
+            finally:
+                workbook.close()
         except Exception as e:
             api_logger.error(f"XLSX extraction error: {str(e)}")
             raise
     
+    @staticmethod
+    def _xlsx_parts(workbook) -> Iterator[TextSegment]:
+        """XLSXの行単位の断片（読み取り専用モードでシートを逐次読み込み）"""
+        separator = ''
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            has_data = False
+            
+            # 各行のデータを抽出
+            for row in sheet.iter_rows(values_only=True):
+                row_data = [str(value) for value in row if value is not None]
+                if not row_data:
+                    continue
+                if not has_data:  # ヘッダー以外にデータがある場合のみシート見出しを出力
+                    yield TextSegment(f"{separator}=== シート: {sheet_name} ===", location={"sheet": sheet_name})
+                    separator = '\n\n'
+                    has_data = True
+                yield TextSegment('\n' + ' | '.join(row_data))
+    
     @staticmethod
     async def _extract_pptx(content: bytes) -> ExtractionResult:
         """PPTXからテキストを抽出"""
@@ -230,44 +327,9 @@ class DocumentExtractor:
             pptx_file = io.BytesIO(content)
             presentation = Presentation(pptx_file)
             
-            text_parts = []
-            
-            for slide_num, slide in enumerate(presentation.slides, 1):
-                slide_text = [f"--- スライド {slide_num} ---"]
-                
-                # タイトル
-                if slide.shapes.title:
-                    title = slide.shapes.title.text.strip()
-                    if title:
-                        slide_text.append(f"タイトル: {title}")
-                
-                # 各シェイプからテキストを抽出
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text:
-                        text = shape.text.strip()
-                        # タイトルの重複を避ける
-                        if text and (not slide.shapes.title or text != slide.shapes.title.text):
-                            slide_text.append(text)
-                    
-                    # テーブルの場合
-                    if shape.has_table:
-                        table_text = []
-                        for row in shape.table.rows:
-                            row_text = []
-                            for cell in row.cells:
-                                if cell.text.strip():
-                                    row_text.append(cell.text.strip())
-                            if row_text:
-                                table_text.append(' | '.join(row_text))
-                        if table_text:
-                            slide_text.append('\n'.join(table_text))
-                
-                if len(slide_text) > 1:  # ヘッダー以外にコンテンツがある場合
-                    text_parts.append('\n'.join(slide_text))
-            
             return ExtractionResult(
                 success=True,
-                text='\n\n'.join(text_parts),
+                text=DocumentExtractor._join(DocumentExtractor._pptx_parts(presentation)),
                 metadata=DocumentMetadata(
                     format='PPTX',
                     slide_count=len(presentation.slides)
@@ -276,6 +338,44 @@ class DocumentExtractor:
         except Exception as e:
             api_logger.error(f"PPTX extraction error: {str(e)}")
             raise
+    
+    @staticmethod
+    def _pptx_parts(presentation) -> Iterator[TextSegment]:
+        """PPTXのスライド単位の断片"""
+        separator = ''
+        for slide_num, slide in enumerate(presentation.slides, 1):
+            slide_text = [f"--- スライド {slide_num} ---"]
+            
+            # タイトル
+            if slide.shapes.title:
+                title = slide.shapes.title.text.strip()
+                if title:
+                    slide_text.append(f"タイトル: {title}")
+            
+            # 各シェイプからテキストを抽出
+            for shape in slide.shapes:
+                if hasattr(shape, "text") and shape.text:
+                    text = shape.text.strip()
+                    # タイトルの重複を避ける
+                    if text and (not slide.shapes.title or text != slide.shapes.title.text):
+                        slide_text.append(text)
+                
+                # テーブルの場合
+                if shape.has_table:
+                    table_text = []
+                    for row in shape.table.rows:
+                        row_text = []
+                        for cell in row.cells:
+                            if cell.text.strip():
+                                row_text.append(cell.text.strip())
+                        if row_text:
+                            table_text.append(' | '.join(row_text))
+                    if table_text:
+                        slide_text.append('\n'.join(table_text))
+            
+            if len(slide_text) > 1:  # ヘッダー以外にコンテンツがある場合
+                yield TextSegment(separator + '\n'.join(slide_text), location={"slide": slide_num})
+                separator = '\n\n'
 
 
 # シングルトンインスタンス
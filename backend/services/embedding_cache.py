@@ -0,0 +1,325 @@
+"""
+エンベディングキャッシュ
+(モデル, 次元数, 正規化テキスト) のハッシュをキーとしたコンテンツアドレス型キャッシュ
+
+- ローカル層: プロセス内LRU
+- 永続層: put_many 1回分のベクトルを1つのパックとして storage_service に保存
+  （{tenant}/embedding_cache/{model}/{dimension}/packs/{pack_id}.npz）し、
+  キー → (パック, 行) の索引を kvm_service にバッチで書き込む
+  取得は索引のバッチ取得とパック単位の読み込みのため、チャンクごとのストレージ往復は発生しない
+
+変更のないチャンクは再アップロード時にもAPIを呼ばずに再利用できる
+
+検索クエリ用には、プロセス内のLRU + TTLキャッシュ（QueryEmbeddingCache）を別に持つ
+"""
+
+import io
+import re
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple, Callable, Awaitable
+
+import numpy as np
+
+from services.storage_service import storage_service
+from services.kvm_service import kvm_service
+
+
+class EmbeddingCache:
+    """エンベディングキャッシュ（LRU + ストレージ永続化）"""
+
+    def __init__(self, max_entries: int = 5000, storage_concurrency: int = 16):
+        self.max_entries = max_entries
+        self.storage_concurrency = storage_concurrency
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+        # ヒット/ミスのカウンター
+        self.local_hits = 0
+        self.storage_hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """キャッシュキー用にテキストを正規化（NFKC・空白の畳み込み）"""
+        text = unicodedata.normalize('NFKC', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    @staticmethod
+    def make_key(model: str, dimension: int, text: str) -> str:
+        """
+        キャッシュキーを生成
+
+        Args:
+            model: エンベディングモデル名
+            dimension: ベクトル次元数
+            text: チャンクテキスト
+
+        Returns:
+            SHA-256ハッシュ（16進）
+        """
+        normalized = EmbeddingCache.normalize_text(text)
+        return hashlib.sha256(f"{model}\0{dimension}\0{normalized}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _pack_key(tenant_id: str, model: str, dimension: int, pack_id: str) -> str:
+        return f"{tenant_id}/embedding_cache/{model}/{dimension}/packs/{pack_id}.npz"
+
+    @staticmethod
+    def _index_pk(tenant_id: str, model: str, dimension: int) -> str:
+        """索引のPK（SKはキャッシュキー）"""
+        return f"EMBEDDING_CACHE#{tenant_id}#{model}#{dimension}"
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """ローカル層に登録（上限を超えたら古いものから破棄）"""
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_many(
+        self,
+        texts: List[str],
+        model: str,
+        dimension: int,
+        tenant_id: str = "default_tenant"
+    ) -> List[Optional[List[float]]]:
+        """
+        テキストのリストに対応するキャッシュ済みベクトルを取得
+
+        Args:
+            texts: チャンクテキストのリスト
+            model: エンベディングモデル名
+            dimension: ベクトル次元数
+            tenant_id: テナントID
+
+        Returns:
+            入力と同じ順序のベクトル（キャッシュにない場合はNone）
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+
+        # ローカル層
+        for i, text in enumerate(texts):
+            key = self.make_key(model, dimension, text)
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                results[i] = vector.tolist()
+                self.local_hits += 1
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if not pending:
+            return results
+
+        # 永続層（索引をバッチで引き、見つかったキーをパックごとにまとめて読み込む）
+        index_pk = self._index_pk(tenant_id, model, dimension)
+        try:
+            index_items = await kvm_service.batch_get_items([(index_pk, key) for key in pending])
+        except Exception as e:
+            print(f"[WARN] Embedding cache index lookup failed: {str(e)}")
+            index_items = [None] * len(pending)
+        packs: Dict[str, List[Tuple[str, int]]] = {}
+        for key, item in zip(pending, index_items):
+            if item:
+                packs.setdefault(item['pack'], []).append((key, item['row']))
+
+        semaphore = asyncio.Semaphore(self.storage_concurrency)
+
+        async def load(pack_id: str):
+            async with semaphore:
+                content = await storage_service.get_object(
+                    self._pack_key(tenant_id, model, dimension, pack_id), return_bytes=True
+                )
+            if not content:
+                return pack_id, None
+            try:
+                with np.load(io.BytesIO(content), allow_pickle=False) as pack:
+                    return pack_id, (pack['keys'], pack['vectors'].astype(np.float32))
+            except (ValueError, KeyError, OSError):
+                return pack_id, None
+
+        found: Dict[str, np.ndarray] = {}
+        for pack_id, pack in await asyncio.gather(*(load(pack_id) for pack_id in packs)):
+            if pack is None:
+                continue
+            keys, vectors = pack
+            for key, row in packs[pack_id]:
+                if row < len(keys) and keys[row] == key:
+                    found[key] = vectors[row]
+
+        for key, indices in pending.items():
+            vector = found.get(key)
+            if vector is None:
+                self.misses += len(indices)
+                continue
+            self._remember(key, vector)
+            self.storage_hits += len(indices)
+            for i in indices:
+                results[i] = vector.tolist()
+
+        return results
+
+    async def put_many(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        model: str,
+        dimension: int,
+        tenant_id: str = "default_tenant"
+    ):
+        """
+        新しく作成したベクトルを両方の層に保存（永続層へはパック1つと索引のバッチ書き込み）
+
+        Args:
+            texts: チャンクテキストのリスト
+            vectors: 対応するベクトルのリスト
+            model: エンベディングモデル名
+            dimension: ベクトル次元数
+            tenant_id: テナントID
+        """
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            entries[self.make_key(model, dimension, text)] = np.asarray(vector, dtype=np.float32)
+        if not entries:
+            return
+
+        for key, vector in entries.items():
+            self._remember(key, vector)
+
+        keys = list(entries)
+        pack_id = hashlib.sha256(''.join(keys).encode('ascii')).hexdigest()[:32]
+        buffer = io.BytesIO()
+        np.savez(buffer, keys=np.array(keys), vectors=np.stack([entries[key] for key in keys]))
+        index_pk = self._index_pk(tenant_id, model, dimension)
+        try:
+            # 索引が存在しないパックを指さないよう、パックを先に保存
+            await storage_service.put_object(
+                key=self._pack_key(tenant_id, model, dimension, pack_id),
+                content=buffer.getvalue(),
+                content_type="application/octet-stream"
+            )
+            await kvm_service.batch_put_items([
+                {'PK': index_pk, 'SK': key, 'pack': pack_id, 'row': row}
+                for row, key in enumerate(keys)
+            ])
+        except Exception as e:
+            # キャッシュの保存に失敗してもエンベディング自体は成功させる
+            print(f"[WARN] Failed to persist {len(keys)} cached embeddings: {str(e)}")
+            return
+        self.writes += len(entries)
+
+    def get_stats(self) -> Dict[str, float]:
+        """ヒット/ミスのカウンターを取得"""
+        hits = self.local_hits + self.storage_hits
+        total = hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "storage_hits": self.storage_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_ratio": hits / total if total else 0.0,
+            "local_entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
+
+
+class QueryEmbeddingCache:
+    """
+    検索クエリのエンベディングキャッシュ（プロセス内LRU + TTL）
+    - キーは (テナント, モデル, 次元数, 正規化クエリ)
+    - 同じクエリの同時要求はAPI呼び出し1回にまとめる（single-flight）
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str, int, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str, int, str], asyncio.Future] = {}
+
+        # ヒット/ミスのカウンター
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 作成中の要求に相乗りした件数
+        self.expired = 0
+
+    async def get_or_create(
+        self,
+        query: str,
+        model: str,
+        dimension: int,
+        create: Callable[[], Awaitable[List[float]]],
+        tenant_id: str = "default_tenant"
+    ) -> List[float]:
+        """
+        クエリのエンベディングを取得（キャッシュにない場合はcreateで作成して登録）
+
+        Args:
+            query: 検索クエリ
+            model: エンベディングモデル名
+            dimension: ベクトル次元数
+            create: エンベディングを作成するコルーチン関数
+            tenant_id: テナントID
+
+        Returns:
+            エンベディングベクトル
+        """
+        key = (tenant_id, model, dimension, EmbeddingCache.normalize_text(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, vector = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            del self._entries[key]
+            self.expired += 1
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return list(await asyncio.shield(pending))
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._pending[key] = future
+        try:
+            vector = await create()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 待機者がいない場合の警告を抑止
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, list(vector))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        future.set_result(vector)
+        return list(vector)
+
+    def clear(self):
+        """キャッシュを破棄"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        """ヒット/ミスのカウンターを取得"""
+        total = self.hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": (self.hits + self.coalesced) / total if total else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds
+        }
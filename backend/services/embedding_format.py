@@ -0,0 +1,432 @@
+"""
+エンベディング保存フォーマット
+ベクトル行列は .npy 形式のバイナリ、チャンク情報は小さなJSONサイドカーに分けて保存する
+
+ストレージ構成:
+- {tenant}/library/{library_id}/embeddings/{filename}.npy       ベクトル行列（float32/float16）
+- {tenant}/library/{library_id}/embeddings/{filename}.meta.json チャンクID・オフセット表・テキスト
+- {tenant}/library/{library_id}/embeddings/{filename}.json      旧形式（読み込みのみ対応）
+
+取り込みでは行列をセグメント単位で書き出し、最後にマニフェストを保存する:
+- {filename}.{generation}.seg{n}.npy / .meta.json  セグメント（上と同じ形式、書き込み後は不変）
+- {filename}.meta.json                             セグメント一覧のマニフェスト（format_version 2）
+マニフェストの保存をもって取り込み完了とし、それまでは前の世代が読まれる
+
+ファイルの追加・削除はライブラリの変更ログにも記録する（削除は墓標）:
+- _log/{timestamp}-{random}.log  変更ログ（他プロセスのロード済みインデックスが差分を反映）
+
+.npy のデータ部は行優先の連続領域なので、サイドカーの offset を使えば
+1行だけのレンジ読み込みやメモリマップが可能（近い行は coalesce_ranges で1回のレンジ読み込みにまとめる）
+"""
+
+import io
+import re
+import json
+import time
+import uuid
+import bisect
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+
+FORMAT_NAME = "makoto-embeddings"
+FORMAT_VERSION = 1
+MANIFEST_VERSION = 2  # セグメント一覧のマニフェスト（旧バージョンの読み込み側では拒否される）
+
+MATRIX_SUFFIX = ".npy"
+META_SUFFIX = ".meta.json"
+LEGACY_SUFFIX = ".json"
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+LOG_PREFIX = "_log/"
+LOG_SUFFIX = ".log"
+
+# {filename}.{generation}.seg{n}
+SEGMENT_PATTERN = re.compile(r"^(?P<filename>.+)\.(?P<generation>[0-9a-f]{8})\.seg(?P<number>\d{5})$")
+
+
+def matrix_key(prefix: str, filename: str) -> str:
+    """ベクトル行列のストレージキー"""
+    return f"{prefix}{filename}{MATRIX_SUFFIX}"
+
+
+def meta_key(prefix: str, filename: str) -> str:
+    """サイドカーのストレージキー"""
+    return f"{prefix}{filename}{META_SUFFIX}"
+
+
+def legacy_key(prefix: str, filename: str) -> str:
+    """旧形式JSONのストレージキー"""
+    return f"{prefix}{filename}{LEGACY_SUFFIX}"
+
+
+def new_generation() -> str:
+    """セグメントの世代ID（同じファイルの再取り込みと区別する）"""
+    return uuid.uuid4().hex[:8]
+
+
+def segment_name(filename: str, generation: str, number: int) -> str:
+    """セグメントの名前（matrix_key / meta_key の filename として使用）"""
+    return f"{filename}.{generation}.seg{number:05d}"
+
+
+def log_entry_name() -> str:
+    """変更ログのエントリ名（名前順 ≒ 時刻順）"""
+    return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{LOG_SUFFIX}"
+
+
+def log_entry_time(name: str) -> float:
+    """変更ログのエントリ名から書き込み時刻（UNIX秒）を取得"""
+    return int(name.split("-", 1)[0]) / 1e9
+
+
+def encode_log_entry(op: str, filename: str, generation: Optional[str] = None) -> str:
+    """
+    変更ログのエントリを作成
+
+    Args:
+        op: put（追加・置き換え）/ delete（墓標）
+        filename: ファイル名
+        generation: 書き込んだ世代ID
+
+    Returns:
+        JSON文字列
+    """
+    return json.dumps({"op": op, "filename": filename, "generation": generation}, ensure_ascii=False)
+
+
+def decode_log_entry(content: str) -> Dict[str, Any]:
+    """変更ログのエントリをデコード"""
+    return json.loads(content)
+
+
+def parse_segment_name(name: str) -> Optional[Tuple[str, str, int]]:
+    """
+    セグメント名を分解
+
+    Args:
+        name: プレフィックスと拡張子を除いた名前
+
+    Returns:
+        (ファイル名, 世代ID, セグメント番号)、セグメントでない場合はNone
+    """
+    match = SEGMENT_PATTERN.match(name)
+    if match is None:
+        return None
+    return match.group("filename"), match.group("generation"), int(match.group("number"))
+
+
+def encode_embeddings(
+    filename: str,
+    chunk_ids: List[str],
+    texts: List[str],
+    metadatas: List[Dict[str, Any]],
+    vectors: np.ndarray,
+    embedding_model: str,
+    created_at: str,
+    dtype: str = "float32"
+) -> Tuple[bytes, str]:
+    """
+    エンベディングをバイナリ行列とサイドカーJSONにエンコード
+
+    Args:
+        filename: ファイル名
+        chunk_ids: チャンクIDのリスト
+        texts: チャンクテキストのリスト
+        metadatas: チャンクメタデータのリスト
+        vectors: (N, D) のベクトル行列
+        embedding_model: エンベディングモデル名
+        created_at: 作成日時（ISO形式）
+        dtype: 保存する型（float32 / float16）
+
+    Returns:
+        (.npy のバイト列, サイドカーJSON文字列)
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=dtype).reshape(len(chunk_ids), -1))
+
+    buffer = io.BytesIO()
+    np.save(buffer, matrix, allow_pickle=False)
+    matrix_bytes = buffer.getvalue()
+
+    # .npy ヘッダー長（データ部の開始位置）
+    data_offset = len(matrix_bytes) - matrix.nbytes
+    row_bytes = matrix.shape[1] * matrix.itemsize
+
+    meta = {
+        "format": FORMAT_NAME,
+        "format_version": FORMAT_VERSION,
+        "filename": filename,
+        "embedding_model": embedding_model,
+        "embedding_dimension": int(matrix.shape[1]),
+        "dtype": dtype,
+        "chunk_count": len(chunk_ids),
+        "data_offset": data_offset,
+        "row_bytes": row_bytes,
+        "created_at": created_at,
+        "chunks": [
+            {
+                "chunk_id": chunk_id,
+                "row": row,
+                "offset": data_offset + row * row_bytes,
+                "text": text,
+                "metadata": metadata
+            }
+            for row, (chunk_id, text, metadata) in enumerate(zip(chunk_ids, texts, metadatas))
+        ]
+    }
+
+    return matrix_bytes, json.dumps(meta, ensure_ascii=False)
+
+
+def decode_embeddings(
+    matrix_bytes: bytes,
+    meta_content: str
+) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    バイナリ行列とサイドカーJSONをデコード
+
+    Args:
+        matrix_bytes: .npy のバイト列
+        meta_content: サイドカーJSON文字列
+
+    Returns:
+        (サイドカーの辞書, float32のベクトル行列)
+    """
+    return decode_meta(meta_content), decode_matrix(matrix_bytes)
+
+
+def decode_matrix(matrix_bytes: bytes) -> np.ndarray:
+    """.npy のバイト列をfloat32の行列としてデコード"""
+    matrix = np.load(io.BytesIO(matrix_bytes), allow_pickle=False)
+    return matrix.astype(np.float32, copy=False)
+
+
+def decode_meta(meta_content: str) -> Dict[str, Any]:
+    """
+    サイドカーまたはマニフェストのJSONをデコード
+
+    Args:
+        meta_content: JSON文字列
+
+    Returns:
+        サイドカーの辞書
+    """
+    meta = json.loads(meta_content)
+    if meta.get("format") != FORMAT_NAME:
+        raise ValueError("Not an embedding sidecar")
+    max_version = MANIFEST_VERSION if is_manifest(meta) else FORMAT_VERSION
+    if meta.get("format_version", 0) > max_version:
+        raise ValueError(f"Unsupported embedding format version: {meta.get('format_version')}")
+    return meta
+
+
+def is_manifest(meta: Dict[str, Any]) -> bool:
+    """セグメント一覧のマニフェストかどうか"""
+    return "segments" in meta
+
+
+def encode_manifest(
+    filename: str,
+    generation: str,
+    segments: List[Dict[str, Any]],
+    embedding_model: str,
+    dimension: int,
+    dtype: str,
+    created_at: str,
+    attributes: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    セグメント一覧のマニフェストをエンコード
+
+    Args:
+        filename: ファイル名
+        generation: 世代ID
+        segments: name / chunk_count / data_offset の辞書のリスト（行順）
+        embedding_model: エンベディングモデル名
+        dimension: 次元数
+        dtype: 保存型
+        created_at: 作成日時（ISO形式）
+        attributes: ファイル属性（アップロード日時・コンテンツタイプ。検索フィルタ用）
+
+    Returns:
+        マニフェストJSON文字列
+    """
+    manifest = {
+        "format": FORMAT_NAME,
+        "format_version": MANIFEST_VERSION,
+        "filename": filename,
+        "generation": generation,
+        "embedding_model": embedding_model,
+        "embedding_dimension": int(dimension),
+        "dtype": dtype,
+        "chunk_count": sum(segment["chunk_count"] for segment in segments),
+        "row_bytes": int(dimension) * np.dtype(dtype).itemsize,
+        "created_at": created_at,
+        "segments": segments
+    }
+    if attributes is not None:
+        manifest["attributes"] = attributes
+    return json.dumps(manifest, ensure_ascii=False)
+
+
+def merge_segments(
+    manifest: Dict[str, Any],
+    parts: List[Tuple[Dict[str, Any], np.ndarray]]
+) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    セグメントを1ファイル分のサイドカーと行列にまとめる
+
+    Args:
+        manifest: マニフェストの辞書
+        parts: セグメントごとの (サイドカーの辞書, ベクトル行列)（マニフェストの順）
+
+    Returns:
+        (サイドカー互換の辞書, float32のベクトル行列)
+    """
+    chunk_count = manifest["chunk_count"]
+    chunks = []
+    for segment_meta, _ in parts:
+        for chunk in segment_meta["chunks"]:
+            # ストリーミング中は総チャンク数が未確定のためここで補完
+            metadata = dict(chunk["metadata"], total_chunks=chunk_count)
+            chunks.append(dict(chunk, row=len(chunks), metadata=metadata))
+
+    matrices = [matrix for _, matrix in parts if len(matrix)]
+    if matrices:
+        matrix = np.concatenate(matrices)
+    else:
+        matrix = np.zeros((0, manifest["embedding_dimension"]), dtype=np.float32)
+
+    meta = {key: value for key, value in manifest.items() if key != "chunks"}
+    meta["chunks"] = chunks
+    return meta, matrix
+
+
+def matrix_layout(matrix_bytes: bytes, rows: int, dimension: int, dtype: str) -> Dict[str, Any]:
+    """
+    .npy 内のデータ部のレイアウト（行単位のレンジ読み込み用）
+
+    Args:
+        matrix_bytes: .npy のバイト列
+        rows: 行数
+        dimension: 次元数
+        dtype: 保存型
+
+    Returns:
+        data_offset / row_bytes / dtype の辞書
+    """
+    row_bytes = dimension * np.dtype(dtype).itemsize
+    return {
+        "data_offset": len(matrix_bytes) - rows * row_bytes,
+        "row_bytes": row_bytes,
+        "dtype": dtype
+    }
+
+
+def layout_from_meta(meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """サイドカーからレイアウトを取得（旧形式の場合はNone）"""
+    if is_manifest(meta):
+        start_rows = []
+        row = 0
+        for segment in meta["segments"]:
+            start_rows.append(row)
+            row += segment["chunk_count"]
+        return {
+            "row_bytes": meta["row_bytes"],
+            "dtype": meta["dtype"],
+            "segments": [
+                {"name": segment["name"], "start_row": start, "data_offset": segment["data_offset"]}
+                for segment, start in zip(meta["segments"], start_rows)
+            ]
+        }
+    if meta.get("format_version", 0) < 1 or "data_offset" not in meta:
+        return None
+    return {
+        "data_offset": meta["data_offset"],
+        "row_bytes": meta["row_bytes"],
+        "dtype": meta["dtype"]
+    }
+
+
+def locate_row(layout: Dict[str, Any], filename: str, row: int) -> Tuple[str, int]:
+    """
+    ファイル内の行が保存されている行列とバイト位置を取得
+
+    Args:
+        layout: matrix_layout / layout_from_meta のレイアウト
+        filename: ファイル名
+        row: ファイル内の行番号
+
+    Returns:
+        (matrix_key に渡す名前, データの開始バイト位置)
+    """
+    segments = layout.get("segments")
+    if not segments:
+        return filename, layout["data_offset"] + row * layout["row_bytes"]
+    position = bisect.bisect_right([segment["start_row"] for segment in segments], row) - 1
+    segment = segments[position]
+    return segment["name"], segment["data_offset"] + (row - segment["start_row"]) * layout["row_bytes"]
+
+
+def coalesce_ranges(starts: List[int], length: int, max_gap: int) -> List[Tuple[int, int, List[int]]]:
+    """
+    同じ行列内の行のバイト位置を、まとめて読み込むレンジに統合
+
+    Args:
+        starts: 行の開始バイト位置のリスト
+        length: 1行のバイト数
+        max_gap: この間隔（バイト）以下の行は同じレンジで読み込む
+
+    Returns:
+        (レンジの開始位置, レンジのバイト数, 含まれる行の開始位置のリスト) のリスト
+    """
+    ranges: List[Tuple[int, int, List[int]]] = []
+    for start in sorted(set(starts)):
+        if ranges:
+            first, size, members = ranges[-1]
+            if start - (first + size) <= max_gap:
+                ranges[-1] = (first, start + length - first, members + [start])
+                continue
+        ranges.append((start, length, [start]))
+    return ranges
+
+
+def decode_legacy_embeddings(content: str) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    旧形式（インデント付きJSON）のエンベディングをデコード
+
+    Args:
+        content: JSON文字列
+
+    Returns:
+        (サイドカー互換の辞書, float32のベクトル行列)
+    """
+    data = json.loads(content)
+    chunks = data.get("chunks", [])
+    matrix = np.array([chunk["embedding"] for chunk in chunks], dtype=np.float32)
+
+    meta = {
+        "format": FORMAT_NAME,
+        "format_version": 0,
+        "filename": data["filename"],
+        "embedding_model": data.get("embedding_model"),
+        "embedding_dimension": data.get("embedding_dimension"),
+        "dtype": "float32",
+        "chunk_count": len(chunks),
+        "created_at": data.get("created_at"),
+        "chunks": [
+            {
+                "chunk_id": chunk["chunk_id"],
+                "row": row,
+                "text": chunk["text"],
+                "metadata": chunk["metadata"]
+            }
+            for row, chunk in enumerate(chunks)
+        ]
+    }
+    return meta, matrix
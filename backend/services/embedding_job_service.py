@@ -0,0 +1,599 @@
+"""
+エンベディングジョブサービス
+ファイル単位のエンベディング処理をHTTPリクエストの外（ワーカープール）で実行する
+
+- ジョブの状態・進捗はkvm_serviceに保存（ステータスAPIはここを読む）
+- キューはEMBEDDING_JOB_QUEUE_TYPEで切り替え（local: プロセス内 / sqs / azure）
+- テナントごとに同時実行数を制限（上限を超えたジョブはプロセス内で保留し、枠が空いたら実行）
+- 実行するジョブはKVMの条件付き更新で確保し、実行中はメッセージの可視性とハートビートを延長
+- 未完了のジョブは起動時に再投入（処理済みチャンクはエンベディングキャッシュで再利用）
+- 取り込み後、ライブラリのセグメント圧縮を遅延実行（連続した取り込みは1回にまとめる）
+"""
+
+import os
+import json
+import uuid
+import asyncio
+from collections import deque
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from services.kvm_service import kvm_service
+
+
+# 未完了ジョブの一覧（起動時の再投入用、SKはジョブID）
+PENDING_JOBS_PK = "EMBEDDING_JOBS#PENDING"
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobQueueBase(ABC):
+    """ジョブキューの基底クラス"""
+
+    @abstractmethod
+    async def put(self, message: Dict[str, Any]):
+        """メッセージを投入"""
+        pass
+
+    @abstractmethod
+    async def get(self) -> Tuple[Any, Dict[str, Any]]:
+        """メッセージを受信（届くまで待機）し、(受信ハンドル, メッセージ) を返す"""
+        pass
+
+    @abstractmethod
+    async def ack(self, receipt: Any):
+        """処理済みのメッセージを削除"""
+        pass
+
+    @abstractmethod
+    async def release(self, receipt: Any, message: Dict[str, Any], delay: float = 0):
+        """処理せずにキューへ戻す（delay秒後に再配信）"""
+        pass
+
+    @abstractmethod
+    async def extend(self, receipt: Any) -> Any:
+        """受信中のメッセージが再配信されないよう可視性を延長し、以降に使う受信ハンドルを返す"""
+        pass
+
+
+class LocalJobQueue(JobQueueBase):
+    """開発環境用のプロセス内キュー（再起動時はKVMの未完了ジョブから復元）"""
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def put(self, message: Dict[str, Any]):
+        await self._queue.put(message)
+
+    async def get(self) -> Tuple[Any, Dict[str, Any]]:
+        message = await self._queue.get()
+        return None, message
+
+    async def ack(self, receipt: Any):
+        pass
+
+    async def release(self, receipt: Any, message: Dict[str, Any], delay: float = 0):
+        async def put_later():
+            await asyncio.sleep(delay)
+            await self._queue.put(message)
+        asyncio.ensure_future(put_later())
+
+    async def extend(self, receipt: Any) -> Any:
+        return receipt
+
+
+class SQSJobQueue(JobQueueBase):
+    """Amazon SQS実装"""
+
+    def __init__(self):
+        self.queue_url = os.getenv('EMBEDDING_JOB_QUEUE_URL')
+        self.visibility_timeout = int(os.getenv('EMBEDDING_JOB_VISIBILITY_TIMEOUT', '900'))
+
+    async def put(self, message: Dict[str, Any]):
+        import aioboto3
+        async with aioboto3.Session().client('sqs') as sqs:
+            await sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+
+    async def get(self) -> Tuple[Any, Dict[str, Any]]:
+        import aioboto3
+        async with aioboto3.Session().client('sqs') as sqs:
+            while True:
+                # ロングポーリング
+                response = await sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=1,
+                    WaitTimeSeconds=20,
+                    VisibilityTimeout=self.visibility_timeout
+                )
+                for item in response.get('Messages', []):
+                    return item['ReceiptHandle'], json.loads(item['Body'])
+
+    async def ack(self, receipt: Any):
+        import aioboto3
+        async with aioboto3.Session().client('sqs') as sqs:
+            await sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+    async def release(self, receipt: Any, message: Dict[str, Any], delay: float = 0):
+        import aioboto3
+        async with aioboto3.Session().client('sqs') as sqs:
+            await sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt,
+                VisibilityTimeout=int(delay)
+            )
+
+    async def extend(self, receipt: Any) -> Any:
+        import aioboto3
+        async with aioboto3.Session().client('sqs') as sqs:
+            await sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt,
+                VisibilityTimeout=self.visibility_timeout
+            )
+        return receipt
+
+
+class AzureQueueJobQueue(JobQueueBase):
+    """Azure Queue Storage実装"""
+
+    def __init__(self):
+        self.connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        self.queue_name = os.getenv('EMBEDDING_JOB_QUEUE_NAME', 'makoto-embedding-jobs')
+        self.visibility_timeout = int(os.getenv('EMBEDDING_JOB_VISIBILITY_TIMEOUT', '900'))
+
+    def _client(self):
+        from azure.storage.queue.aio import QueueClient
+        return QueueClient.from_connection_string(self.connection_string, self.queue_name)
+
+    async def put(self, message: Dict[str, Any]):
+        async with self._client() as client:
+            await client.send_message(json.dumps(message))
+
+    async def get(self) -> Tuple[Any, Dict[str, Any]]:
+        async with self._client() as client:
+            while True:
+                item = await client.receive_message(visibility_timeout=self.visibility_timeout)
+                if item is not None:
+                    return item, json.loads(item.content)
+                await asyncio.sleep(2)
+
+    async def ack(self, receipt: Any):
+        async with self._client() as client:
+            await client.delete_message(receipt)
+
+    async def release(self, receipt: Any, message: Dict[str, Any], delay: float = 0):
+        async with self._client() as client:
+            await client.update_message(receipt, visibility_timeout=int(delay))
+
+    async def extend(self, receipt: Any) -> Any:
+        # 更新でpop receiptが変わるため、返されたメッセージを以降の受信ハンドルにする
+        async with self._client() as client:
+            return await client.update_message(receipt, visibility_timeout=self.visibility_timeout)
+
+
+def get_job_queue() -> JobQueueBase:
+    """環境変数に基づいてジョブキューを取得"""
+    queue_type = os.getenv('EMBEDDING_JOB_QUEUE_TYPE', 'local').lower()
+
+    if queue_type == 'sqs':
+        return SQSJobQueue()
+    elif queue_type == 'azure':
+        return AzureQueueJobQueue()
+    else:
+        # 開発環境ではプロセス内キューを使用
+        return LocalJobQueue()
+
+
+class EmbeddingJobService:
+    """
+    エンベディングジョブサービス
+    - enqueue: ジョブレコードをKVMに保存してキューに投入（待機中のジョブがあればそれを返す）
+    - ワーカー: キューから取り出してストリーミング取り込みを実行し、進捗をKVMに記録
+    """
+
+    def __init__(self):
+        self.worker_count = int(os.getenv('EMBEDDING_JOB_WORKERS', '4'))
+        self.tenant_concurrency = int(os.getenv('EMBEDDING_JOB_TENANT_CONCURRENCY', '2'))
+        self.heartbeat_seconds = float(os.getenv('EMBEDDING_JOB_HEARTBEAT_SECONDS', '60'))  # 可視性・ハートビートの延長間隔
+        self.compaction_delay = float(os.getenv('EMBEDDING_COMPACTION_DELAY_SECONDS', '60'))  # 最後の取り込みから圧縮までの待ち
+        self.queue = get_job_queue()
+
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, int] = {}  # テナントごとの実行中ジョブ数
+        self._active_keys = set()  # このプロセスで実行中のジョブのキー (PK, SK)
+        self._deferred: Dict[str, deque] = {}  # テナントごとの保留中のメッセージ
+        self._held: Dict[int, Dict[str, Any]] = {}  # 受信中（実行中・保留中）のメッセージ
+        self._compactions: Dict[Tuple[str, str], asyncio.Task] = {}  # (テナント, ライブラリ) -> 予約済みの圧縮
+
+    @staticmethod
+    def _job_key(library_id: str, filename: str, tenant_id: str, user_id: str) -> Tuple[str, str]:
+        """ジョブレコードのキー（ファイルごとに1件、再投入で上書き）"""
+        return f"TENANT#{tenant_id}#USER#{user_id}", f"EMBEDDING_JOB#{library_id}#{filename}"
+
+    @staticmethod
+    def _job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+        """APIで返すジョブ情報"""
+        return {key: value for key, value in job.items() if key not in ('PK', 'SK')}
+
+    async def start(self):
+        """ワーカーを起動し、未完了のジョブを再投入（起動済みの場合は何もしない）"""
+        if self._workers:
+            return
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.worker_count)]
+        self._workers.append(asyncio.ensure_future(self._keep_alive()))
+
+        # ローカルキューは再起動で消えるためKVMから復元
+        if isinstance(self.queue, LocalJobQueue):
+            pending = await kvm_service.query(pk=PENDING_JOBS_PK, page_size=1000, scan_forward=True)
+            for item in pending:
+                await self.queue.put(self._message(item))
+            if pending:
+                print(f"[INFO] Re-queued {len(pending)} pending embedding jobs")
+        print(f"[INFO] Started {self.worker_count} embedding job workers")
+
+    async def stop(self):
+        """ワーカーを停止（実行中・保留中のジョブは未完了のまま残り、次回起動時に再投入される）"""
+        for worker in self._workers:
+            worker.cancel()
+        for task in self._compactions.values():
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._compactions.values(), return_exceptions=True)
+        self._workers = []
+        self._compactions = {}
+        self._deferred = {}
+        self._held = {}
+
+    @staticmethod
+    def _message(job: Dict[str, Any]) -> Dict[str, Any]:
+        """キューに流すメッセージ"""
+        return {
+            "job_id": job['job_id'],
+            "library_id": job['library_id'],
+            "filename": job['filename'],
+            "tenant_id": job['tenant_id'],
+            "user_id": job['user_id']
+        }
+
+    async def enqueue(
+        self,
+        library_id: str,
+        filename: str,
+        tenant_id: str = "default_tenant",
+        user_id: str = "default_user"
+    ) -> Dict[str, Any]:
+        """
+        ファイルのエンベディングジョブを投入
+
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            tenant_id: テナントID
+            user_id: ユーザーID
+
+        Returns:
+            ジョブ情報
+        """
+        pk, sk = self._job_key(library_id, filename, tenant_id, user_id)
+        existing = await kvm_service.get_item(pk, sk)
+        # 実行中のジョブは読み込み済みの内容を処理しているため、新しいジョブで置き換える
+        # （置き換えられたジョブの結果は記録されず、古いメッセージは_handleで捨てられる）
+        if existing and existing.get('status') == 'queued':
+            return self._job_view(existing)
+
+        # 起動時の再投入と二重にならないよう先にワーカーを起動
+        await self.start()
+
+        now = datetime.utcnow().isoformat()
+        job = {
+            'PK': pk,
+            'SK': sk,
+            'job_id': str(uuid.uuid4()),
+            'library_id': library_id,
+            'filename': filename,
+            'tenant_id': tenant_id,
+            'user_id': user_id,
+            'status': 'queued',  # queued, running, completed, failed
+            'attempts': 0,
+            'chunks_embedded': 0,
+            'segments_written': 0,
+            'chunk_count': 0,
+            'error': None,
+            'queued_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'updated_at': now
+        }
+        await kvm_service.put_item(job)
+        await kvm_service.put_item({'PK': PENDING_JOBS_PK, 'SK': job['job_id'], **self._message(job)})
+        await kvm_service.update_item(pk, f"LIBRARY#{library_id}#FILE#{filename}", {
+            "embedding_status": "queued"
+        })
+
+        await self.queue.put(self._message(job))
+        return self._job_view(job)
+
+    async def get_library_jobs(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant",
+        user_id: str = "default_user"
+    ) -> List[Dict[str, Any]]:
+        """
+        ライブラリのジョブ一覧を取得
+
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            user_id: ユーザーID
+
+        Returns:
+            ファイルごとの最新ジョブ情報
+        """
+        pk, sk_prefix = self._job_key(library_id, "", tenant_id, user_id)
+        items = await kvm_service.query(pk=pk, sk_prefix=sk_prefix, page_size=1000, scan_forward=True)
+        return [self._job_view(item) for item in items]
+
+    async def _worker(self):
+        """キューからジョブを取り出して実行"""
+        while True:
+            receipt, message = await self.queue.get()
+            entry = {'receipt': receipt, 'message': message}
+            self._held[id(entry)] = entry
+            while entry is not None:
+                try:
+                    await self._handle(entry)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Embedding job {entry['message'].get('job_id')} crashed: {str(e)}")
+                # 空いた枠で同じテナントの保留中のジョブを続けて処理
+                entry = self._take_deferred(entry['message']['tenant_id'])
+
+    def _take_deferred(self, tenant_id: str) -> Optional[Dict[str, Any]]:
+        """枠が空いていれば、保留中のメッセージのうち実行できるものを取り出す"""
+        waiting = self._deferred.get(tenant_id)
+        if not waiting or self._running.get(tenant_id, 0) >= self.tenant_concurrency:
+            return None
+        for entry in waiting:
+            if self._entry_key(entry) not in self._active_keys:
+                waiting.remove(entry)
+                if not waiting:
+                    del self._deferred[tenant_id]
+                return entry
+        return None
+
+    def _entry_key(self, entry: Dict[str, Any]) -> Tuple[str, str]:
+        """メッセージのジョブレコードのキー"""
+        message = entry['message']
+        return self._job_key(message['library_id'], message['filename'], message['tenant_id'], message['user_id'])
+
+    async def _finish(self, entry: Dict[str, Any], job_id: str):
+        """メッセージを処理済みにする（未完了ジョブの一覧からも削除）"""
+        self._held.pop(id(entry), None)
+        await kvm_service.delete_item(PENDING_JOBS_PK, job_id)
+        await self.queue.ack(entry['receipt'])
+
+    async def _handle(self, entry: Dict[str, Any]):
+        """1件のメッセージを処理（テナント上限・同じファイルを実行中の場合は保留）"""
+        message = entry['message']
+        tenant_id = message['tenant_id']
+        pk, sk = self._entry_key(entry)
+
+        # 保留中はKVMを読み直さず、枠が空いたときに_take_deferredで取り出す
+        if self._running.get(tenant_id, 0) >= self.tenant_concurrency or (pk, sk) in self._active_keys:
+            self._deferred.setdefault(tenant_id, deque()).append(entry)
+            return
+
+        job = await kvm_service.get_item(pk, sk)
+
+        # 再投入で置き換えられた・処理済みのジョブは捨てる
+        if not job or job.get('job_id') != message['job_id'] or job.get('status') not in ACTIVE_STATUSES:
+            await self._finish(entry, message['job_id'])
+            return
+
+        # 他のワーカーが実行中（ハートビートが新しい）・先に確保された場合は、後で状態を確認し直す
+        if self._is_owned_elsewhere(job) or not await self._claim(pk, sk, job):
+            self._held.pop(id(entry), None)
+            await self.queue.release(entry['receipt'], message, delay=self.heartbeat_seconds * 3)
+            return
+
+        self._running[tenant_id] = self._running.get(tenant_id, 0) + 1
+        self._active_keys.add((pk, sk))
+        entry['job'] = (pk, sk, job['job_id'])
+        cancelled = False
+        try:
+            await self._run(pk, sk, job)
+        except asyncio.CancelledError:
+            # 停止時は未完了のまま残し、次回起動時（他のワーカー）に再実行する
+            cancelled = True
+            raise
+        finally:
+            self._running[tenant_id] -= 1
+            self._active_keys.discard((pk, sk))
+            entry.pop('job', None)
+            if not cancelled:
+                # _runが失敗してもメッセージを残さない（ローカルキューでは再起動まで失われるため）
+                await self._finish(entry, job['job_id'])
+
+    def _is_owned_elsewhere(self, job: Dict[str, Any]) -> bool:
+        """他のワーカーが実行中か（ハートビートが止まっていれば、落ちたワーカーのジョブとして引き継ぐ）"""
+        if job.get('status') != 'running':
+            return False
+        heartbeat = job.get('heartbeat_at') or job.get('started_at')
+        if not heartbeat:
+            return False
+        age = (datetime.utcnow() - datetime.fromisoformat(heartbeat)).total_seconds()
+        return age < self.heartbeat_seconds * 3
+
+    async def _claim(self, pk: str, sk: str, job: Dict[str, Any]) -> bool:
+        """ジョブを実行中にする（読み込んだ後に他のワーカーが確保していない場合のみ成功）"""
+        now = datetime.utcnow().isoformat()
+        result = await kvm_service.update_item(pk, sk, {
+            "status": "running",
+            "attempts": job.get('attempts', 0) + 1,
+            "error": None,
+            "started_at": now,
+            "heartbeat_at": now,
+            "updated_at": now
+        }, expected={
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'attempts': job.get('attempts', 0)
+        })
+        return bool(result.get('success'))
+
+    async def _keep_alive(self):
+        """受信中のメッセージの可視性を延長し、実行中のジョブのハートビートを記録"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            for entry in list(self._held.values()):
+                try:
+                    entry['receipt'] = await self.queue.extend(entry['receipt'])
+                    if 'job' in entry:
+                        pk, sk, job_id = entry['job']
+                        await kvm_service.update_item(pk, sk, {
+                            "heartbeat_at": datetime.utcnow().isoformat()
+                        }, expected={'job_id': job_id})
+                except Exception as e:
+                    print(f"[WARN] Failed to extend embedding job {entry['message'].get('job_id')}: {str(e)}")
+
+    async def _run(self, pk: str, sk: str, job: Dict[str, Any]):
+        """ジョブを実行して結果をKVMに記録（_claimで実行中にしたジョブ）"""
+        file_sk = f"LIBRARY#{job['library_id']}#FILE#{job['filename']}"
+        # 置き換えられたジョブは記録しない
+        current = {'job_id': job['job_id']}
+        await kvm_service.update_item(pk, file_sk, {
+            "embedding_status": "processing"
+        })
+
+        async def progress(chunks_embedded: int, segments_written: int):
+            await kvm_service.update_item(pk, sk, {
+                "chunks_embedded": chunks_embedded,
+                "segments_written": segments_written,
+                "updated_at": datetime.utcnow().isoformat()
+            }, expected=current)
+
+        try:
+            result = await self.process_file(
+                library_id=job['library_id'],
+                filename=job['filename'],
+                tenant_id=job['tenant_id'],
+                user_id=job['user_id'],
+                progress=progress
+            )
+        except Exception as e:
+            result = {"filename": job['filename'], "status": "failed", "reason": str(e)}
+
+        status = "completed" if result['status'] == 'success' else "failed"
+        recorded = await kvm_service.update_item(pk, sk, {
+            "status": status,
+            "chunk_count": result.get('chunk_count', 0),
+            "error": result.get('reason'),
+            "finished_at": datetime.utcnow().isoformat(),
+            "updated_at": datetime.utcnow().isoformat()
+        }, expected=current)
+        if not recorded.get('success'):
+            print(f"[INFO] Embedding job {job['job_id']} ({job['filename']}) superseded")
+            return
+        if status == "failed":
+            # 例外にならない失敗（テキストなし・ライブラリやファイルなし）でも処理中のまま残さない
+            await kvm_service.update_item(pk, file_sk, {
+                "embedding_status": "failed",
+                "embedding_error": result.get('reason'),
+                "updated_at": datetime.utcnow().isoformat()
+            })
+        print(f"[INFO] Embedding job {job['job_id']} ({job['filename']}) {status}")
+        if status == "completed":
+            self._schedule_compaction(job['library_id'], job['tenant_id'])
+
+    def _schedule_compaction(self, library_id: str, tenant_id: str):
+        """ライブラリの圧縮を予約（予約済みなら待ち時間を延長）"""
+        key = (tenant_id, library_id)
+        task = self._compactions.get(key)
+        if task is not None and not task.done():
+            task.cancel()
+        self._compactions[key] = asyncio.ensure_future(self._compact_later(library_id, tenant_id))
+
+    async def _compact_later(self, library_id: str, tenant_id: str):
+        """一定時間取り込みがなければライブラリの小さなセグメントをまとめる"""
+        from services.embedding_service import embedding_service
+
+        await asyncio.sleep(self.compaction_delay)
+        self._compactions.pop((tenant_id, library_id), None)
+        try:
+            await embedding_service.compact_library(library_id, tenant_id)
+        except Exception as e:
+            print(f"[ERROR] Compaction failed for library {library_id}: {str(e)}")
+
+    async def process_file(
+        self,
+        library_id: str,
+        filename: str,
+        tenant_id: str = "default_tenant",
+        user_id: str = "default_user",
+        progress=None
+    ) -> Dict[str, Any]:
+        """
+        ファイルのエンベディング処理を実行（抽出からの保存までストリーミング）
+
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            tenant_id: テナントID
+            user_id: ユーザーID
+            progress: セグメント保存ごとに (チャンク数, セグメント数) で呼ばれるコールバック
+
+        Returns:
+            処理結果
+        """
+        from services.library_service import library_service
+        from services.embedding_service import embedding_service
+        from services.document_extractor import document_extractor
+
+        library = await library_service.get_library(library_id, tenant_id, user_id)
+        if not library:
+            return {"filename": filename, "status": "failed", "reason": "Library not found"}
+
+        file_data = await library_service.get_file(
+            library_id=library_id,
+            filename=filename,
+            tenant_id=tenant_id,
+            user_id=user_id
+        )
+        if not file_data:
+            return {"filename": filename, "status": "failed", "reason": "File not found"}
+
+        # コンテンツを取得
+        content = file_data.get('content')
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        # 抽出 → チャンク化 → エンベディング → 保存 をストリーミングで実行
+        try:
+            process_result = await embedding_service.process_file_stream(
+                library_id=library_id,
+                filename=filename,
+                parts=document_extractor.iter_segments(content, filename),
+                tenant_id=tenant_id,
+                user_id=user_id,
+                dimension=library.get('embedding_dimension'),
+                progress=progress
+            )
+        except Exception as e:
+            # 失敗はKVMのembedding_errorにも記録済み
+            return {"filename": filename, "status": "failed", "reason": str(e)}
+
+        if not process_result.get('success'):
+            return {"filename": filename, "status": "failed", "reason": "Text extraction failed"}
+
+        return {
+            "filename": filename,
+            "status": "success",
+            "chunk_count": process_result.get('chunk_count', 0),
+            "success": True
+        }
+
+
+# シングルトンインスタンス
+embedding_job_service = EmbeddingJobService()
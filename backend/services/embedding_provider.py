@@ -0,0 +1,201 @@
+"""
+エンベディングのバックエンド
+EmbeddingService が呼び出すエンベディングAPIを環境変数 EMBEDDING_PROVIDER で切り替える
+
+- azure: Azure OpenAI（デフォルト）
+- openai: OpenAI
+- local: ハッシュによる決定的なベクトル（APIキー不要。遅延・エラーを注入して負荷試験に使う）
+"""
+
+import os
+import zlib
+import random
+import asyncio
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple, Type
+
+import numpy as np
+
+from services.keyword_index import tokenize
+
+
+class EmbeddingProviderBase(ABC):
+    """エンベディングのバックエンドの基底クラス"""
+
+    model: str = ""  # モデル名（キャッシュのキーにも使用）
+    dimension: int = 3072  # モデルの次元数（ライブラリごとに縮小可能）
+
+    # リトライ対象の一時的なエラーと、そのうちレート制限（同時実行数を下げる）のエラー
+    transient_errors: Tuple[Type[BaseException], ...] = ()
+    rate_limit_errors: Tuple[Type[BaseException], ...] = ()
+
+    @abstractmethod
+    async def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        """
+        テキストをエンベディング
+
+        Args:
+            texts: テキストのリスト
+            dimensions: 次元数（Noneの場合はモデルの次元数）
+
+        Returns:
+            入力と同じ順序のエンベディングベクトルのリスト
+        """
+        pass
+
+
+class OpenAICompatibleProvider(EmbeddingProviderBase):
+    """OpenAI SDKのクライアントを使う実装の共通部分"""
+
+    def __init__(self, client, model: str):
+        from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+
+        self.client = client
+        self.model = model
+        self.transient_errors = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+        self.rate_limit_errors = (RateLimitError,)
+
+    async def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        params = {"dimensions": dimensions} if dimensions else {}
+        response = await self.client.embeddings.create(model=self.model, input=texts, **params)
+
+        # レスポンスの順序は保証されないためindexで並べ直す
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+
+class AzureOpenAIEmbeddingProvider(OpenAICompatibleProvider):
+    """Azure OpenAI実装"""
+
+    def __init__(self):
+        from openai import AsyncAzureOpenAI
+
+        client = AsyncAzureOpenAI(
+            api_key=os.getenv('AZURE_OPENAI_EMBEDDING_API_KEY'),
+            api_version=os.getenv('AZURE_OPENAI_EMBEDDING_API_VERSION', '2024-12-01-preview'),
+            azure_endpoint=os.getenv('AZURE_OPENAI_EMBEDDING_ENDPOINT')
+        )
+        # モデル名にはデプロイメント名を使用
+        super().__init__(client, os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT', 'text-embedding-3-large-Trial'))
+
+
+class OpenAIEmbeddingProvider(OpenAICompatibleProvider):
+    """OpenAI実装"""
+
+    def __init__(self):
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=os.getenv('OPENAI_BASE_URL') or None
+        )
+        super().__init__(client, os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-large'))
+
+
+class SimulatedRateLimitError(Exception):
+    """ローカル実装が注入するレート制限エラー（429相当）"""
+    response = None
+
+
+class SimulatedTransientError(Exception):
+    """ローカル実装が注入する一時的なエラー（5xx・タイムアウト相当）"""
+    response = None
+
+
+class LocalEmbeddingProvider(EmbeddingProviderBase):
+    """
+    ハッシュによる決定的なローカル実装
+    - キーワード検索と同じトークンを符号付きで次元に割り当てる（feature hashing）ため、
+      語を共有するテキストほどベクトルが近くなり、検索の動作確認にも使える
+    - モデルの次元数で作成して切り詰め・再正規化するため、text-embedding-3と同様に
+      縮小した次元のベクトルは元のベクトルの先頭と一致する
+    - 遅延（固定 + 入力数比例）とエラー（一時的エラー・レート制限）を確率で注入できる
+    """
+
+    transient_errors = (SimulatedTransientError, SimulatedRateLimitError)
+    rate_limit_errors = (SimulatedRateLimitError,)
+
+    def __init__(
+        self,
+        dimension: int = 3072,
+        latency_seconds: float = 0.0,
+        latency_per_input_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.model = f"local-hash-{dimension}"
+        self.dimension = dimension
+        self.latency_seconds = latency_seconds
+        self.latency_per_input_seconds = latency_per_input_seconds
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._random = random.Random(seed)  # エラー注入用（ベクトルは入力だけで決まる）
+        self.calls = 0
+        self.inputs = 0
+
+    @classmethod
+    def from_env(cls) -> "LocalEmbeddingProvider":
+        """環境変数から作成"""
+        seed = os.getenv('EMBEDDING_LOCAL_SEED')
+        return cls(
+            dimension=int(os.getenv('EMBEDDING_LOCAL_DIMENSION', '3072')),
+            latency_seconds=float(os.getenv('EMBEDDING_LOCAL_LATENCY_MS', '0')) / 1000,
+            latency_per_input_seconds=float(os.getenv('EMBEDDING_LOCAL_LATENCY_PER_INPUT_MS', '0')) / 1000,
+            error_rate=float(os.getenv('EMBEDDING_LOCAL_ERROR_RATE', '0')),
+            rate_limit_rate=float(os.getenv('EMBEDDING_LOCAL_RATE_LIMIT_RATE', '0')),
+            seed=int(seed) if seed else None
+        )
+
+    def vector(self, text: str, dimensions: Optional[int] = None) -> np.ndarray:
+        """
+        テキストのベクトル（同じテキストには常に同じベクトル）
+
+        Args:
+            text: テキスト
+            dimensions: 次元数（Noneの場合はモデルの次元数）
+
+        Returns:
+            正規化済みのfloat32ベクトル
+        """
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        tokens = tokenize(text) or [text]
+        hashes = np.array([zlib.crc32(token.encode('utf-8')) for token in tokens], dtype=np.uint64)
+        signs = np.where(hashes & np.uint64(1 << 31), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, (hashes % np.uint64(self.dimension)).astype(np.int64), signs)
+
+        vector = vector[:dimensions or self.dimension]
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            # 先頭の次元に語が割り当てられなかった場合もゼロベクトルにはしない
+            vector = vector.copy()
+            vector[zlib.crc32(text.encode('utf-8')) % len(vector)] = 1.0
+            return vector
+        return vector / norm
+
+    async def embed(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        self.calls += 1
+        self.inputs += len(texts)
+        delay = self.latency_seconds + self.latency_per_input_seconds * len(texts)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            raise SimulatedRateLimitError("Simulated rate limit")
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise SimulatedTransientError("Simulated transient error")
+
+        return [self.vector(text, dimensions).tolist() for text in texts]
+
+
+def get_embedding_provider() -> EmbeddingProviderBase:
+    """環境変数に基づいてエンベディングのバックエンドを取得"""
+    provider_type = os.getenv('EMBEDDING_PROVIDER', 'azure').lower()
+
+    if provider_type == 'openai':
+        return OpenAIEmbeddingProvider()
+    elif provider_type == 'local':
+        return LocalEmbeddingProvider.from_env()
+    else:
+        return AzureOpenAIEmbeddingProvider()
@@ -1,32 +1,36 @@
 """
 エンベディング（ベクトル化）サービス
 OpenAI text-embedding-3-largeを使用した文書のベクトル化と検索
+（エンベディングAPIは services.embedding_provider で Azure OpenAI / OpenAI / ローカルを切り替え）
 """
 
 import os
-import json
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Callable, Awaitable, Iterable, Union
 from dataclasses import dataclass
 import asyncio
+import random
 from datetime import datetime
-import hashlib
-
-# Azure OpenAI
-from openai import AsyncAzureOpenAI
+import heapq
+import itertools
 
 # ストレージサービス
 from services.storage_service import storage_service
 from services.kvm_service import kvm_service
-
-
-@dataclass
-class ChunkResult:
-    """チャンク化の結果"""
-    chunk_id: str
-    text: str
-    position: int
-    metadata: Dict[str, Any]
+from services.vector_index import LibraryVectorIndex
+from services.keyword_index import LibraryKeywordIndex, FileTerms
+from services.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from services.index_residency import IndexResidencyManager
+from services.search_filter import SearchFilter
+from services.chunker import ChunkResult, StreamingChunker, TextSegment
+from services.embedding_provider import get_embedding_provider
+from services import embedding_format
+from services import ann_index
+from services import quantization
+from services import keyword_index
+from services import search_filter
+from services import result_diversity
+from services import chunker
 
 
 @dataclass
@@ -38,6 +42,41 @@ class EmbeddingResult:
     metadata: Dict[str, Any]
 
 
+class AdaptiveConcurrencyLimiter:
+    """
+    429に応じて同時実行数を調整するリミッター（AIMD）
+    - レート制限を受けたら上限を半減
+    - 連続成功で上限を1ずつ回復
+    """
+    
+    def __init__(self, max_concurrency: int, recovery_successes: int = 5):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.recovery_successes = recovery_successes
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+    
+    async def acquire(self):
+        async with self._condition:
+            while self._in_flight >= self.limit:
+                await self._condition.wait()
+            self._in_flight += 1
+    
+    async def release(self, rate_limited: bool = False):
+        async with self._condition:
+            self._in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.recovery_successes and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
 @dataclass
 class SearchResult:
     """検索結果"""
@@ -46,6 +85,11 @@ class SearchResult:
     score: float
     filename: str
     metadata: Dict[str, Any]
+    vector_score: Optional[float] = None  # コサイン類似度（ベクトル側で候補になった場合）
+    keyword_score: Optional[float] = None  # BM25スコア（キーワード側で候補になった場合）
+    library_id: Optional[str] = None  # 複数ライブラリ検索時の検索元ライブラリ
+    uploaded_at: Optional[str] = None  # ファイルのアップロード日時
+    content_type: Optional[str] = None  # ファイルのコンテンツタイプ
 
 
 class EmbeddingService:
@@ -53,24 +97,78 @@ class EmbeddingService:
     エンベディングサービス
     - テキストのチャンク化
     - OpenAI APIでのベクトル化
-    - コサイン類似度による検索
+    - コサイン類似度による検索（ライブラリ単位のインメモリインデックス）
     """
     
     def __init__(self):
-        # Azure OpenAI エンベディング専用設定
-        self.client = AsyncAzureOpenAI(
-            api_key=os.getenv('AZURE_OPENAI_EMBEDDING_API_KEY'),
-            api_version=os.getenv('AZURE_OPENAI_EMBEDDING_API_VERSION', '2024-12-01-preview'),
-            azure_endpoint=os.getenv('AZURE_OPENAI_EMBEDDING_ENDPOINT')
-        )
+        # エンベディングのバックエンド（EMBEDDING_PROVIDER: azure / openai / local）
+        self.provider = get_embedding_provider()
         
         # エンベディングモデル設定
-        self.embedding_model = os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT', 'text-embedding-3-large-Trial')
-        self.embedding_dimension = 3072  # text-embedding-3-largeの次元数
+        self.embedding_model = self.provider.model
+        self.embedding_dimension = self.provider.dimension  # text-embedding-3-largeは3072（ライブラリごとに縮小可能）
+        self.storage_dtype = os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32')  # float32 / float16
+        
+        # チャンク設定（推定トークン数。日本語は約1文字/トークン）
+        self.max_input_tokens = int(os.getenv('EMBEDDING_MAX_INPUT_TOKENS', '8191'))  # モデルの入力上限
+        self.chunk_tokens = min(int(os.getenv('EMBEDDING_CHUNK_TOKENS', '1000')), self.max_input_tokens)
+        self.chunk_overlap_tokens = int(os.getenv('EMBEDDING_CHUNK_OVERLAP_TOKENS', '200'))  # 重複トークン数
         
-        # チャンク設定
-        self.chunk_size = 1000  # 文字数
-        self.chunk_overlap = 200  # 重複文字数
+        # バッチ設定（1リクエストに複数チャンクをまとめる）
+        self.batch_max_tokens = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', '32000'))  # 1リクエストあたりの推定トークン上限
+        self.batch_max_inputs = int(os.getenv('EMBEDDING_BATCH_MAX_INPUTS', '256'))  # 1リクエストあたりの最大入力数
+        self.max_retries = int(os.getenv('EMBEDDING_MAX_RETRIES', '5'))
+        self._limiter = AdaptiveConcurrencyLimiter(int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4')))
+        
+        # チャンクエンベディングのキャッシュ（変更のないチャンクはAPIを呼ばない）
+        self.cache_enabled = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+        self.cache = EmbeddingCache(max_entries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '5000')))
+        
+        # 検索クエリのエンベディングキャッシュ（UIからの同一クエリの繰り返しでAPIを呼ばない）
+        self.query_cache_enabled = os.getenv('EMBEDDING_QUERY_CACHE_ENABLED', 'true').lower() == 'true'
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=int(os.getenv('EMBEDDING_QUERY_CACHE_MAX_ENTRIES', '1000')),
+            ttl_seconds=float(os.getenv('EMBEDDING_QUERY_CACHE_TTL_SECONDS', '600'))
+        )
+        
+        # ストリーミング取り込み設定（メモリ使用量はキューの深さ × バッチサイズで決まる）
+        self.stream_queue_depth = int(os.getenv('EMBEDDING_STREAM_QUEUE_DEPTH', '4'))  # 待機できるバッチ数
+        self.stream_segment_chunks = int(os.getenv('EMBEDDING_STREAM_SEGMENT_CHUNKS', '512'))  # セグメントあたりのチャンク数
+        
+        # ANN（IVF）設定
+        self.ann_min_chunks = int(os.getenv('ANN_MIN_CHUNKS', '20000'))  # この件数以上で自動構築
+        self.ann_default_nprobe = int(os.getenv('ANN_DEFAULT_NPROBE', '8'))
+        
+        # 量子化設定（none / int8 / pq）と量子化時の再ランキング
+        self.quantization = os.getenv('EMBEDDING_QUANTIZATION', 'none').lower()
+        self.pq_subspaces = int(os.getenv('EMBEDDING_PQ_SUBSPACES', '96'))
+        self.rerank_factor = int(os.getenv('EMBEDDING_RERANK_FACTOR', '4'))  # 再ランキング候補数 = top_k × factor
+        self.rerank_max_gap_bytes = int(os.getenv('EMBEDDING_RERANK_MAX_GAP_BYTES', '262144'))  # この間隔以下の候補行は1回のレンジ読み込みにまとめる
+        
+        # ハイブリッド検索設定（BM25とコサイン類似度の順位をRRFで統合）
+        self.hybrid_candidates = int(os.getenv('HYBRID_SEARCH_CANDIDATES', '50'))  # 各検索で統合に使う候補数
+        self.rrf_k = int(os.getenv('HYBRID_SEARCH_RRF_K', '60'))
+        
+        # MMR設定（多様化する場合は top_k × factor 件の候補から選び直す）
+        self.mmr_candidate_factor = int(os.getenv('SEARCH_MMR_CANDIDATE_FACTOR', '4'))
+        
+        # 変更ログ・圧縮設定（ロード済みインデックスは変更ログから差分だけを反映）
+        self.index_refresh_seconds = float(os.getenv('EMBEDDING_INDEX_REFRESH_SECONDS', '5'))  # 変更ログの確認間隔
+        self.log_retention_seconds = float(os.getenv('EMBEDDING_LOG_RETENTION_SECONDS', '86400'))
+        self.compact_min_segments = int(os.getenv('EMBEDDING_COMPACT_MIN_SEGMENTS', '4'))  # これ以上のセグメントを持つファイルを圧縮
+        self.compact_max_chunks = int(os.getenv('EMBEDDING_COMPACT_MAX_CHUNKS', '50000'))  # 圧縮で一度に読み込む最大チャンク数
+        
+        # ライブラリ単位のインメモリインデックス（リクエスト間で保持し、メモリ予算内でLRU/LFU破棄）
+        self.residency = IndexResidencyManager(
+            budget_bytes=int(os.getenv('EMBEDDING_INDEX_MEMORY_BUDGET_BYTES', str(2 * 1024 ** 3))),
+            policy=os.getenv('EMBEDDING_INDEX_EVICTION_POLICY', 'lru').lower()  # lru / lfu
+        )
+        self.residency.on_evict = self._on_index_evicted
+        self.prewarm_count = int(os.getenv('EMBEDDING_INDEX_PREWARM_COUNT', '10'))  # 起動時に事前ロードするライブラリ数
+        self.stats_flush_seconds = float(os.getenv('EMBEDDING_INDEX_STATS_FLUSH_SECONDS', '60'))
+        self._residency_tasks: List[asyncio.Task] = []
+        self._log_states: Dict[Tuple[str, str], Dict[str, Any]] = {}  # 変更ログの既読エントリと確認時刻
+        self._own_log_entries: Dict[str, float] = {}  # このプロセスが書いたエントリ -> 書き込み時刻
     
     def create_chunks(self, text: str, filename: str) -> List[ChunkResult]:
         """
@@ -83,47 +181,7 @@ class EmbeddingService:
         Returns:
             チャンクのリスト
         """
-        chunks = []
-        text_length = len(text)
-        position = 0
-        chunk_index = 0
-        
-        while position < text_length:
-            # チャンクの終了位置を計算
-            end_position = min(position + self.chunk_size, text_length)
-            
-            # 文の途中で切れないように調整（句読点で区切る）
-            if end_position < text_length:
-                # 句読点を探す
-                for punct in ['。', '．', '！', '？', '\n\n', '\n']:
-                    last_punct = text.rfind(punct, position, end_position)
-                    if last_punct != -1:
-                        end_position = last_punct + len(punct)
-                        break
-            
-            # チャンクを作成
-            chunk_text = text[position:end_position].strip()
-            if chunk_text:  # 空のチャンクは無視
-                chunk_id = hashlib.md5(f"{filename}_{chunk_index}_{chunk_text[:50]}".encode()).hexdigest()[:12]
-                
-                chunks.append(ChunkResult(
-                    chunk_id=chunk_id,
-                    text=chunk_text,
-                    position=chunk_index,
-                    metadata={
-                        "filename": filename,
-                        "start_position": position,
-                        "end_position": end_position,
-                        "chunk_index": chunk_index,
-                        "total_chunks": 0  # 後で更新
-                    }
-                ))
-                chunk_index += 1
-            
-            # 次の開始位置（オーバーラップを考慮）
-            position = end_position - self.chunk_overlap
-            if position <= 0:
-                position = end_position
+        chunks = list(chunker.iter_chunks(text, filename, self.chunk_tokens, self.chunk_overlap_tokens))
         
         # 総チャンク数を更新
         for chunk in chunks:
@@ -131,66 +189,234 @@ class EmbeddingService:
         
         return chunks
     
-    async def create_embedding(self, text: str) -> List[float]:
+    def resolve_dimension(self, dimension: Optional[int] = None) -> int:
+        """
+        ライブラリ設定の次元数を検証（未設定の場合はモデルの次元数）
+        
+        Args:
+            dimension: ライブラリに設定された次元数
+            
+        Returns:
+            使用する次元数
+        """
+        if not dimension:
+            return self.embedding_dimension
+        if dimension < 1 or dimension > self.embedding_dimension:
+            raise ValueError(f"embedding_dimension must be between 1 and {self.embedding_dimension}")
+        return int(dimension)
+    
+    def _dimension_params(self, dimension: Optional[int]) -> Dict[str, Any]:
+        """text-embedding-3のdimensionsパラメータ（モデルの次元数と同じ場合は省略）"""
+        dimension = self.resolve_dimension(dimension)
+        if dimension == self.embedding_dimension:
+            return {}
+        return {"dimensions": dimension}
+    
+    async def create_embedding(self, text: str, dimension: Optional[int] = None) -> List[float]:
         """
         テキストのエンベディングを作成
         
         Args:
             text: エンベディングするテキスト
+            dimension: 次元数（Noneの場合はモデルの次元数）
             
         Returns:
             エンベディングベクトル
         """
         try:
-            # Azure OpenAI エンベディングAPIを呼び出し
-            response = await self.client.embeddings.create(
-                model=self.embedding_model,  # デプロイメント名を使用
-                input=text
-            )
-            
-            # エンベディングを取得
-            embedding = response.data[0].embedding
-            return embedding
+            embeddings = await self.provider.embed([text], **self._dimension_params(dimension))
+            return embeddings[0]
             
         except Exception as e:
             print(f"[ERROR] Failed to create embedding: {str(e)}")
             raise
     
-    async def embed_chunks(self, chunks: List[ChunkResult]) -> List[EmbeddingResult]:
+    async def embed_query(
+        self,
+        query: str,
+        dimension: Optional[int] = None,
+        tenant_id: str = "default_tenant"
+    ) -> List[float]:
         """
-        チャンクのリストをエンベディング
+        検索クエリのエンベディングを作成（クエリキャッシュを使用）
         
         Args:
-            chunks: チャンクのリスト
+            query: 検索クエリ
+            dimension: 次元数（Noneの場合はモデルの次元数）
+            tenant_id: テナントID
+            
+        Returns:
+            エンベディングベクトル
+        """
+        if not self.query_cache_enabled:
+            return await self.create_embedding(query, dimension)
+        return await self.query_cache.get_or_create(
+            query,
+            self.embedding_model,
+            self.resolve_dimension(dimension),
+            lambda: self.create_embedding(query, dimension),
+            tenant_id
+        )
+    
+    async def create_embeddings(
+        self,
+        texts: List[str],
+        dimension: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        複数テキストのエンベディングを1リクエストで作成
+        
+        Args:
+            texts: エンベディングするテキストのリスト
+            dimension: 次元数（Noneの場合はモデルの次元数）
             
         Returns:
-            エンベディング結果のリスト
+            入力と同じ順序のエンベディングベクトルのリスト
         """
-        results = []
+        return await self.provider.embed(texts, **self._dimension_params(dimension))
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """トークン数を概算（chunker.estimate_tokens と同じ）"""
+        return chunker.estimate_tokens(text)
+    
+    def _make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        トークン予算と入力数上限に収まるようにテキストをバッチに分割
         
-        # バッチ処理（並列化）
-        batch_size = 5  # 同時に処理するチャンク数
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
+        Args:
+            texts: テキストのリスト
             
-            # 並列でエンベディングを作成
-            embedding_tasks = [
-                self.create_embedding(chunk.text)
-                for chunk in batch
-            ]
+        Returns:
+            各バッチに含まれる入力インデックスのリスト
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+        
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if current and (
+                current_tokens + tokens > self.batch_max_tokens
+                or len(current) >= self.batch_max_inputs
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_batch_with_retry(
+        self,
+        texts: List[str],
+        dimension: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        バッチをエンベディング（429・一時的エラーは上限付きでリトライ）
+        
+        Args:
+            texts: バッチ内のテキスト
+            dimension: 次元数
             
-            embeddings = await asyncio.gather(*embedding_tasks)
+        Returns:
+            エンベディングベクトルのリスト
+        """
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            try:
+                embeddings = await self.create_embeddings(texts, dimension)
+            except self.provider.transient_errors as e:
+                await self._limiter.release(rate_limited=isinstance(e, self.provider.rate_limit_errors))
+                attempt += 1
+                if attempt > self.max_retries:
+                    print(f"[ERROR] Embedding batch failed after {self.max_retries} retries: {str(e)}")
+                    raise
+                
+                # Retry-Afterヘッダーがあれば優先、なければ指数バックオフ
+                delay = min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+                response = getattr(e, 'response', None)
+                retry_after = response.headers.get('retry-after') if response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                
+                print(f"[WARN] Embedding batch retry {attempt}/{self.max_retries} in {delay:.1f}s "
+                      f"(concurrency={self._limiter.limit}): {type(e).__name__}")
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                await self._limiter.release()
+                raise
             
-            # 結果を格納
-            for chunk, embedding in zip(batch, embeddings):
-                results.append(EmbeddingResult(
-                    chunk_id=chunk.chunk_id,
-                    embedding=embedding,
-                    text=chunk.text,
-                    metadata=chunk.metadata
-                ))
+            await self._limiter.release()
+            return embeddings
+    
+    async def embed_chunks(
+        self,
+        chunks: List[ChunkResult],
+        tenant_id: str = "default_tenant",
+        dimension: Optional[int] = None
+    ) -> List[EmbeddingResult]:
+        """
+        チャンクのリストをエンベディング
         
-        return results
+        Args:
+            chunks: チャンクのリスト
+            tenant_id: テナントID（キャッシュの永続化先）
+            dimension: 次元数（Noneの場合はモデルの次元数）
+            
+        Returns:
+            エンベディング結果のリスト（入力と同じ順序）
+        """
+        texts = [chunk.text for chunk in chunks]
+        dimension = self.resolve_dimension(dimension)
+        
+        # キャッシュ済みのチャンクはAPIを呼ばない
+        if self.cache_enabled:
+            embeddings = await self.cache.get_many(
+                texts, self.embedding_model, dimension, tenant_id
+            )
+        else:
+            embeddings = [None] * len(chunks)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        # トークン予算でまとめたバッチを並列処理（同時実行数はリミッターが調整）
+        async def process_batch(batch: List[int]):
+            indices = [missing[j] for j in batch]
+            vectors = await self._embed_batch_with_retry([texts[i] for i in indices], dimension)
+            for i, vector in zip(indices, vectors):
+                embeddings[i] = vector
+        
+        batches = self._make_batches([texts[i] for i in missing])
+        await asyncio.gather(*(process_batch(batch) for batch in batches))
+        print(f"[INFO] Embedded {len(missing)}/{len(chunks)} chunks in {len(batches)} requests "
+              f"({len(chunks) - len(missing)} cached)")
+        
+        if self.cache_enabled and missing:
+            await self.cache.put_many(
+                [texts[i] for i in missing],
+                [embeddings[i] for i in missing],
+                self.embedding_model,
+                dimension,
+                tenant_id
+            )
+        
+        return [
+            EmbeddingResult(
+                chunk_id=chunk.chunk_id,
+                embedding=embedding,
+                text=chunk.text,
+                metadata=chunk.metadata
+            )
+            for chunk, embedding in zip(chunks, embeddings)
+        ]
     
     async def save_embeddings(
         self,
@@ -201,7 +427,7 @@ class EmbeddingService:
         user_id: str = "default_user"
     ) -> Dict[str, Any]:
         """
-        エンベディングをストレージに保存
+        エンベディングを不変のセグメントとして保存し、ファイルのマニフェストを置き換え
         
         Args:
             library_id: ライブラリID
@@ -213,178 +439,1742 @@ class EmbeddingService:
         Returns:
             保存結果
         """
-        # エンベディングデータを準備
-        embedding_data = {
-            "filename": filename,
-            "embedding_model": self.embedding_model,
-            "embedding_dimension": self.embedding_dimension,
-            "chunk_count": len(embeddings),
-            "created_at": datetime.utcnow().isoformat(),
-            "chunks": [
-                {
-                    "chunk_id": emb.chunk_id,
-                    "text": emb.text,
-                    "embedding": emb.embedding,
-                    "metadata": emb.metadata
-                }
-                for emb in embeddings
-            ]
-        }
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        generation = embedding_format.new_generation()
+        created_at = datetime.utcnow().isoformat()
+        dimension = len(embeddings[0].embedding) if embeddings else self.embedding_dimension
         
-        # JSONとして保存
-        storage_key = f"{tenant_id}/library/{library_id}/embeddings/{filename}.json"
-        content = json.dumps(embedding_data, ensure_ascii=False, indent=2)
+        segments = []
+        loaded = None
+        if embeddings:
+            segment, vectors, terms = await self._write_segment(
+                prefix, embedding_format.segment_name(filename, generation, 0), filename, embeddings, created_at
+            )
+            segments.append(segment)
+            loaded = (embeddings, vectors, terms)
         
-        await storage_service.put_object(
-            key=storage_key,
-            content=content,
-            metadata={
-                "library_id": library_id,
-                "filename": filename,
-                "chunk_count": str(len(embeddings))
-            }
+        await self._commit_file(
+            library_id, filename, generation, segments, dimension, created_at,
+            tenant_id=tenant_id, user_id=user_id, loaded=loaded
         )
         
-        # KVMのファイル情報を更新
-        pk = f"TENANT#{tenant_id}#USER#{user_id}"
-        sk = f"LIBRARY#{library_id}#FILE#{filename}"
-        
-        await kvm_service.update_item(pk, sk, {
-            "embedding_status": "completed",
-            "chunk_count": len(embeddings),
-            "embedded_at": datetime.utcnow().isoformat()
-        })
+        # IVFが未ロードでも永続化済みなら新しいファイルの割り当てを追加
+        if embeddings and self.residency.peek("vector", (tenant_id, library_id)) is None:
+            stored = await self._load_ivf(library_id, tenant_id)
+            if stored is not None and stored[0].shape[1] == dimension:
+                centroids, assignments_by_file = stored
+                assignments_by_file[filename] = ann_index.assign_lists(
+                    LibraryVectorIndex.normalize(loaded[1]), centroids
+                )
+                await self._save_ivf(library_id, tenant_id, centroids, assignments_by_file)
         
         return {
             "success": True,
             "chunk_count": len(embeddings),
-            "storage_key": storage_key
+            "storage_key": embedding_format.meta_key(prefix, filename)
         }
     
-    async def load_embeddings(
+    async def process_file_stream(
         self,
         library_id: str,
-        tenant_id: str = "default_tenant"
-    ) -> Dict[str, List[EmbeddingResult]]:
+        filename: str,
+        parts: AsyncIterator[Union[str, TextSegment]],
+        tenant_id: str = "default_tenant",
+        user_id: str = "default_user",
+        dimension: Optional[int] = None,
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
         """
-        ライブラリの全エンベディングを読み込み
+        テキスト断片を逐次チャンク化・エンベディングし、セグメント単位で保存
+        抽出 → チャンク化 → エンベディング → 保存 を有界キューでつなぐため、
+        メモリ使用量はファイルサイズではなくキューの深さで決まる
         
         Args:
             library_id: ライブラリID
+            filename: ファイル名
+            parts: テキスト断片（document_extractor.iter_segments など。TextSegmentの場合は
+                ページ・スライド等の境界をまたがずにチャンク化し、位置をmetadataに記録する）
             tenant_id: テナントID
+            user_id: ユーザーID
+            dimension: ライブラリの次元数（Noneの場合はモデルの次元数）
+            progress: セグメント保存ごとに (保存済みチャンク数, セグメント数) で呼ばれるコールバック
             
         Returns:
-            ファイル名をキーとしたエンベディングの辞書
+            処理結果
         """
-        embeddings_by_file = {}
+        dimension = self.resolve_dimension(dimension)
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        generation = embedding_format.new_generation()
+        created_at = datetime.utcnow().isoformat()
+        segments: List[Dict[str, Any]] = []
         
-        # エンベディングファイルのリストを取得
-        prefix = f"{tenant_id}/library/{library_id}/embeddings/"
-        result = await storage_service.list_objects(prefix=prefix)
+        # エンベディング中のバッチ（タスク）を順番に保持する有界キュー
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.stream_queue_depth)
+        
+        async def produce():
+            text_chunker = StreamingChunker(filename, self.chunk_tokens, self.chunk_overlap_tokens)
+            batch: List[ChunkResult] = []
+            batch_tokens = 0
+            
+            async def put_batch():
+                nonlocal batch, batch_tokens
+                task = asyncio.ensure_future(self.embed_chunks(batch, tenant_id, dimension))
+                try:
+                    # キューが満杯なら抽出側が待つ（バックプレッシャー）
+                    await queue.put(task)
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                batch = []
+                batch_tokens = 0
+            
+            async def add_chunks(chunks: Iterable[ChunkResult]):
+                nonlocal batch_tokens
+                for chunk in chunks:
+                    tokens = self.estimate_tokens(chunk.text)
+                    if batch and (
+                        batch_tokens + tokens > self.batch_max_tokens
+                        or len(batch) >= self.batch_max_inputs
+                    ):
+                        await put_batch()
+                    batch.append(chunk)
+                    batch_tokens += tokens
+            
+            try:
+                async for part in parts:
+                    if isinstance(part, TextSegment):
+                        await add_chunks(text_chunker.feed_segment(part))
+                    else:
+                        await add_chunks(text_chunker.feed(part))
+                await add_chunks(text_chunker.finish())
+                if batch:
+                    await put_batch()
+            finally:
+                # 終端（抽出に失敗した場合も受信側を止める）
+                await queue.put(None)
         
-        if result.get('success') and result.get('objects'):
-            for obj in result['objects']:
-                key = obj['key']
-                if key.endswith('.json'):
-                    # エンベディングデータを読み込み
-                    content = await storage_service.get_object(key)
-                    if content:
-                        data = json.loads(content)
-                        filename = data['filename']
-                        
-                        # EmbeddingResultオブジェクトに変換
-                        embeddings = []
-                        for chunk in data['chunks']:
-                            embeddings.append(EmbeddingResult(
-                                chunk_id=chunk['chunk_id'],
-                                embedding=chunk['embedding'],
-                                text=chunk['text'],
-                                metadata=chunk['metadata']
-                            ))
-                        
-                        embeddings_by_file[filename] = embeddings
+        async def flush(pending: List[EmbeddingResult]):
+            name = embedding_format.segment_name(filename, generation, len(segments))
+            segment, _, _ = await self._write_segment(prefix, name, filename, pending, created_at)
+            segments.append(segment)
+            if progress is not None:
+                await progress(sum(segment['chunk_count'] for segment in segments), len(segments))
         
-        return embeddings_by_file
+        producer = asyncio.ensure_future(produce())
+        try:
+            # エンベディング済みのバッチを投入順に受け取り、一定件数ごとにセグメントとして保存
+            pending: List[EmbeddingResult] = []
+            while True:
+                task = await queue.get()
+                if task is None:
+                    break
+                pending.extend(await task)
+                if len(pending) >= self.stream_segment_chunks:
+                    await flush(pending)
+                    pending = []
+            await producer
+            if pending:
+                await flush(pending)
+            
+            chunk_count = sum(segment['chunk_count'] for segment in segments)
+            if chunk_count == 0:
+                return {"success": False, "chunk_count": 0, "reason": "No text extracted"}
+            
+            # マニフェストの保存をもって取り込み完了（それまでは前の世代が読まれる）
+            await self._commit_file(
+                library_id, filename, generation, segments, dimension, created_at,
+                tenant_id=tenant_id, user_id=user_id
+            )
+        except BaseException as e:
+            producer.cancel()
+            while not queue.empty():
+                task = queue.get_nowait()
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            # マニフェストの切り替え前に失敗した場合のみ、この世代のセグメントを削除
+            current = await storage_service.get_object(embedding_format.meta_key(prefix, filename))
+            if not current or embedding_format.decode_meta(current).get('generation') != generation:
+                await self._delete_segments(prefix, filename, generation=generation)
+            
+            if isinstance(e, Exception):
+                print(f"[ERROR] Failed to stream file {filename}: {str(e)}")
+                pk = f"TENANT#{tenant_id}#USER#{user_id}"
+                sk = f"LIBRARY#{library_id}#FILE#{filename}"
+                await kvm_service.update_item(pk, sk, {
+                    "embedding_status": "failed",
+                    "embedding_error": str(e),
+                    "updated_at": datetime.utcnow().isoformat()
+                })
+            raise
+        
+        print(f"[INFO] Streamed {chunk_count} chunks for {filename} in {len(segments)} segments")
+        return {
+            "success": True,
+            "chunk_count": chunk_count,
+            "segment_count": len(segments),
+            "storage_key": embedding_format.meta_key(prefix, filename)
+        }
     
-    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
+    async def _write_segment(
+        self,
+        prefix: str,
+        name: str,
+        filename: str,
+        embeddings: List[EmbeddingResult],
+        created_at: str
+    ) -> Tuple[Dict[str, Any], np.ndarray, FileTerms]:
         """
-        コサイン類似度を計算
+        セグメント（ベクトル行列・転置リスト・サイドカー）を1つ保存
         
         Args:
-            vec1: ベクトル1
-            vec2: ベクトル2
+            prefix: エンベディング保存先のプレフィックス
+            name: セグメント名
+            filename: ファイル名
+            embeddings: セグメントに含めるエンベディング結果
+            created_at: 作成日時
             
         Returns:
-            コサイン類似度（-1～1）
+            (マニフェストに載せるセグメント情報, float32のベクトル行列, 転置リスト)
         """
-        vec1 = np.array(vec1)
-        vec2 = np.array(vec2)
+        vectors = np.array([emb.embedding for emb in embeddings], dtype=np.float32)
+        texts = [emb.text for emb in embeddings]
+        matrix_bytes, meta_content = embedding_format.encode_embeddings(
+            filename=filename,
+            chunk_ids=[emb.chunk_id for emb in embeddings],
+            texts=texts,
+            metadatas=[emb.metadata for emb in embeddings],
+            vectors=vectors,
+            embedding_model=self.embedding_model,
+            created_at=created_at,
+            dtype=self.storage_dtype
+        )
         
-        # ゼロベクトルのチェック
-        if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
-            return 0.0
+        # キーワード検索用の転置リスト（トークン化はCPU負荷が高いためスレッドで実行）
+        loop = asyncio.get_event_loop()
+        terms = await loop.run_in_executor(None, FileTerms.from_texts, texts)
         
-        # コサイン類似度を計算
-        similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-        return float(similarity)
+        # 行列・転置リストを先に保存し、サイドカーの存在をもってセグメントの完成とする
+        await storage_service.put_object(
+            key=embedding_format.matrix_key(prefix, name),
+            content=matrix_bytes,
+            content_type="application/octet-stream"
+        )
+        await storage_service.put_object(
+            key=keyword_index.terms_key(prefix, name),
+            content=terms.encode(),
+            content_type="application/octet-stream"
+        )
+        await storage_service.put_object(
+            key=embedding_format.meta_key(prefix, name),
+            content=meta_content,
+            content_type="application/json"
+        )
+        layout = embedding_format.matrix_layout(matrix_bytes, len(embeddings), vectors.shape[1], self.storage_dtype)
+        segment = {
+            "name": name,
+            "chunk_count": len(embeddings),
+            "data_offset": layout['data_offset'],
+            "bytes": len(matrix_bytes) + len(meta_content.encode('utf-8'))
+        }
+        return segment, vectors, terms
     
-    async def search(
+    async def _commit_file(
+        self,
+        library_id: str,
+        filename: str,
+        generation: str,
+        segments: List[Dict[str, Any]],
+        dimension: int,
+        created_at: str,
+        tenant_id: str = "default_tenant",
+        user_id: Optional[str] = "default_user",
+        loaded: Optional[Tuple[List[EmbeddingResult], np.ndarray, FileTerms]] = None,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        """
+        保存済みセグメントのマニフェストを書いてファイルの世代を切り替え
+        前の世代を削除し、変更ログ・KVM・ロード済みインデックスに反映する
+        
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            generation: 新しい世代ID
+            segments: セグメント情報（_write_segment の戻り値、行順）
+            dimension: ベクトル次元数
+            created_at: 作成日時
+            tenant_id: テナントID
+            user_id: ユーザーID（NoneならKVMを更新しない）
+            loaded: 1セグメント分の (エンベディング結果, 行列, 転置リスト)（インデックス反映時の再読み込みを省略）
+            attributes: ファイル属性（省略時はKVMのファイル情報、user_idがNoneなら現在のマニフェストから引き継ぐ）
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        if attributes is None:
+            attributes = await self._file_attributes(library_id, filename, tenant_id, user_id)
+        manifest_content = embedding_format.encode_manifest(
+            filename=filename,
+            generation=generation,
+            segments=segments,
+            embedding_model=self.embedding_model,
+            dimension=dimension,
+            dtype=self.storage_dtype,
+            created_at=created_at,
+            attributes=attributes
+        )
+        await storage_service.put_object(
+            key=embedding_format.meta_key(prefix, filename),
+            content=manifest_content,
+            metadata={
+                "library_id": library_id,
+                "filename": filename
+            },
+            content_type="application/json"
+        )
+        
+        # 前の世代（単一行列・旧形式・古いセグメント）を削除
+        await storage_service.delete_object(embedding_format.matrix_key(prefix, filename))
+        await storage_service.delete_object(embedding_format.legacy_key(prefix, filename))
+        await storage_service.delete_object(keyword_index.terms_key(prefix, filename))
+        await self._delete_segments(prefix, filename, keep_generation=generation)
+        await self._append_log(library_id, tenant_id, "put", filename, generation)
+        
+        chunk_count = sum(segment['chunk_count'] for segment in segments)
+        if user_id is not None:
+            pk = f"TENANT#{tenant_id}#USER#{user_id}"
+            sk = f"LIBRARY#{library_id}#FILE#{filename}"
+            await kvm_service.update_item(pk, sk, {
+                "embedding_status": "completed",
+                "chunk_count": chunk_count,
+                "embedded_at": datetime.utcnow().isoformat()
+            })
+        
+        # ロード済みのインデックスには確定したファイルのみ反映
+        manifest = embedding_format.decode_meta(manifest_content)
+        if loaded is not None:
+            embeddings, vectors, terms = loaded
+            meta = embedding_format.merge_segments(manifest, [(
+                {"chunks": [
+                    {"chunk_id": emb.chunk_id, "text": emb.text, "metadata": emb.metadata}
+                    for emb in embeddings
+                ]},
+                vectors
+            )])
+            await self._sync_file(library_id, tenant_id, filename, manifest, (meta[0], vectors, terms))
+        else:
+            await self._sync_file(library_id, tenant_id, filename, manifest)
+    
+    async def _file_attributes(
+        self,
+        library_id: str,
+        filename: str,
+        tenant_id: str,
+        user_id: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """検索フィルタ用のファイル属性を取得（KVMのファイル情報、無ければ現在のマニフェスト）"""
+        if user_id is not None:
+            item = await kvm_service.get_item(
+                f"TENANT#{tenant_id}#USER#{user_id}", f"LIBRARY#{library_id}#FILE#{filename}"
+            )
+            if item:
+                return search_filter.file_attributes(item)
+        
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        content = await storage_service.get_object(embedding_format.meta_key(prefix, filename))
+        if not content:
+            return None
+        return embedding_format.decode_meta(content).get('attributes')
+    
+    async def _sync_file(
+        self,
+        library_id: str,
+        tenant_id: str,
+        filename: str,
+        meta: Optional[Dict[str, Any]],
+        loaded: Optional[Tuple[Dict[str, Any], np.ndarray, FileTerms]] = None
+    ):
+        """
+        ロード済みインデックスにファイル1件分の変更だけを反映（ライブラリ全体は読み直さない）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            filename: ファイル名
+            meta: 現在のサイドカーまたはマニフェスト（Noneの場合は削除）
+            loaded: 読み込み済みの (サイドカー互換の辞書, 行列, 転置リスト)
+        """
+        key = (tenant_id, library_id)
+        index = self.residency.peek("vector", key)
+        keywords = self.residency.peek("keyword", key)
+        if meta is None:
+            if index is not None:
+                index.remove_file(filename)
+            if keywords is not None:
+                keywords.remove_file(filename)
+            return
+        if index is None and keywords is None:
+            return
+        
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        if keywords is not None:
+            if loaded is not None:
+                chunks = loaded[0]['chunks']
+                keywords.add_file(
+                    filename,
+                    [chunk['chunk_id'] for chunk in chunks],
+                    [chunk['text'] for chunk in chunks],
+                    [chunk['metadata'] for chunk in chunks],
+                    loaded[2]
+                )
+            else:
+                loaded_terms = await self._load_keyword_file(prefix, meta)
+                if loaded_terms is None:
+                    self.residency.discard("keyword", key)
+                else:
+                    keywords.add_file(filename, *loaded_terms)
+            keywords.set_file_attributes(filename, meta.get('attributes') or {})
+        
+        if index is not None:
+            file_data = loaded[:2] if loaded is not None else await self._load_file(prefix, meta)
+            if file_data is None:
+                self.drop_library_index(library_id, tenant_id)
+                return
+            file_meta, matrix = file_data
+            if len(matrix) and matrix.shape[1] < index.dimension:
+                # 次元数が足りない場合はロード時の判定（スキップ）に任せる
+                self.drop_library_index(library_id, tenant_id)
+                return
+            index.add_file(
+                filename,
+                [chunk['chunk_id'] for chunk in file_meta['chunks']],
+                [chunk['text'] for chunk in file_meta['chunks']],
+                [chunk['metadata'] for chunk in file_meta['chunks']],
+                matrix[:, :index.dimension]
+            )
+            layout = embedding_format.layout_from_meta(meta)
+            if layout:
+                index.file_layouts[filename] = layout
+            index.set_file_attributes(filename, meta.get('attributes') or {})
+            await self._refresh_ann(library_id, tenant_id, index)
+        
+        # 差分でサイズが変わったため予算を再確認
+        self.residency.refresh_size("vector", key)
+        self.residency.refresh_size("keyword", key)
+    
+    async def _append_log(
+        self,
+        library_id: str,
+        tenant_id: str,
+        op: str,
+        filename: str,
+        generation: Optional[str] = None
+    ):
+        """変更ログにエントリを追加（このプロセスで反映済みのものとして記録）"""
+        name = embedding_format.log_entry_name()
+        await storage_service.put_object(
+            key=f"{self._embeddings_prefix(library_id, tenant_id)}{embedding_format.LOG_PREFIX}{name}",
+            content=embedding_format.encode_log_entry(op, filename, generation),
+            content_type="application/json"
+        )
+        now = datetime.utcnow().timestamp()
+        self._own_log_entries[name] = now
+        for entry, written_at in list(self._own_log_entries.items()):
+            if now - written_at > self.log_retention_seconds:
+                del self._own_log_entries[entry]
+    
+    async def _list_log(self, library_id: str, tenant_id: str) -> List[str]:
+        """変更ログのエントリ名を古い順に取得"""
+        prefix = f"{self._embeddings_prefix(library_id, tenant_id)}{embedding_format.LOG_PREFIX}"
+        result = await storage_service.list_objects(prefix=prefix)
+        return sorted(
+            obj['key'][len(prefix):] for obj in result.get('objects', [])
+            if obj['key'].endswith(embedding_format.LOG_SUFFIX)
+        )
+    
+    async def _start_log_tracking(self, library_id: str, tenant_id: str):
+        """インデックスのロード前に変更ログの既読位置を記録（ロード後の変更を差分で反映するため）"""
+        key = (tenant_id, library_id)
+        if key in self._log_states:
+            return
+        self._log_states[key] = {
+            "seen": set(await self._list_log(library_id, tenant_id)),
+            "checked_at": datetime.utcnow().timestamp()
+        }
+    
+    async def _refresh_indexes(self, library_id: str, tenant_id: str):
+        """
+        変更ログを確認し、他のプロセスで追加・削除されたファイルだけをロード済みインデックスに反映
+        （確認はindex_refresh_seconds間隔。ログの保持期間を過ぎた場合は全体を読み直す）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+        """
+        key = (tenant_id, library_id)
+        state = self._log_states.get(key)
+        if state is None:
+            return
+        now = datetime.utcnow().timestamp()
+        if now - state['checked_at'] < self.index_refresh_seconds:
+            return
+        if now - state['checked_at'] > self.log_retention_seconds:
+            self.drop_library_index(library_id, tenant_id)
+            return
+        state['checked_at'] = now
+        
+        entries = await self._list_log(library_id, tenant_id)
+        new_entries = [name for name in entries if name not in state['seen']]
+        state['seen'] = set(entries)
+        if not new_entries:
+            return
+        
+        # ファイルごとに最後のエントリだけを見て、現在のストレージの状態に合わせる
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        latest: Dict[str, str] = {}
+        for name in new_entries:
+            content = await storage_service.get_object(f"{prefix}{embedding_format.LOG_PREFIX}{name}")
+            if content:
+                latest[embedding_format.decode_log_entry(content)['filename']] = name
+        
+        applied = 0
+        for filename, name in latest.items():
+            if name in self._own_log_entries:
+                continue  # このプロセスで書き込み時に反映済み
+            meta_content = await storage_service.get_object(embedding_format.meta_key(prefix, filename))
+            meta = embedding_format.decode_meta(meta_content) if meta_content else None
+            await self._sync_file(library_id, tenant_id, filename, meta)
+            applied += 1
+        if applied:
+            print(f"[INFO] Applied {applied} file changes from the change log to {library_id}")
+    
+    def _embeddings_prefix(self, library_id: str, tenant_id: str) -> str:
+        """エンベディング保存先のプレフィックス"""
+        return f"{tenant_id}/library/{library_id}/embeddings/"
+    
+    async def _load_segments(
+        self,
+        prefix: str,
+        manifest: Dict[str, Any]
+    ) -> Optional[Tuple[Dict[str, Any], np.ndarray]]:
+        """マニフェストのセグメントを読み込んで1ファイル分にまとめる（欠けている場合はNone）"""
+        parts = []
+        for segment in manifest['segments']:
+            meta_content = await storage_service.get_object(
+                embedding_format.meta_key(prefix, segment['name'])
+            )
+            matrix_bytes = await storage_service.get_object(
+                embedding_format.matrix_key(prefix, segment['name']), return_bytes=True
+            )
+            if not meta_content or not matrix_bytes:
+                print(f"[WARN] Missing segment {segment['name']}")
+                return None
+            parts.append(embedding_format.decode_embeddings(matrix_bytes, meta_content))
+        return embedding_format.merge_segments(manifest, parts)
+    
+    async def _load_file(
+        self,
+        prefix: str,
+        meta: Dict[str, Any]
+    ) -> Optional[Tuple[Dict[str, Any], np.ndarray]]:
+        """サイドカーまたはマニフェストから1ファイル分の行列を読み込み（欠けている場合はNone）"""
+        if embedding_format.is_manifest(meta):
+            return await self._load_segments(prefix, meta)
+        matrix_bytes = await storage_service.get_object(
+            embedding_format.matrix_key(prefix, meta['filename']), return_bytes=True
+        )
+        if not matrix_bytes:
+            return None
+        return meta, embedding_format.decode_matrix(matrix_bytes)
+    
+    async def _delete_segments(
+        self,
+        prefix: str,
+        filename: str,
+        generation: Optional[str] = None,
+        keep_generation: Optional[str] = None
+    ):
+        """
+        ストリーミング取り込みのセグメントを削除
+        
+        Args:
+            prefix: エンベディング保存先のプレフィックス
+            filename: ファイル名
+            generation: 削除する世代（Noneの場合は全世代）
+            keep_generation: 残す世代
+        """
+        result = await storage_service.list_objects(prefix=f"{prefix}{filename}.")
+        for obj in result.get('objects', []):
+            name = obj['key'][len(prefix):]
+            for suffix in (embedding_format.META_SUFFIX, embedding_format.MATRIX_SUFFIX, keyword_index.TERMS_SUFFIX):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+                    break
+            else:
+                continue
+            parsed = embedding_format.parse_segment_name(name)
+            if parsed is None or parsed[0] != filename:
+                continue
+            if (generation is None or parsed[1] == generation) and parsed[1] != keep_generation:
+                await storage_service.delete_object(obj['key'])
+    
+    async def _load_embedding_files(
         self,
         library_id: str,
-        query: str,
-        top_k: int = 10,
-        threshold: float = 0.7,
         tenant_id: str = "default_tenant"
-    ) -> List[SearchResult]:
+    ) -> Dict[str, Tuple[Dict[str, Any], np.ndarray]]:
         """
-        ライブラリ内をベクトル検索
+        ライブラリの全エンベディングをファイル単位で読み込み（新旧形式の両方に対応）
         
         Args:
             library_id: ライブラリID
-            query: 検索クエリ
-            top_k: 返す結果の最大数
-            threshold: 類似度の閾値
             tenant_id: テナントID
             
         Returns:
-            検索結果のリスト
+            ファイル名 -> (サイドカーの辞書, float32のベクトル行列)
         """
-        # クエリのエンベディングを作成
-        query_embedding = await self.create_embedding(query)
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        result = await storage_service.list_objects(prefix=prefix)
+        if not result.get('success') or not result.get('objects'):
+            return {}
         
-        # ライブラリの全エンベディングを読み込み
-        embeddings_by_file = await self.load_embeddings(library_id, tenant_id)
+        keys = {obj['key'] for obj in result['objects']}
+        files = {}
         
-        # 全チャンクとの類似度を計算
-        results = []
-        for filename, embeddings in embeddings_by_file.items():
-            for emb in embeddings:
-                # コサイン類似度を計算
-                similarity = self.cosine_similarity(query_embedding, emb.embedding)
-                
-                # 閾値以上の場合は結果に追加
-                if similarity >= threshold:
-                    results.append(SearchResult(
-                        chunk_id=emb.chunk_id,
-                        text=emb.text,
-                        score=similarity,
-                        filename=filename,
-                        metadata=emb.metadata
-                    ))
-        
-        # スコアでソート（降順）
-        results.sort(key=lambda x: x.score, reverse=True)
-        
-        # top_k件を返す
-        return results[:top_k]
+        # バイナリ形式（サイドカーがあるもの）
+        for key in keys:
+            if not key.endswith(embedding_format.META_SUFFIX):
+                continue
+            filename = key[len(prefix):-len(embedding_format.META_SUFFIX)]
+            if embedding_format.parse_segment_name(filename) is not None:
+                continue  # セグメントはマニフェストから読み込む
+            meta_content = await storage_service.get_object(key)
+            if not meta_content:
+                continue
+            meta = embedding_format.decode_meta(meta_content)
+            loaded = await self._load_file(prefix, meta)
+            if loaded is not None:
+                files[meta['filename']] = loaded
+        
+        # 旧形式JSON（未移行のもの）
+        for key in keys:
+            if key.endswith(embedding_format.META_SUFFIX) or not key.endswith(embedding_format.LEGACY_SUFFIX):
+                continue
+            filename = key[len(prefix):-len(embedding_format.LEGACY_SUFFIX)]
+            if filename in files:
+                continue
+            content = await storage_service.get_object(key)
+            if content:
+                meta, matrix = embedding_format.decode_legacy_embeddings(content)
+                files[meta['filename']] = (meta, matrix)
+        
+        return files
     
-    async def process_file(
+    async def load_embeddings(
         self,
         library_id: str,
-        filename: str,
+        tenant_id: str = "default_tenant"
+    ) -> Dict[str, List[EmbeddingResult]]:
+        """
+        ライブラリの全エンベディングを読み込み
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            
+        Returns:
+            ファイル名をキーとしたエンベディングの辞書
+        """
+        embeddings_by_file = {}
+        
+        files = await self._load_embedding_files(library_id, tenant_id)
+        for filename, (meta, matrix) in files.items():
+            embeddings_by_file[filename] = [
+                EmbeddingResult(
+                    chunk_id=chunk['chunk_id'],
+                    embedding=matrix[chunk['row']].tolist(),
+                    text=chunk['text'],
+                    metadata=chunk['metadata']
+                )
+                for chunk in meta['chunks']
+            ]
+        
+        return embeddings_by_file
+    
+    async def delete_file_embeddings(
+        self,
+        library_id: str,
+        filename: str,
+        tenant_id: str = "default_tenant"
+    ):
+        """
+        ファイルのエンベディングをストレージとロード済みインデックスから削除
+        
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            tenant_id: テナントID
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        await storage_service.delete_object(embedding_format.meta_key(prefix, filename))
+        await storage_service.delete_object(embedding_format.matrix_key(prefix, filename))
+        await storage_service.delete_object(embedding_format.legacy_key(prefix, filename))
+        await storage_service.delete_object(keyword_index.terms_key(prefix, filename))
+        await self._delete_segments(prefix, filename)
+        
+        # 墓標を記録し、他のプロセスのロード済みインデックスからも削除させる
+        await self._append_log(library_id, tenant_id, "delete", filename)
+        self.remove_file_from_index(library_id, filename, tenant_id)
+    
+    async def _rewrite_file(
+        self,
+        library_id: str,
+        tenant_id: str,
+        meta: Dict[str, Any],
+        matrix: np.ndarray
+    ) -> Dict[str, Any]:
+        """
+        1ファイル分の行を新しい世代の単一セグメントとして書き直す（移行・切り詰め・圧縮用）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            meta: サイドカー互換の辞書（chunks は行順）
+            matrix: (N, D) のベクトル行列
+            
+        Returns:
+            書き込んだセグメント情報
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        filename = meta['filename']
+        generation = embedding_format.new_generation()
+        created_at = meta.get('created_at') or datetime.utcnow().isoformat()
+        embeddings = [
+            EmbeddingResult(
+                chunk_id=chunk['chunk_id'],
+                embedding=matrix[row],
+                text=chunk['text'],
+                metadata=chunk['metadata']
+            )
+            for row, chunk in enumerate(meta['chunks'])
+        ]
+        segment, vectors, terms = await self._write_segment(
+            prefix, embedding_format.segment_name(filename, generation, 0), filename, embeddings, created_at
+        )
+        await self._commit_file(
+            library_id, filename, generation, [segment], matrix.shape[1], created_at,
+            tenant_id=tenant_id, user_id=None, loaded=(embeddings, vectors, terms),
+            attributes=meta.get('attributes')
+        )
+        return segment
+    
+    async def migrate_library(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant"
+    ) -> Dict[str, Any]:
+        """
+        旧形式JSONのエンベディングをバイナリ形式（セグメント）に変換
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            
+        Returns:
+            移行結果
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        result = await storage_service.list_objects(prefix=prefix)
+        
+        migrated = []
+        for obj in result.get('objects', []):
+            key = obj['key']
+            if key.endswith(embedding_format.META_SUFFIX) or not key.endswith(embedding_format.LEGACY_SUFFIX):
+                continue
+            
+            content = await storage_service.get_object(key)
+            if not content:
+                continue
+            meta, matrix = embedding_format.decode_legacy_embeddings(content)
+            segment = await self._rewrite_file(library_id, tenant_id, meta, matrix)
+            
+            migrated.append({
+                "filename": meta['filename'],
+                "chunk_count": meta['chunk_count'],
+                "json_size": len(content.encode('utf-8')),
+                "binary_size": segment['bytes']
+            })
+        
+        return {
+            "library_id": library_id,
+            "migrated_files": len(migrated),
+            "files": migrated
+        }
+    
+    async def truncate_library_embeddings(
+        self,
+        library_id: str,
+        dimension: int,
+        tenant_id: str = "default_tenant"
+    ) -> Dict[str, Any]:
+        """
+        保存済みエンベディングを指定次元に切り詰めて保存し直す（Matryoshka表現）
+        text-embedding-3は先頭の次元ほど情報量が多いため、切り詰めて再正規化すれば
+        dimensionsパラメータ付きで作成したベクトルと同等になる
+        
+        Args:
+            library_id: ライブラリID
+            dimension: 新しい次元数
+            tenant_id: テナントID
+            
+        Returns:
+            変換結果（次元数が足りないファイルは再エンベディングが必要）
+        """
+        dimension = self.resolve_dimension(dimension)
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        loaded = await self._load_embedding_files(library_id, tenant_id)
+        
+        # 次元数が変わるためロード済みインデックスへの差分反映はせず、最後に破棄する
+        self.drop_library_index(library_id, tenant_id)
+        
+        truncated = []
+        reembed_required = []
+        for filename, (meta, matrix) in loaded.items():
+            if len(matrix) == 0 or matrix.shape[1] == dimension:
+                continue
+            if matrix.shape[1] < dimension:
+                reembed_required.append(filename)
+                continue
+            await self._rewrite_file(
+                library_id, tenant_id, meta, LibraryVectorIndex.normalize(matrix[:, :dimension])
+            )
+            truncated.append(filename)
+        
+        # セントロイドの次元が変わるためIVFは作り直し
+        if truncated:
+            await storage_service.delete_object(f"{prefix}{ann_index.IVF_INDEX_KEY}")
+        self.drop_library_index(library_id, tenant_id)
+        
+        if reembed_required:
+            print(f"[WARN] {len(reembed_required)} files in {library_id} have fewer than "
+                  f"{dimension} dimensions and must be re-embedded")
+        
+        return {
+            "library_id": library_id,
+            "embedding_dimension": dimension,
+            "truncated_files": truncated,
+            "reembed_required": reembed_required
+        }
+    
+    async def compact_library(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant"
+    ) -> Dict[str, Any]:
+        """
+        小さなセグメントをまとめ、古い変更ログを削除（LSM型レイアウトの圧縮）
+        - 複数の小さなセグメントに分かれたファイル（ストリーミング取り込み）を1セグメントに書き直す
+        - 保持期間を過ぎた変更ログ（削除の墓標を含む）を削除
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            
+        Returns:
+            圧縮結果
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        result = await storage_service.list_objects(prefix=prefix)
+        
+        compacted = []
+        for obj in result.get('objects', []):
+            key = obj['key']
+            if not key.endswith(embedding_format.META_SUFFIX):
+                continue
+            name = key[len(prefix):-len(embedding_format.META_SUFFIX)]
+            if embedding_format.parse_segment_name(name) is not None:
+                continue
+            meta_content = await storage_service.get_object(key)
+            if not meta_content:
+                continue
+            meta = embedding_format.decode_meta(meta_content)
+            if not embedding_format.is_manifest(meta) or len(meta['segments']) < self.compact_min_segments:
+                continue
+            if meta['chunk_count'] > self.compact_max_chunks:
+                continue  # 1セグメントにまとめるとメモリ使用量が大きすぎるもの
+            
+            loaded = await self._load_segments(prefix, meta)
+            if loaded is None:
+                continue
+            
+            # 読み込み中に再取り込みされた場合は新しい世代を優先
+            current = await storage_service.get_object(key)
+            if not current or embedding_format.decode_meta(current).get('generation') != meta['generation']:
+                continue
+            await self._rewrite_file(library_id, tenant_id, *loaded)
+            compacted.append({"filename": meta['filename'], "segments": len(meta['segments'])})
+        
+        # 保持期間を過ぎた変更ログを削除（それより長く確認していないインデックスは全体を読み直す）
+        cutoff = datetime.utcnow().timestamp() - self.log_retention_seconds
+        pruned = 0
+        for name in await self._list_log(library_id, tenant_id):
+            if embedding_format.log_entry_time(name) < cutoff:
+                await storage_service.delete_object(f"{prefix}{embedding_format.LOG_PREFIX}{name}")
+                pruned += 1
+        
+        if compacted or pruned:
+            print(f"[INFO] Compacted {library_id}: {len(compacted)} files, {pruned} log entries pruned")
+        return {
+            "library_id": library_id,
+            "compacted_files": compacted,
+            "pruned_log_entries": pruned
+        }
+    
+    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
+        """
+        コサイン類似度を計算
+        
+        Args:
+            vec1: ベクトル1
+            vec2: ベクトル2
+            
+        Returns:
+            コサイン類似度（-1～1）
+        """
+        vec1 = np.array(vec1)
+        vec2 = np.array(vec2)
+        
+        # ゼロベクトルのチェック
+        if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
+            return 0.0
+        
+        # コサイン類似度を計算
+        similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+        return float(similarity)
+    
+    async def get_library_index(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant",
+        dimension: Optional[int] = None
+    ) -> LibraryVectorIndex:
+        """
+        ライブラリのインメモリインデックスを取得（未ロードの場合はストレージから構築）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            dimension: ライブラリの次元数（保存済みベクトルが大きい場合は切り詰めて再正規化。
+                       Noneの場合はロード済みのインデックスをそのまま使用）
+            
+        Returns:
+            ライブラリのベクトルインデックス
+        """
+        key = (tenant_id, library_id)
+        if self.residency.peek("vector", key) is not None:
+            await self._refresh_indexes(library_id, tenant_id)
+        index = self.residency.peek("vector", key)
+        if index is not None and not (dimension is None or index.dimension == dimension or len(index) == 0):
+            # 次元数の設定が変わった場合は再構築
+            self.drop_library_index(library_id, tenant_id)
+        
+        # 同じライブラリへの同時検索でもロードは1回だけ（メモリ予算を超えたら他のライブラリを破棄）
+        return await self.residency.get_or_load(
+            "vector", key, lambda: self._load_library_index(library_id, tenant_id, dimension)
+        )
+    
+    async def _load_library_index(
+        self,
+        library_id: str,
+        tenant_id: str,
+        dimension: Optional[int]
+    ) -> LibraryVectorIndex:
+        """ストレージからライブラリのベクトルインデックスを構築"""
+        dimension = self.resolve_dimension(dimension)
+        
+        await self._start_log_tracking(library_id, tenant_id)
+        loaded = await self._load_embedding_files(library_id, tenant_id)
+        
+        files = {}
+        for filename, (meta, matrix) in loaded.items():
+            if len(matrix) == 0:
+                continue
+            if matrix.shape[1] < dimension:
+                print(f"[WARN] Skipping {filename}: stored dimension {matrix.shape[1]} < {dimension} "
+                      f"(re-embedding required)")
+                continue
+            if matrix.shape[1] > dimension:
+                # Matryoshka表現: 先頭の次元を切り詰め（正規化はbuildで実施）
+                matrix = matrix[:, :dimension]
+            files[filename] = (
+                [chunk['chunk_id'] for chunk in meta['chunks']],
+                [chunk['text'] for chunk in meta['chunks']],
+                [chunk['metadata'] for chunk in meta['chunks']],
+                matrix
+            )
+        
+        index = LibraryVectorIndex.build(dimension, files)
+        for filename, (meta, matrix) in loaded.items():
+            if filename not in files:
+                continue
+            layout = embedding_format.layout_from_meta(meta)
+            if layout:
+                index.file_layouts[filename] = layout
+            index.set_file_attributes(filename, meta.get('attributes') or {})
+        await self._attach_ivf(library_id, tenant_id, index)
+        
+        # 量子化（学習・符号化はCPU負荷が高いためスレッドで実行）
+        codec = quantization.create_codec(self.quantization, self.pq_subspaces)
+        if codec is not None:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, index.quantize, codec)
+        
+        print(f"[INFO] Loaded vector index for {library_id}: {len(index)} chunks, "
+              f"{index.memory_bytes():,} bytes"
+              f"{' (ivf)' if index.centroids is not None else ''}"
+              f"{f' ({codec.name})' if codec is not None else ''}")
+        return index
+    
+    async def _load_terms(self, prefix: str, name: str, texts: List[str]) -> FileTerms:
+        """保存済みの転置リストを読み込み（無い・古い場合はテキストから作成して保存）"""
+        key = keyword_index.terms_key(prefix, name)
+        content = await storage_service.get_object(key, return_bytes=True)
+        terms = FileTerms.decode(content) if content else None
+        if terms is None or len(terms) != len(texts):
+            loop = asyncio.get_event_loop()
+            terms = await loop.run_in_executor(None, FileTerms.from_texts, texts)
+            await storage_service.put_object(
+                key=key,
+                content=terms.encode(),
+                content_type="application/octet-stream"
+            )
+        return terms
+    
+    async def _load_keyword_file(
+        self,
+        prefix: str,
+        meta: Dict[str, Any]
+    ) -> Optional[Tuple[List[str], List[str], List[Dict[str, Any]], FileTerms]]:
+        """
+        1ファイル分のチャンク情報と転置リストを読み込み（ベクトル行列は読まない）
+        
+        Args:
+            prefix: エンベディング保存先のプレフィックス
+            meta: サイドカーまたはマニフェストの辞書
+            
+        Returns:
+            (chunk_ids, texts, metadatas, 転置リスト)（セグメントが欠けている場合はNone）
+        """
+        if embedding_format.is_manifest(meta):
+            parts = []
+            terms_parts = []
+            for segment in meta['segments']:
+                meta_content = await storage_service.get_object(
+                    embedding_format.meta_key(prefix, segment['name'])
+                )
+                if not meta_content:
+                    print(f"[WARN] Missing segment {segment['name']}")
+                    return None
+                segment_meta = embedding_format.decode_meta(meta_content)
+                parts.append((segment_meta, np.zeros((0, 0), dtype=np.float32)))
+                terms_parts.append(await self._load_terms(
+                    prefix, segment['name'], [chunk['text'] for chunk in segment_meta['chunks']]
+                ))
+            meta, _ = embedding_format.merge_segments(meta, parts)
+            terms = FileTerms.concat(terms_parts)
+        else:
+            terms = await self._load_terms(prefix, meta['filename'], [chunk['text'] for chunk in meta['chunks']])
+        return (
+            [chunk['chunk_id'] for chunk in meta['chunks']],
+            [chunk['text'] for chunk in meta['chunks']],
+            [chunk['metadata'] for chunk in meta['chunks']],
+            terms
+        )
+    
+    async def get_keyword_index(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant"
+    ) -> LibraryKeywordIndex:
+        """
+        ライブラリのキーワードインデックスを取得（未ロードの場合はサイドカーと転置リストから構築）
+        ベクトル行列は読み込まないため、ベクトルインデックスより軽量にロードできる
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            
+        Returns:
+            ライブラリのキーワードインデックス
+        """
+        key = (tenant_id, library_id)
+        if self.residency.peek("keyword", key) is not None:
+            await self._refresh_indexes(library_id, tenant_id)
+        return await self.residency.get_or_load(
+            "keyword", key, lambda: self._load_keyword_index(library_id, tenant_id)
+        )
+    
+    async def _load_keyword_index(self, library_id: str, tenant_id: str) -> LibraryKeywordIndex:
+        """サイドカーと転置リストからライブラリのキーワードインデックスを構築"""
+        await self._start_log_tracking(library_id, tenant_id)
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        result = await storage_service.list_objects(prefix=prefix)
+        keys = {obj['key'] for obj in result.get('objects', [])} if result.get('success') else set()
+        
+        files = {}
+        attributes = {}
+        for object_key in sorted(keys):
+            if not object_key.endswith(embedding_format.META_SUFFIX):
+                continue
+            name = object_key[len(prefix):-len(embedding_format.META_SUFFIX)]
+            if embedding_format.parse_segment_name(name) is not None:
+                continue  # セグメントはマニフェストから読み込む
+            meta_content = await storage_service.get_object(object_key)
+            if not meta_content:
+                continue
+            meta = embedding_format.decode_meta(meta_content)
+            loaded = await self._load_keyword_file(prefix, meta)
+            if loaded is not None:
+                files[meta['filename']] = loaded
+                attributes[meta['filename']] = meta.get('attributes') or {}
+        
+        # 旧形式JSON（未移行のもの。転置リストは保存せずその場で作成）
+        for object_key in sorted(keys):
+            if object_key.endswith(embedding_format.META_SUFFIX) or not object_key.endswith(embedding_format.LEGACY_SUFFIX):
+                continue
+            filename = object_key[len(prefix):-len(embedding_format.LEGACY_SUFFIX)]
+            if filename in files:
+                continue
+            content = await storage_service.get_object(object_key)
+            if content:
+                meta, _ = embedding_format.decode_legacy_embeddings(content)
+                texts = [chunk['text'] for chunk in meta['chunks']]
+                files[meta['filename']] = (
+                    [chunk['chunk_id'] for chunk in meta['chunks']],
+                    texts,
+                    [chunk['metadata'] for chunk in meta['chunks']],
+                    FileTerms.from_texts(texts)
+                )
+        
+        keywords = LibraryKeywordIndex.build(files)
+        for filename, file_attributes in attributes.items():
+            keywords.set_file_attributes(filename, file_attributes)
+        print(f"[INFO] Loaded keyword index for {library_id}: {len(keywords)} chunks")
+        return keywords
+    
+    async def _load_ivf(
+        self,
+        library_id: str,
+        tenant_id: str
+    ) -> Optional[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """永続化されたIVFインデックスを読み込み（存在しない場合はNone）"""
+        key = self._embeddings_prefix(library_id, tenant_id) + ann_index.IVF_INDEX_KEY
+        content = await storage_service.get_object(key, return_bytes=True)
+        if not content:
+            return None
+        return ann_index.decode_ivf(content)
+    
+    async def _save_ivf(
+        self,
+        library_id: str,
+        tenant_id: str,
+        centroids: np.ndarray,
+        assignments_by_file: Dict[str, np.ndarray]
+    ):
+        """IVFインデックスをエンベディングと同じ場所に保存"""
+        key = self._embeddings_prefix(library_id, tenant_id) + ann_index.IVF_INDEX_KEY
+        await storage_service.put_object(
+            key=key,
+            content=ann_index.encode_ivf(centroids, assignments_by_file),
+            content_type="application/octet-stream"
+        )
+    
+    async def _attach_ivf(self, library_id: str, tenant_id: str, index: LibraryVectorIndex):
+        """
+        永続化されたIVFをロード直後のインデックスに設定
+        （IVF構築後に追加されたファイルはここで割り当て）
+        """
+        stored = await self._load_ivf(library_id, tenant_id)
+        if stored is None or len(index) == 0:
+            return
+        centroids, assignments_by_file = stored
+        if centroids.shape[1] != index.dimension:
+            return
+        
+        rows_by_file: Dict[str, List[int]] = {}
+        for row, filename in enumerate(index.filenames):
+            rows_by_file.setdefault(filename, []).append(row)
+        
+        list_ids = np.empty(len(index), dtype=np.int32)
+        stale = False
+        for filename, rows in rows_by_file.items():
+            assignments = assignments_by_file.get(filename)
+            if assignments is not None and len(assignments) == len(rows):
+                list_ids[rows] = assignments
+            else:
+                list_ids[rows] = ann_index.assign_lists(index.reconstruct(np.array(rows)), centroids)
+                stale = True
+        
+        index.set_ivf(centroids, list_ids)
+        if stale or len(assignments_by_file) != len(rows_by_file):
+            await self._save_ivf(library_id, tenant_id, centroids, index.ivf_assignments_by_file())
+    
+    async def _refresh_ann(self, library_id: str, tenant_id: str, index: LibraryVectorIndex):
+        """ファイル追加後のIVFを保存（未構築で一定件数を超えた場合は構築）"""
+        if index.centroids is not None:
+            await self._save_ivf(library_id, tenant_id, index.centroids, index.ivf_assignments_by_file())
+        elif len(index) >= self.ann_min_chunks:
+            await self.build_ann_index(library_id, tenant_id)
+    
+    async def build_ann_index(
+        self,
+        library_id: str,
+        tenant_id: str = "default_tenant",
+        n_lists: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        ライブラリのIVFインデックスを構築して保存
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            n_lists: リスト数（省略時は約√N）
+            
+        Returns:
+            構築結果
+        """
+        index = await self.get_library_index(library_id, tenant_id)
+        if len(index) == 0:
+            return {"success": False, "reason": "No embeddings"}
+        
+        n_lists = n_lists or ann_index.default_list_count(len(index))
+        
+        # 学習用サンプル（量子化時は近似ベクトルを復元）
+        sample_size = min(len(index), 65536)
+        rows = np.sort(np.random.default_rng(0).choice(len(index), sample_size, replace=False))
+        training = index.reconstruct(rows)
+        
+        # k-meansはCPU負荷が高いためスレッドで実行
+        loop = asyncio.get_event_loop()
+        centroids = await loop.run_in_executor(
+            None, ann_index.train_centroids, training, n_lists
+        )
+        index.set_ivf(centroids)
+        await self._save_ivf(library_id, tenant_id, centroids, index.ivf_assignments_by_file())
+        
+        print(f"[INFO] Built IVF index for {library_id}: {len(centroids)} lists, {len(index)} chunks")
+        return {"success": True, "n_lists": len(centroids), "chunk_count": len(index)}
+    
+    def _on_index_evicted(self, kind: str, key: Tuple[str, str]):
+        """常駐マネージャーがインデックスを破棄した際、どちらも無くなれば変更ログの既読状態も破棄"""
+        if self.residency.peek("vector", key) is None and self.residency.peek("keyword", key) is None:
+            self._log_states.pop(key, None)
+    
+    async def warm_up(self, limit: Optional[int] = None) -> int:
+        """
+        検索回数の多いライブラリのベクトルインデックスを事前ロード（メモリ予算に収まる範囲）
+        
+        Args:
+            limit: 最大ライブラリ数（省略時は prewarm_count）
+            
+        Returns:
+            ロードしたライブラリ数
+        """
+        warmed = 0
+        for (tenant_id, library_id), dimension in await self.residency.top_libraries(limit or self.prewarm_count):
+            if self.residency.resident_bytes >= self.residency.budget_bytes:
+                break
+            try:
+                await self.get_library_index(library_id, tenant_id, dimension)
+                warmed += 1
+            except Exception as e:
+                print(f"[WARN] Failed to warm up index for {library_id}: {str(e)}")
+        if warmed:
+            print(f"[INFO] Warmed up {warmed} library indexes ({self.residency.resident_bytes:,} bytes)")
+        return warmed
+    
+    async def start_residency(self):
+        """事前ロードと検索回数の定期保存を開始（アプリ起動時に呼ぶ）"""
+        if self._residency_tasks:
+            return
+        
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(self.stats_flush_seconds)
+                await self.residency.flush_stats()
+        
+        self._residency_tasks = [
+            asyncio.ensure_future(self.warm_up()),
+            asyncio.ensure_future(flush_periodically())
+        ]
+    
+    async def stop_residency(self):
+        """バックグラウンド処理を停止し、未保存の検索回数を保存"""
+        for task in self._residency_tasks:
+            task.cancel()
+        await asyncio.gather(*self._residency_tasks, return_exceptions=True)
+        self._residency_tasks = []
+        await self.residency.flush_stats()
+    
+    def drop_library_index(self, library_id: str, tenant_id: str = "default_tenant"):
+        """
+        ライブラリのインメモリインデックスを破棄（次回検索時に再構築）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+        """
+        self.residency.discard("vector", (tenant_id, library_id))
+        self.residency.discard("keyword", (tenant_id, library_id))
+        self._log_states.pop((tenant_id, library_id), None)
+    
+    def remove_file_from_index(
+        self,
+        library_id: str,
+        filename: str,
+        tenant_id: str = "default_tenant"
+    ):
+        """
+        ロード済みインデックスからファイルの行を削除
+        
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            tenant_id: テナントID
+        """
+        index = self.residency.peek("vector", (tenant_id, library_id))
+        if index is not None:
+            index.remove_file(filename)
+        keywords = self.residency.peek("keyword", (tenant_id, library_id))
+        if keywords is not None:
+            keywords.remove_file(filename)
+    
+    async def _rerank(
+        self,
+        library_id: str,
+        tenant_id: str,
+        index: LibraryVectorIndex,
+        hits: List[Tuple[int, float]],
+        query_embedding: List[float]
+    ) -> List[Tuple[int, float]]:
+        """
+        候補を保存済みの元ベクトルで再スコアリング（候補をセグメントごとにまとめ、近い行は1回のレンジ読み込み）
+        
+        Args:
+            library_id: ライブラリID
+            tenant_id: テナントID
+            index: ライブラリインデックス
+            hits: (行番号, 近似スコア) のリスト
+            query_embedding: クエリベクトル
+            
+        Returns:
+            (行番号, スコア) のリスト（スコア降順）
+        """
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        query = LibraryVectorIndex.normalize(query_embedding)
+        semaphore = asyncio.Semaphore(16)
+        scores = dict(hits)
+        
+        # 行列（セグメント）ごとに候補行の位置をまとめる
+        segments: Dict[str, Tuple[Dict[str, Any], Dict[int, List[int]]]] = {}
+        for row, _ in hits:
+            filename = index.filenames[row]
+            layout = index.file_layouts.get(filename)
+            if layout is None:
+                # 旧形式はレンジ読み込みできないため近似スコアのまま
+                continue
+            name, start = embedding_format.locate_row(layout, filename, int(index.file_rows[row]))
+            segments.setdefault(name, (layout, {}))[1].setdefault(start, []).append(row)
+        
+        async def rescore_segment(name: str, layout: Dict[str, Any], rows_by_start: Dict[int, List[int]]):
+            row_bytes = layout['row_bytes']
+            ranges = embedding_format.coalesce_ranges(list(rows_by_start), row_bytes, self.rerank_max_gap_bytes)
+            async with semaphore:
+                chunks = await storage_service.get_object_ranges(
+                    embedding_format.matrix_key(prefix, name), [(start, length) for start, length, _ in ranges]
+                )
+            for (range_start, _, starts), data in zip(ranges, chunks):
+                if not data:
+                    continue
+                for start in starts:
+                    offset = start - range_start
+                    if len(data) < offset + row_bytes:
+                        continue
+                    # 切り詰め済みライブラリでは先頭の次元のみ使用
+                    vector = np.frombuffer(data[offset:offset + row_bytes], dtype=layout['dtype'])[:index.dimension]
+                    score = float(LibraryVectorIndex.normalize(vector) @ query)
+                    for row in rows_by_start[start]:
+                        scores[row] = score
+        
+        await asyncio.gather(*(
+            rescore_segment(name, layout, rows_by_start) for name, (layout, rows_by_start) in segments.items()
+        ))
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    
+    async def search(
+        self,
+        library_id: str,
+        query: str,
+        top_k: int = 10,
+        threshold: float = 0.7,
+        tenant_id: str = "default_tenant",
+        index_type: str = "auto",
+        nprobe: Optional[int] = None,
+        rerank: Optional[bool] = None,
+        dimension: Optional[int] = None,
+        mode: str = "vector",
+        prefilter: bool = False,
+        query_embedding: Optional[List[float]] = None,
+        filters: Optional[SearchFilter] = None,
+        mmr_lambda: Optional[float] = None,
+        merge_adjacent: bool = False
+    ) -> List[SearchResult]:
+        """
+        ライブラリ内を検索（ベクトル / キーワード / ハイブリッド）
+        
+        Args:
+            library_id: ライブラリID
+            query: 検索クエリ
+            top_k: 返す結果の最大数
+            threshold: 類似度の閾値（ベクトル側のみに適用）
+            tenant_id: テナントID
+            index_type: auto（IVFがあれば使用）/ flat（全件走査）/ ivf（未構築なら構築）
+            nprobe: IVFで走査するリスト数（大きいほど高再現率・低速）
+            rerank: 量子化時に上位候補を元のベクトルで再スコアリングするか（Noneは量子化時のみ）
+            dimension: ライブラリの次元数（Noneの場合はモデルの次元数）
+            mode: vector（コサイン類似度）/ keyword（BM25、ベクトルを読み込まない）/
+                  hybrid（両方の順位をRRFで統合）
+            prefilter: hybrid時、キーワード検索の候補だけをベクトルでスコアリングする
+            query_embedding: 作成済みのクエリのエンベディング（ライブラリの次元数以上。先頭を使用）
+            filters: ファイル名・アップロード日時・コンテンツタイプの条件（スコアリング前に適用）
+            mmr_lambda: MMRで多様化する場合の関連度の重み（0〜1。Noneは多様化しない。keywordでは無視）
+            merge_adjacent: 同じファイルの連続したチャンクを1つのパッセージに結合する
+            
+        Returns:
+            検索結果のリスト（hybridのscoreはRRFスコア）
+        """
+        if mode not in ("vector", "keyword", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {mode}")
+        if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+            raise ValueError("mmr_lambda must be between 0 and 1")
+        self.residency.record_query((tenant_id, library_id), dimension)
+        
+        diversify = mmr_lambda is not None and mode != "keyword"
+        results = await self._search(
+            library_id, query, top_k * self.mmr_candidate_factor if diversify else top_k,
+            threshold, tenant_id, index_type, nprobe, rerank, dimension, mode, prefilter,
+            query_embedding, filters
+        )
+        
+        if diversify and len(results) > top_k:
+            # 候補のベクトルは常駐中のインデックスから取得（量子化時は近似値）
+            index = await self.get_library_index(library_id, tenant_id, dimension)
+            rows = index.lookup_rows([(result.filename, result.chunk_id) for result in results])
+            results = [result for result, row in zip(results, rows) if row >= 0]
+            rows = rows[rows >= 0]
+            chosen = result_diversity.mmr_select(
+                index.reconstruct(rows),
+                result_diversity.normalize_scores([result.score for result in results]),
+                top_k,
+                mmr_lambda
+            )
+            results = [results[i] for i in chosen]
+        
+        for result in results:
+            result.library_id = library_id
+        if merge_adjacent:
+            results = result_diversity.merge_adjacent(results)
+        return results
+    
+    async def _search(
+        self,
+        library_id: str,
+        query: str,
+        top_k: int,
+        threshold: float,
+        tenant_id: str,
+        index_type: str,
+        nprobe: Optional[int],
+        rerank: Optional[bool],
+        dimension: Optional[int],
+        mode: str,
+        prefilter: bool,
+        query_embedding: Optional[List[float]],
+        filters: Optional[SearchFilter]
+    ) -> List[SearchResult]:
+        """検索の本体（引数はsearchと同じ。スコア降順の上位top_k件）"""
+        keywords = None
+        keyword_hits: List[Tuple[int, float]] = []
+        if mode != "vector":
+            keywords = await self.get_keyword_index(library_id, tenant_id)
+            depth = top_k if mode == "keyword" else max(top_k, self.hybrid_candidates)
+            keyword_hits = keywords.search(query, top_k=depth, filenames=keywords.filter_files(filters))
+            if mode == "keyword":
+                return [
+                    SearchResult(
+                        chunk_id=keywords.chunk_ids[row],
+                        text=keywords.texts[row],
+                        score=score,
+                        filename=keywords.filenames[row],
+                        metadata=keywords.metadatas[row],
+                        keyword_score=score,
+                        **self._result_attributes(keywords, keywords.filenames[row])
+                    )
+                    for row, score in keyword_hits
+                ]
+        
+        # クエリのエンベディングを作成（渡された場合はMatryoshka表現として先頭の次元を使用）
+        if query_embedding is None:
+            query_embedding = await self.embed_query(query, dimension, tenant_id)
+        query_embedding = query_embedding[:self.resolve_dimension(dimension)]
+        
+        # インメモリインデックスで一括スコアリング
+        index = await self.get_library_index(library_id, tenant_id, dimension)
+        if len(index) == 0 and mode == "vector":
+            return []
+        
+        if index_type == "ivf" and index.centroids is None and len(index) > 0:
+            await self.build_ann_index(library_id, tenant_id)
+        
+        use_ivf = index_type != "flat" and index.centroids is not None
+        if rerank is None:
+            rerank = index.codec is not None
+        vector_top_k = top_k if mode == "vector" else max(top_k, self.hybrid_candidates)
+        
+        # メタデータフィルタに一致する行だけをスコアリング（絞り込むほど走査量が減る）
+        candidate_rows = index.filter_rows(filters)
+        
+        # キーワードで一致したチャンクだけをベクトルでスコアリング（一致なしなら全件）
+        if mode == "hybrid" and prefilter and keyword_hits:
+            keyword_rows = index.rows_for([
+                (keywords.filenames[row], keywords.chunk_ids[row]) for row, _ in keyword_hits
+            ])
+            if candidate_rows is None:
+                candidate_rows = keyword_rows
+            else:
+                candidate_rows = np.intersect1d(candidate_rows, keyword_rows, assume_unique=True)
+        
+        # 再ランキング時は近似スコアで多めに候補を取り、閾値は正確なスコアで適用
+        hits = index.search(
+            query_embedding,
+            top_k=vector_top_k * self.rerank_factor if rerank else vector_top_k,
+            threshold=None if rerank else threshold,
+            nprobe=(nprobe or self.ann_default_nprobe) if use_ivf else None,
+            candidate_rows=candidate_rows
+        )
+        if rerank:
+            hits = await self._rerank(library_id, tenant_id, index, hits, query_embedding)
+            hits = [(row, score) for row, score in hits if score >= threshold][:vector_top_k]
+        
+        if mode == "vector":
+            return [
+                SearchResult(
+                    chunk_id=index.chunk_ids[row],
+                    text=index.texts[row],
+                    score=score,
+                    filename=index.filenames[row],
+                    metadata=index.metadatas[row],
+                    vector_score=score,
+                    **self._result_attributes(index, index.filenames[row])
+                )
+                for row, score in hits
+            ]
+        
+        # 2つの順位を (ファイル名, チャンクID) で突き合わせてRRFで統合
+        vector_rows = {(index.filenames[row], index.chunk_ids[row]): (row, score) for row, score in hits}
+        keyword_rows = {
+            (keywords.filenames[row], keywords.chunk_ids[row]): (row, score) for row, score in keyword_hits
+        }
+        fused = keyword_index.reciprocal_rank_fusion([list(vector_rows), list(keyword_rows)], k=self.rrf_k)
+        
+        results = []
+        for (filename, chunk_id), score in fused[:top_k]:
+            vector_hit = vector_rows.get((filename, chunk_id))
+            keyword_hit = keyword_rows.get((filename, chunk_id))
+            if keyword_hit is not None:
+                text, metadata = keywords.texts[keyword_hit[0]], keywords.metadatas[keyword_hit[0]]
+            else:
+                text, metadata = index.texts[vector_hit[0]], index.metadatas[vector_hit[0]]
+            results.append(SearchResult(
+                chunk_id=chunk_id,
+                text=text,
+                score=score,
+                filename=filename,
+                metadata=metadata,
+                vector_score=vector_hit[1] if vector_hit is not None else None,
+                keyword_score=keyword_hit[1] if keyword_hit is not None else None,
+                **self._result_attributes(keywords, filename)
+            ))
+        return results
+    
+    @staticmethod
+    def _result_attributes(index, filename: str) -> Dict[str, Any]:
+        """検索結果に付けるファイル属性"""
+        attributes = index.file_attributes.get(filename) or {}
+        return {
+            "uploaded_at": attributes.get('uploaded_at'),
+            "content_type": attributes.get('content_type')
+        }
+    
+    async def search_libraries(
+        self,
+        libraries: List[Tuple[str, Optional[int]]],
+        query: str,
+        top_k: int = 10,
+        threshold: float = 0.7,
+        tenant_id: str = "default_tenant",
+        index_type: str = "auto",
+        nprobe: Optional[int] = None,
+        rerank: Optional[bool] = None,
+        mode: str = "vector",
+        prefilter: bool = False,
+        filters: Optional[SearchFilter] = None,
+        mmr_lambda: Optional[float] = None,
+        merge_adjacent: bool = False
+    ) -> List[SearchResult]:
+        """
+        複数ライブラリを横断検索
+        クエリのエンベディングは最大次元数で1回だけ作成し、各ライブラリを並行に検索して
+        ライブラリごとの上位をヒープでマージする
+        
+        Args:
+            libraries: (ライブラリID, 次元数) のリスト
+            query: 検索クエリ
+            top_k: 返す結果の最大数（全ライブラリ合計）
+            その他: searchと同じ
+            
+        Returns:
+            スコアの降順に並べた検索結果のリスト（library_idに検索元を設定）
+            ※ keywordのBM25スコアはライブラリごとの統計に依存するため目安として比較する
+        """
+        if mode not in ("vector", "keyword", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {mode}")
+        if not libraries:
+            return []
+        
+        # 次元数の異なるライブラリは先頭の次元を切り詰めて使う（Matryoshka表現）
+        query_embedding = None
+        if mode != "keyword":
+            dimension = max(self.resolve_dimension(dimension) for _, dimension in libraries)
+            query_embedding = await self.embed_query(query, dimension, tenant_id)
+        
+        outcomes = await asyncio.gather(*[
+            self.search(
+                library_id=library_id,
+                query=query,
+                top_k=top_k,
+                threshold=threshold,
+                tenant_id=tenant_id,
+                index_type=index_type,
+                nprobe=nprobe,
+                rerank=rerank,
+                dimension=dimension,
+                mode=mode,
+                prefilter=prefilter,
+                query_embedding=query_embedding,
+                filters=filters,
+                mmr_lambda=mmr_lambda,
+                merge_adjacent=merge_adjacent
+            )
+            for library_id, dimension in libraries
+        ], return_exceptions=True)
+        
+        rankings = []
+        for (library_id, _), outcome in zip(libraries, outcomes):
+            if isinstance(outcome, BaseException):
+                if all(isinstance(other, BaseException) for other in outcomes):
+                    raise outcome
+                print(f"[WARN] Search failed for library {library_id}: {str(outcome)}")
+                continue
+            # MMRの結果は選択順、隣接チャンクの結合後もスコア順とは限らないため並べ直す
+            rankings.append(sorted(outcome, key=lambda result: -result.score))
+        
+        # 各ライブラリの結果をスコアの降順にしてから、ヒープで先頭からtop_k件だけ取り出す
+        merged = heapq.merge(*rankings, key=lambda result: -result.score)
+        return list(itertools.islice(merged, top_k))
+    
+    async def get_chunk(
+        self,
+        library_id: str,
+        filename: str,
+        chunk_id: str,
+        tenant_id: str = "default_tenant",
+        chunk_index: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        チャンクの全文をチャンクIDで取得（スニペット形式の検索結果から遅延取得する用）
+        ロード済みのインデックスがあれば (ファイル名, チャンクID) -> 行 の対応表から、
+        なければ保存済みのサイドカーから読む（ライブラリ全体はロードしない）
+        
+        Args:
+            library_id: ライブラリID
+            filename: ファイル名
+            chunk_id: チャンクID
+            tenant_id: テナントID
+            chunk_index: 検索結果のchunk_index（セグメント化されたファイルでは該当セグメントから読む）
+            
+        Returns:
+            chunk_id / text / metadata の辞書（見つからない場合はNone）
+        """
+        key = (tenant_id, library_id)
+        if self.residency.peek("vector", key) is not None:
+            await self._refresh_indexes(library_id, tenant_id)
+        index = self.residency.peek("vector", key)
+        if index is not None:
+            row = int(index.lookup_rows([(filename, chunk_id)])[0])
+            if row < 0:
+                return None
+            return {"chunk_id": chunk_id, "text": index.texts[row], "metadata": index.metadatas[row]}
+        
+        prefix = self._embeddings_prefix(library_id, tenant_id)
+        meta_content = await storage_service.get_object(embedding_format.meta_key(prefix, filename))
+        if not meta_content:
+            content = await storage_service.get_object(embedding_format.legacy_key(prefix, filename))
+            if not content:
+                return None
+            meta, _ = embedding_format.decode_legacy_embeddings(content)
+            return self._find_chunk(meta['chunks'], chunk_id)
+        meta = embedding_format.decode_meta(meta_content)
+        if not embedding_format.is_manifest(meta):
+            return self._find_chunk(meta['chunks'], chunk_id)
+        
+        # セグメントは行順に並び、行番号はchunk_indexと一致するため、該当するセグメントを先に読む
+        names = [segment['name'] for segment in meta['segments']]
+        if chunk_index is not None and 0 <= chunk_index < meta['chunk_count']:
+            name, _ = embedding_format.locate_row(embedding_format.layout_from_meta(meta), filename, chunk_index)
+            names.remove(name)
+            names.insert(0, name)
+        for name in names:
+            content = await storage_service.get_object(embedding_format.meta_key(prefix, name))
+            if not content:
+                print(f"[WARN] Missing segment {name}")
+                continue
+            chunk = self._find_chunk(embedding_format.decode_meta(content)['chunks'], chunk_id, meta['chunk_count'])
+            if chunk is not None:
+                return chunk
+        return None
+    
+    @staticmethod
+    def _find_chunk(
+        chunks: List[Dict[str, Any]],
+        chunk_id: str,
+        total_chunks: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """サイドカーのチャンク一覧からチャンクIDで探す"""
+        for chunk in chunks:
+            if chunk['chunk_id'] == chunk_id:
+                metadata = chunk['metadata']
+                if total_chunks is not None:
+                    metadata = dict(metadata, total_chunks=total_chunks)
+                return {"chunk_id": chunk_id, "text": chunk['text'], "metadata": metadata}
+        return None
+    
+    async def process_file(
+        self,
+        library_id: str,
+        filename: str,
         text: str,
         tenant_id: str = "default_tenant",
-        user_id: str = "default_user"
+        user_id: str = "default_user",
+        dimension: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         ファイル全体のエンベディング処理
@@ -395,6 +2185,7 @@ class EmbeddingService:
             text: ファイルのテキスト
             tenant_id: テナントID
             user_id: ユーザーID
+            dimension: ライブラリの次元数（Noneの場合はモデルの次元数）
             
         Returns:
             処理結果
@@ -405,7 +2196,7 @@ class EmbeddingService:
             print(f"[INFO] Created {len(chunks)} chunks for {filename}")
             
             # エンベディング作成
-            embeddings = await self.embed_chunks(chunks)
+            embeddings = await self.embed_chunks(chunks, tenant_id, dimension)
             print(f"[INFO] Created embeddings for {len(embeddings)} chunks")
             
             # 保存
@@ -0,0 +1,238 @@
+"""
+ライブラリインデックスの常駐管理
+メモリ予算（バイト）の範囲でインデックスを保持し、超えた分はライブラリ単位でLRU/LFU破棄する
+
+- 未ロードのインデックスは同時に何件要求されても1回だけロード（single-flight）
+- ライブラリごとの検索回数をkvm_serviceに記録し、起動時に検索の多いライブラリを事前ロード
+- ヒット率・ロード時間などの統計を提供
+"""
+
+import time
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+from services.kvm_service import kvm_service
+
+
+# 検索回数の記録（SKはテナント・ライブラリ）
+STATS_PK = "LIBRARY_INDEX#STATS"
+
+LibraryKey = Tuple[str, str]  # (テナントID, ライブラリID)
+
+
+class IndexResidencyManager:
+    """
+    インデックス常駐マネージャー
+    - インデックスは (種類, (テナントID, ライブラリID)) 単位で保持（種類は vector / keyword）
+    - 各インデックスの resident_bytes() の合計が予算を超えたら、直近で使っていないもの
+      （lru）または使用回数の少ないもの（lfu）から破棄
+    """
+
+    def __init__(self, budget_bytes: int, policy: str = "lru"):
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+
+        self._entries: Dict[Tuple[str, LibraryKey], Dict[str, Any]] = {}
+        self._loading: Dict[Tuple[str, LibraryKey], asyncio.Future] = {}
+
+        # 破棄時の通知（ライブラリの付随状態の後始末用）
+        self.on_evict: Optional[Callable[[str, LibraryKey], None]] = None
+
+        # KVMに未反映の検索回数とライブラリの次元数
+        self._pending_queries: Dict[LibraryKey, int] = {}
+        self._dimensions: Dict[LibraryKey, Optional[int]] = {}
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # ロード中の要求に相乗りした件数
+        self.loads = 0
+        self.load_failures = 0
+        self.evictions = 0
+        self.load_seconds_total = 0.0
+        self.load_seconds_max = 0.0
+
+    @property
+    def resident_bytes(self) -> int:
+        """常駐中のインデックスの合計サイズ"""
+        return sum(entry['bytes'] for entry in self._entries.values())
+
+    def peek(self, kind: str, key: LibraryKey):
+        """常駐中のインデックスを取得（統計・LRU順は更新しない。未ロードならNone）"""
+        entry = self._entries.get((kind, key))
+        return entry['index'] if entry is not None else None
+
+    def keys(self, kind: str) -> List[LibraryKey]:
+        """常駐中のライブラリ一覧"""
+        return [key for entry_kind, key in self._entries if entry_kind == kind]
+
+    async def get_or_load(self, kind: str, key: LibraryKey, loader: Callable[[], Awaitable[Any]]):
+        """
+        インデックスを取得（未ロードの場合はloaderでロード）
+        同じインデックスのロード中に来た要求はそのロードの完了を待つ
+
+        Args:
+            kind: インデックスの種類
+            key: (テナントID, ライブラリID)
+            loader: インデックスをロードするコルーチン関数
+
+        Returns:
+            インデックス
+        """
+        entry = self._entries.get((kind, key))
+        if entry is not None:
+            self.hits += 1
+            entry['last_access'] = time.monotonic()
+            entry['uses'] += 1
+            return entry['index']
+
+        loading = self._loading.get((kind, key))
+        if loading is not None:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._loading[(kind, key)] = future
+        started = time.monotonic()
+        try:
+            index = await loader()
+        except asyncio.CancelledError:
+            self.load_failures += 1
+            future.cancel()
+            raise
+        except Exception as e:
+            self.load_failures += 1
+            future.set_exception(e)
+            future.exception()  # 待機者がいない場合の警告を抑止
+            raise
+        finally:
+            self._loading.pop((kind, key), None)
+
+        elapsed = time.monotonic() - started
+        self.loads += 1
+        self.load_seconds_total += elapsed
+        self.load_seconds_max = max(self.load_seconds_max, elapsed)
+        self._entries[(kind, key)] = {
+            'index': index,
+            'bytes': index.resident_bytes(),
+            'last_access': time.monotonic(),
+            'uses': 1,
+            'loaded_at': time.time(),
+            'load_seconds': elapsed
+        }
+        self._evict(protect=(kind, key))
+        future.set_result(index)
+        return index
+
+    def discard(self, kind: str, key: LibraryKey):
+        """インデックスを破棄（次回要求時に再ロード）"""
+        self._entries.pop((kind, key), None)
+
+    def refresh_size(self, kind: str, key: LibraryKey):
+        """差分反映などでサイズが変わったインデックスを再計測し、予算超過なら破棄"""
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            return
+        entry['bytes'] = entry['index'].resident_bytes()
+        self._evict(protect=(kind, key))
+
+    def _evict(self, protect: Tuple[str, LibraryKey]):
+        """予算に収まるまで破棄（直前にロードしたものは残す）"""
+        total = self.resident_bytes
+        if total <= self.budget_bytes:
+            return
+
+        if self.policy == "lfu":
+            order = sorted(self._entries, key=lambda k: (self._entries[k]['uses'], self._entries[k]['last_access']))
+        else:
+            order = sorted(self._entries, key=lambda k: self._entries[k]['last_access'])
+
+        for entry_key in order:
+            if total <= self.budget_bytes:
+                break
+            if entry_key == protect:
+                continue
+            total -= self._entries.pop(entry_key)['bytes']
+            self.evictions += 1
+            print(f"[INFO] Evicted {entry_key[0]} index for {entry_key[1][1]} "
+                  f"(resident {total:,} / {self.budget_bytes:,} bytes)")
+            if self.on_evict is not None:
+                self.on_evict(*entry_key)
+
+        if total > self.budget_bytes:
+            print(f"[WARN] Index for {protect[1][1]} alone exceeds the memory budget "
+                  f"({total:,} / {self.budget_bytes:,} bytes)")
+
+    def record_query(self, key: LibraryKey, dimension: Optional[int] = None):
+        """検索回数を記録（KVMへはflush_statsでまとめて反映）"""
+        self._pending_queries[key] = self._pending_queries.get(key, 0) + 1
+        self._dimensions[key] = dimension
+
+    async def flush_stats(self):
+        """未反映の検索回数をKVMに加算"""
+        pending, self._pending_queries = self._pending_queries, {}
+        for (tenant_id, library_id), count in pending.items():
+            sk = f"TENANT#{tenant_id}#LIBRARY#{library_id}"
+            try:
+                item = await kvm_service.get_item(STATS_PK, sk) or {
+                    'PK': STATS_PK,
+                    'SK': sk,
+                    'tenant_id': tenant_id,
+                    'library_id': library_id,
+                    'query_count': 0
+                }
+                item['query_count'] = item.get('query_count', 0) + count
+                item['embedding_dimension'] = self._dimensions.get((tenant_id, library_id))
+                item['last_queried_at'] = time.time()
+                await kvm_service.put_item(item)
+            except Exception as e:
+                print(f"[WARN] Failed to save index stats for {library_id}: {str(e)}")
+
+    async def top_libraries(self, limit: int) -> List[Tuple[LibraryKey, Optional[int]]]:
+        """
+        検索回数の多いライブラリを取得
+
+        Args:
+            limit: 最大件数
+
+        Returns:
+            ((テナントID, ライブラリID), 次元数) のリスト（検索回数の降順）
+        """
+        items = await kvm_service.query(pk=STATS_PK, page_size=1000)
+        items.sort(key=lambda item: item.get('query_count', 0), reverse=True)
+        return [
+            ((item['tenant_id'], item['library_id']), item.get('embedding_dimension'))
+            for item in items[:limit]
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット率・ロード時間・常駐状況の統計を取得"""
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "loads": self.loads,
+            "load_failures": self.load_failures,
+            "load_seconds_avg": self.load_seconds_total / self.loads if self.loads else 0.0,
+            "load_seconds_max": self.load_seconds_max,
+            "evictions": self.evictions,
+            "policy": self.policy,
+            "budget_bytes": self.budget_bytes,
+            "resident_bytes": self.resident_bytes,
+            "resident": [
+                {
+                    "kind": kind,
+                    "tenant_id": key[0],
+                    "library_id": key[1],
+                    "bytes": entry['bytes'],
+                    "uses": entry['uses'],
+                    "load_seconds": entry['load_seconds']
+                }
+                for (kind, key), entry in sorted(
+                    self._entries.items(), key=lambda item: item[1]['last_access'], reverse=True
+                )
+            ]
+        }
@@ -0,0 +1,440 @@
+"""
+ライブラリ単位のキーワード（BM25）インデックス
+日本語などは文字bigram、英数字は単語単位でトークン化し、製品コードや固有名詞の一致を拾う
+ファイルごとの転置リストは取り込み時に作成して保存する（検索時にベクトルを読み込まない）
+"""
+
+import io
+import math
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Set
+
+import numpy as np
+
+from services.search_filter import SearchFilter, FileColumns
+
+
+
+TOKENIZER_VERSION = 1  # トークン化を変えた場合は上げる（古い転置リストは読み込み時に作り直す）
+TERMS_SUFFIX = ".terms.npz"
+MAX_TERM_LENGTH = 32  # 長すぎる英数字列（ハッシュ値など）は先頭のみ使用
+
+# 英数字の語（ABC-123 や v1.2 のような区切りを含むコードは1語）/ それ以外の文字の連続
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*|[^\W\da-z_]+")
+_CODE_SEPARATOR = re.compile(r"[-_./]")
+
+
+def terms_key(prefix: str, filename: str) -> str:
+    """転置リストのキー"""
+    return f"{prefix}{filename}{TERMS_SUFFIX}"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    テキストを検索用のトークンに分割
+
+    - NFKC正規化と小文字化（全角英数字・半角カナの揺れを吸収）
+    - 英数字は語単位（区切り付きのコードは全体と各部分の両方）
+    - 日本語などは文字bigram（1文字だけの場合はその文字）
+
+    Args:
+        text: テキスト
+
+    Returns:
+        トークンのリスト（重複あり）
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token[:MAX_TERM_LENGTH])
+            parts = _CODE_SEPARATOR.split(token)
+            if len(parts) > 1:
+                tokens.extend(part[:MAX_TERM_LENGTH] for part in parts)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class FileTerms:
+    """
+    1ファイル分の転置リスト
+    語ごとに (チャンク行, 出現回数) をCSR形式で保持する
+    """
+
+    def __init__(
+        self,
+        terms: List[str],
+        indptr: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        lengths: np.ndarray
+    ):
+        self.terms = terms
+        self.indptr = indptr
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths  # チャンクごとのトークン数
+        self._lookup = {term: i for i, term in enumerate(terms)}
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @classmethod
+    def _from_postings(
+        cls,
+        postings: Dict[str, List[Tuple[np.ndarray, np.ndarray]]],
+        lengths: np.ndarray
+    ) -> "FileTerms":
+        """語 -> (行, 出現回数) の配列リストから構築"""
+        terms = sorted(postings)
+        counts = [sum(len(rows) for rows, _ in postings[term]) for term in terms]
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        if terms:
+            rows = np.concatenate([rows for term in terms for rows, _ in postings[term]]).astype(np.int32)
+            tfs = np.concatenate([tfs for term in terms for _, tfs in postings[term]]).astype(np.uint16)
+        else:
+            rows = np.zeros(0, dtype=np.int32)
+            tfs = np.zeros(0, dtype=np.uint16)
+        return cls(terms, indptr, rows, tfs, np.asarray(lengths, dtype=np.int32))
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "FileTerms":
+        """
+        チャンクテキストから転置リストを作成
+
+        Args:
+            texts: チャンクテキストのリスト（行順）
+
+        Returns:
+            転置リスト
+        """
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                rows, tfs = postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(min(tf, 65535))
+        return cls._from_postings(
+            {term: [(np.array(rows), np.array(tfs))] for term, (rows, tfs) in postings.items()},
+            lengths
+        )
+
+    @classmethod
+    def concat(cls, parts: List["FileTerms"]) -> "FileTerms":
+        """
+        セグメントごとの転置リストを1ファイル分にまとめる（行番号は順にずらす）
+
+        Args:
+            parts: 転置リストのリスト（行順）
+
+        Returns:
+            まとめた転置リスト
+        """
+        postings: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        offset = 0
+        for part in parts:
+            for i, term in enumerate(part.terms):
+                start, end = part.indptr[i], part.indptr[i + 1]
+                postings.setdefault(term, []).append((part.rows[start:end] + offset, part.tfs[start:end]))
+            offset += len(part)
+        lengths = [part.lengths for part in parts]
+        return cls._from_postings(postings, np.concatenate(lengths) if lengths else np.zeros(0))
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """語の (行, 出現回数)（出現しない場合はNone）"""
+        i = self._lookup.get(term)
+        if i is None:
+            return None
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.rows[start:end], self.tfs[start:end]
+
+    def encode(self) -> bytes:
+        """保存用の .npz バイト列"""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            version=np.array([TOKENIZER_VERSION], dtype=np.int32),
+            terms=np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8),
+            indptr=self.indptr,
+            rows=self.rows,
+            tfs=self.tfs,
+            lengths=self.lengths
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def decode(cls, content: bytes) -> Optional["FileTerms"]:
+        """
+        保存された転置リストを読み込み
+
+        Args:
+            content: encode() のバイト列
+
+        Returns:
+            転置リスト（トークン化のバージョンが異なる場合はNone）
+        """
+        with np.load(io.BytesIO(content), allow_pickle=False) as data:
+            if int(data['version'][0]) != TOKENIZER_VERSION:
+                return None
+            text = data['terms'].tobytes().decode('utf-8')
+            return cls(
+                text.split('\n') if text else [],
+                data['indptr'],
+                data['rows'],
+                data['tfs'],
+                data['lengths']
+            )
+
+
+class LibraryKeywordIndex:
+    """
+    ライブラリキーワードインデックス
+    - ファイルごとの転置リストを行オフセット付きで束ねる（ファイルの行は連続）
+    - BM25でスコアリングし、top-kはargpartitionで選択
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        # 行ごとの付随情報
+        self.chunk_ids: List[str] = []
+        self.texts: List[str] = []
+        self.filenames: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.lengths = np.zeros(0, dtype=np.float32)
+
+        # ファイル名 -> 転置リスト（挿入順 = 行順）と先頭行
+        self._files: Dict[str, FileTerms] = {}
+        self._offsets: Dict[str, int] = {}
+        self._length_norm: Optional[np.ndarray] = None
+
+        # ファイル属性（アップロード日時・コンテンツタイプ。検索フィルタ用）
+        self.file_attributes: Dict[str, Dict[str, Any]] = {}
+        self._file_columns: Optional[FileColumns] = None
+
+        self.loaded_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def build(
+        cls,
+        files: Dict[str, Tuple[List[str], List[str], List[Dict[str, Any]], FileTerms]]
+    ) -> "LibraryKeywordIndex":
+        """
+        複数ファイル分の転置リストから構築
+
+        Args:
+            files: ファイル名 -> (chunk_ids, texts, metadatas, 転置リスト)
+
+        Returns:
+            構築したインデックス
+        """
+        index = cls()
+        lengths = []
+        for filename, (chunk_ids, texts, metadatas, terms) in files.items():
+            if len(chunk_ids) == 0:
+                continue
+            index._offsets[filename] = len(index.chunk_ids)
+            index._files[filename] = terms
+            index.chunk_ids.extend(chunk_ids)
+            index.texts.extend(texts)
+            index.filenames.extend([filename] * len(chunk_ids))
+            index.metadatas.extend(metadatas)
+            lengths.append(terms.lengths)
+        if lengths:
+            index.lengths = np.concatenate(lengths).astype(np.float32)
+        return index
+
+    def add_file(
+        self,
+        filename: str,
+        chunk_ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        terms: Optional[FileTerms] = None
+    ):
+        """
+        ファイル単位で行を追加（同名ファイルの既存行は置き換え）
+
+        Args:
+            filename: ファイル名
+            chunk_ids: チャンクIDのリスト
+            texts: チャンクテキストのリスト
+            metadatas: チャンクメタデータのリスト
+            terms: 転置リスト（省略時はテキストから作成）
+        """
+        self.remove_file(filename)
+        if len(chunk_ids) == 0:
+            return
+        if terms is None:
+            terms = FileTerms.from_texts(texts)
+
+        self._offsets[filename] = len(self.chunk_ids)
+        self._files[filename] = terms
+        self.chunk_ids.extend(chunk_ids)
+        self.texts.extend(texts)
+        self.filenames.extend([filename] * len(chunk_ids))
+        self.metadatas.extend(metadatas)
+        self.lengths = np.concatenate([self.lengths, terms.lengths.astype(np.float32)])
+        self._length_norm = None
+        self._file_columns = None
+
+    def remove_file(self, filename: str) -> int:
+        """
+        ファイルの行を削除
+
+        Args:
+            filename: ファイル名
+
+        Returns:
+            削除した行数
+        """
+        self.set_file_attributes(filename, None)
+        terms = self._files.pop(filename, None)
+        if terms is None:
+            return 0
+        start = self._offsets.pop(filename)
+        end = start + len(terms)
+
+        del self.chunk_ids[start:end]
+        del self.texts[start:end]
+        del self.filenames[start:end]
+        del self.metadatas[start:end]
+        self.lengths = np.delete(self.lengths, np.s_[start:end])
+        for name, offset in self._offsets.items():
+            if offset > start:
+                self._offsets[name] = offset - len(terms)
+        self._length_norm = None
+        self._file_columns = None
+        return len(terms)
+
+    def set_file_attributes(self, filename: str, attributes: Optional[Dict[str, Any]]):
+        """
+        ファイル属性を設定（Noneの場合は削除）
+
+        Args:
+            filename: ファイル名
+            attributes: search_filter.file_attributes の辞書
+        """
+        if attributes is None:
+            if self.file_attributes.pop(filename, None) is None:
+                return
+        else:
+            self.file_attributes[filename] = attributes
+        self._file_columns = None
+
+    def filter_files(self, search_filter: Optional[SearchFilter]) -> Optional[Set[str]]:
+        """
+        フィルタに一致するファイル名を取得
+
+        Args:
+            search_filter: 検索フィルタ
+
+        Returns:
+            ファイル名の集合（フィルタなしの場合はNone）
+        """
+        if search_filter is None or search_filter.is_empty():
+            return None
+        if self._file_columns is None:
+            self._file_columns = FileColumns(list(self._files), self.file_attributes)
+        mask = self._file_columns.mask(search_filter)
+        return set(self._file_columns.names[mask].tolist())
+
+    def resident_bytes(self) -> int:
+        """インデックス全体のメモリ使用量の概算（転置リスト・テキスト）"""
+        total = self.lengths.nbytes
+        for terms in self._files.values():
+            total += terms.indptr.nbytes + terms.rows.nbytes + terms.tfs.nbytes + terms.lengths.nbytes
+            total += sum(sys.getsizeof(term) for term in terms.terms)
+        return int(total + sum(sys.getsizeof(text) for text in self.texts))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        filenames: Optional[Set[str]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        BM25で上位top_k件を検索
+
+        Args:
+            query: 検索クエリ
+            top_k: 返す結果の最大数
+            filenames: スコアリングするファイル（filter_filesの結果。IDFはライブラリ全体で計算）
+
+        Returns:
+            (行番号, スコア) のリスト（スコア降順、一致しない行は含まない）
+        """
+        terms = set(tokenize(query))
+        if len(self) == 0 or top_k <= 0 or not terms:
+            return []
+
+        if self._length_norm is None:
+            average = float(self.lengths.mean()) or 1.0
+            self._length_norm = self.k1 * (1 - self.b + self.b * self.lengths / average)
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in terms:
+            blocks = []
+            frequency = 0
+            for filename, file_terms in self._files.items():
+                found = file_terms.postings(term)
+                if found is None:
+                    continue
+                frequency += len(found[0])
+                if filenames is None or filename in filenames:
+                    blocks.append((found[0] + self._offsets[filename], found[1]))
+            if not blocks:
+                continue
+            rows = np.concatenate([rows for rows, _ in blocks])
+            tfs = np.concatenate([tfs for _, tfs in blocks]).astype(np.float32)
+            idf = math.log(1 + (len(self) - frequency + 0.5) / (frequency + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[rows])
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return []
+        candidate_scores = scores[candidates]
+        if len(candidates) > top_k:
+            top = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+            candidates = candidates[top]
+            candidate_scores = candidate_scores[top]
+
+        order = np.argsort(-candidate_scores, kind='stable')
+        return [(int(candidates[i]), float(candidate_scores[i])) for i in order]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Any]],
+    k: int = 60
+) -> List[Tuple[Any, float]]:
+    """
+    複数の順位リストをRRF（Σ 1 / (k + 順位)）で統合
+
+    Args:
+        rankings: キーの順位リスト（それぞれ上位から）
+        k: 下位の順位の影響を抑える定数
+
+    Returns:
+        (キー, 統合スコア) のリスト（スコア降順）
+    """
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
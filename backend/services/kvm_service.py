@@ -1,16 +1,138 @@
 """
 KVM (Key-Value Management) サービス
-DynamoDB/CosmosDBを使用したメタデータ管理
+DynamoDB/CosmosDBを使用したメタデータ管理（ローカル環境ではSQLite）
 
 仕様書: /makoto/docs/仕様書/データ保存仕様書.md#kvm連携
 """
 
 import os
 import json
-from typing import Dict, Any, List, Optional
+import base64
+from typing import Dict, Any, List, Optional, Tuple, Iterator
 from datetime import datetime
 import asyncio
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+
+# トランザクション1回の操作数の上限（DynamoDB TransactWriteItems・Cosmos DBトランザクションバッチ）
+TRANSACTION_LIMIT = 100
+# Cosmos DBの部分更新（patch_item）1回の操作数の上限
+COSMOS_PATCH_LIMIT = 10
+# バッチ操作の未処理分（スロットリング）・条件付き更新の競合の再試行回数
+BATCH_MAX_ATTEMPTS = int(os.getenv('KVM_BATCH_MAX_ATTEMPTS', '8'))
+
+
+def _encode_start_key(pk: str, position: Any) -> str:
+    """
+    ページの続きの位置を不透明なキー（URLセーフなBase64）に符号化
+    位置の形式はバックエンドごとに異なる（DynamoDBはLastEvaluatedKey、CosmosDBは継続トークン、ローカルは最後のSK）
+    """
+    payload = json.dumps({'pk': pk, 'position': position}, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_start_key(pk: str, start_key: str) -> Any:
+    """
+    _encode_start_keyで符号化したキーから位置を取り出す
+
+    Raises:
+        ValueError: キーが不正、または別のPKのクエリのキーの場合
+    """
+    try:
+        padded = start_key + '=' * (-len(start_key) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except ValueError:
+        raise ValueError("start_keyが不正です")
+    if not isinstance(payload, dict) or payload.get('pk') != pk or 'position' not in payload:
+        raise ValueError("start_keyが不正です")
+    return payload['position']
+
+
+def _decode_sk_start_key(pk: str, start_key: str) -> str:
+    """ローカル実装のキー（最後のSK）を取り出す"""
+    position = _decode_start_key(pk, start_key)
+    if not isinstance(position, str):
+        raise ValueError("start_keyが不正です")
+    return position
+
+
+def _chunks(values: List[Any], size: int) -> Iterator[List[Any]]:
+    """サービスの上限ごとに分割"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _group_by_pk(items: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """アイテムをPKごとにまとめる（Cosmos DBのバッチはパーティション単位）"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for item in items:
+        groups.setdefault(item['PK'], []).append(item)
+    return groups
+
+
+def _counter_increments(updates: Dict[str, Any], increments: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    更新内容を設定する値と加算する値に分ける
+    互換性のため、updatesのmessage_countに整数を指定した場合も加算として扱う
+    """
+    values = dict(updates)
+    counters = dict(increments or {})
+    if isinstance(values.get('message_count'), int):
+        counters['message_count'] = counters.get('message_count', 0) + values.pop('message_count')
+    return values, counters
+
+
+def _apply_updates(existing: Dict[str, Any], updates: Dict[str, Any],
+                   increments: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """更新を適用（加算する値は属性がなければ0から）"""
+    values, counters = _counter_increments(updates, increments)
+    existing.update(values)
+    for key, value in counters.items():
+        existing[key] = existing.get(key, 0) + value
+    return existing
+
+
+def _matches(existing: Dict[str, Any], expected: Optional[Dict[str, Any]]) -> bool:
+    """条件付き更新の条件（属性の値が全て一致するか）"""
+    return all(existing.get(key) == value for key, value in (expected or {}).items())
+
+
+def _check_update(updates: Optional[Dict[str, Any]], increments: Optional[Dict[str, Any]]):
+    """
+    更新内容を検証（全ての実装で同じ扱いにする）
+    
+    Raises:
+        ValueError: updatesとincrementsがどちらも空の場合
+    """
+    if not (updates or increments):
+        raise ValueError("更新にはupdatesかincrementsが必要です")
+
+
+def _check_transaction(operations: List[Dict[str, Any]]):
+    """
+    transact_writeの操作を検証
+    
+    Raises:
+        ValueError: 操作数が上限を超える場合、または不正な操作の場合
+    """
+    if len(operations) > TRANSACTION_LIMIT:
+        raise ValueError(f"1回のトランザクションの操作は{TRANSACTION_LIMIT}件までです")
+    required = {'put': ('item',), 'update': ('pk', 'sk'), 'delete': ('pk', 'sk')}
+    for operation in operations:
+        fields = required.get(operation.get('action'))
+        if fields is None or any(field not in operation for field in fields):
+            raise ValueError(f"不正なトランザクションの操作です: {operation.get('action')}")
+        if operation['action'] == 'update':
+            _check_update(operation.get('updates'), operation.get('increments'))
+
+
+class _ItemNotFound(Exception):
+    """更新対象のアイテムが存在しない（トランザクションを中断する）"""
+
+
+class _ConditionFailed(Exception):
+    """条件付き更新の条件を満たさない（トランザクションを中断する）"""
 
 
 class KVMServiceBase(ABC):
@@ -26,45 +148,193 @@ class KVMServiceBase(ABC):
         """アイテムを取得"""
         pass
     
-    @abstractmethod
     async def query(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
                    scan_forward: bool = False) -> List[Dict[str, Any]]:
-        """アイテムをクエリ"""
+        """アイテムをクエリ（先頭のページのみ）"""
+        page = await self.query_page(pk, sk_prefix=sk_prefix, page_size=page_size, scan_forward=scan_forward)
+        return page['items']
+    
+    @abstractmethod
+    async def query_page(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
+                        scan_forward: bool = False, start_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        アイテムを1ページ分クエリ
+        
+        Args:
+            pk: パーティションキー
+            sk_prefix: SKのプレフィックス
+            page_size: 1ページの最大件数
+            scan_forward: SKの昇順（Falseの場合は降順）
+            start_key: 前のページのnext_key（Noneの場合は先頭から）
+        
+        Returns:
+            {'items': アイテムのリスト, 'next_key': 次のページのキー（最後のページの場合はNone）}
+            next_keyは同じ条件のクエリにだけ使える不透明な文字列
+        
+        Raises:
+            ValueError: start_keyが不正な場合
+        """
         pass
     
     @abstractmethod
-    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any]) -> Dict[str, Any]:
-        """アイテムを更新"""
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any],
+                          increments: Optional[Dict[str, Any]] = None,
+                          expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        アイテムを更新（存在しないアイテムは更新しない）
+        
+        Args:
+            pk: パーティションキー
+            sk: ソートキー
+            updates: 設定する値（互換性のため、message_countに整数を指定した場合は加算）
+            increments: サーバー側でアトミックに加算する値（負の値で減算。属性がなければ0から）
+            expected: 更新の条件（全ての属性の値が一致する場合のみ更新）
+        
+        Returns:
+            {'success': True, 'item': 更新後のアイテム}、または
+            {'success': False, 'error': 'Item not found' / 'Condition failed' / エラー}
+        
+        Raises:
+            ValueError: updatesとincrementsがどちらも空の場合
+        """
         pass
     
     @abstractmethod
     async def delete_item(self, pk: str, sk: str) -> Dict[str, Any]:
         """アイテムを削除"""
         pass
+    
+    async def batch_get_items(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        複数のアイテムをまとめて取得（バッチ取得のない実装では並行して取得）
+        
+        Args:
+            keys: (PK, SK) のリスト
+        
+        Returns:
+            keysと同じ順序のアイテムのリスト（存在しない場合はNone）
+        """
+        return list(await asyncio.gather(*[self.get_item(pk, sk) for pk, sk in keys]))
+    
+    async def batch_put_items(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        複数のアイテムをまとめて保存（同じキーのアイテムは置き換え。全体としてはアトミックではない）
+        
+        Returns:
+            {'success': True, 'count': 件数}、または {'success': False, 'error': エラー}
+        """
+        results = await asyncio.gather(*[self.put_item(item) for item in items])
+        errors = [result.get('error') for result in results if not result.get('success')]
+        if errors:
+            return {'success': False, 'error': errors[0]}
+        return {'success': True, 'count': len(items)}
+    
+    async def batch_delete_items(self, keys: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """
+        複数のアイテムをまとめて削除（存在しないアイテムは無視。全体としてはアトミックではない）
+        
+        Returns:
+            {'success': True, 'count': 件数}、または {'success': False, 'error': エラー}
+        """
+        await asyncio.gather(*[self.delete_item(pk, sk) for pk, sk in keys])
+        return {'success': True, 'count': len(keys)}
+    
+    async def transact_write(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        複数の書き込みをまとめて実行（トランザクションのない実装では順に実行し、失敗した時点で中断）
+        
+        Args:
+            operations: 操作のリスト（TRANSACTION_LIMIT件まで）
+                {'action': 'put', 'item': アイテム}
+                {'action': 'update', 'pk': PK, 'sk': SK, 'updates': 設定する値, 'increments': 加算する値,
+                 'expected': 条件}（updates・increments・expectedは省略可。アイテムが存在しないか条件を満たさない場合は失敗）
+                {'action': 'delete', 'pk': PK, 'sk': SK, 'expected': 条件}（expectedは省略可。指定した場合は
+                 空の辞書でも、アイテムが存在しないか条件を満たさない場合は失敗）
+        
+        Returns:
+            {'success': True}、または {'success': False, 'error': エラー}
+        
+        Raises:
+            ValueError: 操作数が上限を超える場合、または不正な操作の場合
+        """
+        _check_transaction(operations)
+        for operation in operations:
+            action = operation['action']
+            if action == 'put':
+                result = await self.put_item(operation['item'])
+            elif action == 'update':
+                result = await self.update_item(
+                    operation['pk'], operation['sk'], operation.get('updates', {}),
+                    increments=operation.get('increments'), expected=operation.get('expected')
+                )
+            else:
+                if operation.get('expected') is not None:
+                    existing = await self.get_item(operation['pk'], operation['sk'])
+                    if not existing:
+                        return {'success': False, 'error': 'Item not found'}
+                    if not _matches(existing, operation['expected']):
+                        return {'success': False, 'error': 'Condition failed'}
+                result = await self.delete_item(operation['pk'], operation['sk'])
+            if not result.get('success'):
+                return {'success': False, 'error': result.get('error')}
+        return {'success': True}
+    
+    async def close(self):
+        """接続を閉じる（共有の接続を持つ実装のみ）"""
+        pass
 
 
 class DynamoDBService(KVMServiceBase):
-    """DynamoDB実装"""
+    """
+    DynamoDB実装（aioboto3）
+    - リソースは最初の呼び出しで作成し、全リクエストで共有する（接続プールの上限はKVM_MAX_CONNECTIONS）
+    - スレッドプールを使わないため、同時実行数はイベントループと接続数だけで決まる
+    """
     
     def __init__(self):
         try:
-            import boto3
+            import aioboto3
+            from aiobotocore.config import AioConfig
             from botocore.exceptions import ClientError
             
-            self.dynamodb = boto3.resource('dynamodb', 
-                                          region_name=os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1'))
+            self.session = aioboto3.Session()
+            self.region_name = os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
             self.table_name = os.getenv('DYNAMODB_TABLE_NAME', 'makoto-metadata')
-            self.table = self.dynamodb.Table(self.table_name)
+            self.config = AioConfig(max_pool_connections=int(os.getenv('KVM_MAX_CONNECTIONS', '50')))
             self.ClientError = ClientError
         except ImportError:
-            raise ImportError("boto3がインストールされていません。pip install boto3を実行してください。")
+            raise ImportError("aioboto3がインストールされていません。pip install aioboto3を実行してください。")
+        
+        self._resource_context = None
+        self._resource = None
+        self._table = None
+        self._table_lock = asyncio.Lock()
+    
+    async def _get_table(self):
+        """共有のテーブルリソースを取得（初回のみ作成）"""
+        if self._table is None:
+            async with self._table_lock:
+                if self._table is None:
+                    self._resource_context = self.session.resource(
+                        'dynamodb', region_name=self.region_name, config=self.config
+                    )
+                    self._resource = await self._resource_context.__aenter__()
+                    self._table = await self._resource.Table(self.table_name)
+        return self._table
+    
+    async def close(self):
+        """共有のリソース（接続プール）を閉じる"""
+        if self._resource_context is not None:
+            await self._resource_context.__aexit__(None, None, None)
+            self._resource_context = None
+            self._resource = None
+            self._table = None
     
     async def put_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
         """アイテムを保存"""
         try:
-            # 同期処理を非同期で実行
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(None, self.table.put_item, {'Item': item})
+            table = await self._get_table()
+            response = await table.put_item(Item=item)
             return {'success': True, 'response': response}
         except self.ClientError as e:
             return {'success': False, 'error': str(e)}
@@ -72,116 +342,285 @@ class DynamoDBService(KVMServiceBase):
     async def get_item(self, pk: str, sk: str) -> Optional[Dict[str, Any]]:
         """アイテムを取得"""
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                self.table.get_item,
-                {'Key': {'PK': pk, 'SK': sk}}
-            )
+            table = await self._get_table()
+            response = await table.get_item(Key={'PK': pk, 'SK': sk})
             return response.get('Item')
         except self.ClientError as e:
             print(f"DynamoDB get_item error: {e}")
             return None
     
-    async def query(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
-                   scan_forward: bool = False) -> List[Dict[str, Any]]:
-        """アイテムをクエリ"""
+    async def query_page(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
+                        scan_forward: bool = False, start_key: Optional[str] = None) -> Dict[str, Any]:
+        """アイテムを1ページ分クエリ（続きはExclusiveStartKeyで取得）"""
+        from boto3.dynamodb.conditions import Key
+        
+        key_condition = Key('PK').eq(pk)
+        if sk_prefix:
+            key_condition = key_condition & Key('SK').begins_with(sk_prefix)
+        
+        params = {
+            'KeyConditionExpression': key_condition,
+            'ScanIndexForward': scan_forward,
+            'Limit': page_size
+        }
+        if start_key:
+            params['ExclusiveStartKey'] = _decode_start_key(pk, start_key)
+        
         try:
-            from boto3.dynamodb.conditions import Key
-            
-            key_condition = Key('PK').eq(pk)
-            if sk_prefix:
-                key_condition = key_condition & Key('SK').begins_with(sk_prefix)
-            
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.table.query(
-                    KeyConditionExpression=key_condition,
-                    ScanIndexForward=scan_forward,
-                    Limit=page_size
-                )
-            )
-            return response.get('Items', [])
+            table = await self._get_table()
+            response = await table.query(**params)
         except self.ClientError as e:
             print(f"DynamoDB query error: {e}")
-            return []
+            return {'items': [], 'next_key': None}
+        
+        last_key = response.get('LastEvaluatedKey')
+        return {
+            'items': response.get('Items', []),
+            'next_key': _encode_start_key(pk, last_key) if last_key else None
+        }
     
-    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any]) -> Dict[str, Any]:
-        """アイテムを更新（アトミック更新）"""
-        try:
-            # 更新式を構築
-            update_expression_parts = []
-            expression_attribute_names = {}
-            expression_attribute_values = {}
+    @staticmethod
+    def _condition_expression(expected: Optional[Dict[str, Any]], expression_attribute_names: Dict[str, str],
+                              expression_attribute_values: Dict[str, Any]) -> str:
+        """条件式を構築（アイテムが存在し、expectedの属性の値が全て一致する）"""
+        expression_attribute_names['#PK'] = 'PK'
+        condition_parts = ["attribute_exists(#PK)"]
+        for key, value in (expected or {}).items():
+            attr_name = f"#{key}"
+            attr_value = f":exp_{key}"
             
-            for key, value in updates.items():
-                # DynamoDBの予約語対策
-                attr_name = f"#{key}"
-                attr_value = f":{key}"
-                
-                expression_attribute_names[attr_name] = key
-                expression_attribute_values[attr_value] = value
-                
-                if key == 'message_count' and isinstance(value, int):
-                    # カウンターのインクリメント
-                    update_expression_parts.append(f"{attr_name} = {attr_name} + {attr_value}")
-                else:
-                    update_expression_parts.append(f"{attr_name} = {attr_value}")
+            expression_attribute_names[attr_name] = key
+            expression_attribute_values[attr_value] = value
+            condition_parts.append(f"{attr_name} = {attr_value}")
+        return " AND ".join(condition_parts)
+    
+    @staticmethod
+    def _update_expression(updates: Dict[str, Any], increments: Optional[Dict[str, Any]] = None,
+                           expected: Optional[Dict[str, Any]] = None) -> Tuple[str, str, Dict[str, str], Dict[str, Any]]:
+        """更新式・条件式・属性名・属性値を構築"""
+        values, counters = _counter_increments(updates, increments)
+        update_expression_parts = []
+        expression_attribute_names = {'#PK': 'PK'}
+        expression_attribute_values = {}
+        
+        for key, value in values.items():
+            # DynamoDBの予約語対策
+            attr_name = f"#{key}"
+            attr_value = f":{key}"
             
-            update_expression = "SET " + ", ".join(update_expression_parts)
+            expression_attribute_names[attr_name] = key
+            expression_attribute_values[attr_value] = value
+            update_expression_parts.append(f"{attr_name} = {attr_value}")
+        
+        for key, value in counters.items():
+            # カウンターのインクリメント（属性がなければ0から）
+            attr_name = f"#{key}"
+            attr_value = f":inc_{key}"
             
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.table.update_item(
-                    Key={'PK': pk, 'SK': sk},
-                    UpdateExpression=update_expression,
-                    ExpressionAttributeNames=expression_attribute_names,
-                    ExpressionAttributeValues=expression_attribute_values,
-                    ReturnValues='ALL_NEW'
-                )
+            expression_attribute_names[attr_name] = key
+            expression_attribute_values[attr_value] = value
+            expression_attribute_values[':zero'] = 0
+            update_expression_parts.append(f"{attr_name} = if_not_exists({attr_name}, :zero) + {attr_value}")
+        
+        # 存在しないアイテムは作成しない
+        condition_expression = DynamoDBService._condition_expression(
+            expected, expression_attribute_names, expression_attribute_values
+        )
+        
+        update_expression = "SET " + ", ".join(update_expression_parts)
+        return update_expression, condition_expression, expression_attribute_names, expression_attribute_values
+    
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any],
+                          increments: Optional[Dict[str, Any]] = None,
+                          expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """アイテムを更新（UpdateItemの1回の呼び出しでアトミックに加算・条件を確認）"""
+        _check_update(updates, increments)
+        try:
+            update_expression, condition_expression, expression_attribute_names, expression_attribute_values = \
+                self._update_expression(updates, increments, expected)
+            
+            table = await self._get_table()
+            response = await table.update_item(
+                Key={'PK': pk, 'SK': sk},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition_expression,
+                ExpressionAttributeNames=expression_attribute_names,
+                ExpressionAttributeValues=expression_attribute_values,
+                ReturnValues='ALL_NEW'
             )
             return {'success': True, 'item': response.get('Attributes', {})}
         except self.ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                # アイテムが存在しないか、条件を満たさない
+                existing = await self.get_item(pk, sk)
+                return {'success': False, 'error': 'Condition failed' if existing else 'Item not found'}
             return {'success': False, 'error': str(e)}
     
     async def delete_item(self, pk: str, sk: str) -> Dict[str, Any]:
         """アイテムを削除"""
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                self.table.delete_item,
-                {'Key': {'PK': pk, 'SK': sk}}
-            )
+            table = await self._get_table()
+            response = await table.delete_item(Key={'PK': pk, 'SK': sk})
             return {'success': True, 'response': response}
         except self.ClientError as e:
             return {'success': False, 'error': str(e)}
+    
+    async def batch_get_items(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """複数のアイテムをまとめて取得（BatchGetItem、100件ずつ。未処理のキーは再送）"""
+        found: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        try:
+            await self._get_table()
+            # 同じリクエスト内の重複キーはエラーになるため除く
+            for chunk in _chunks(list(dict.fromkeys(keys)), 100):
+                request = {self.table_name: {'Keys': [{'PK': pk, 'SK': sk} for pk, sk in chunk]}}
+                for attempt in range(BATCH_MAX_ATTEMPTS):
+                    if attempt:
+                        await asyncio.sleep(min(0.05 * 2 ** attempt, 2.0))  # 指数バックオフ
+                    response = await self._resource.batch_get_item(RequestItems=request)
+                    for item in response.get('Responses', {}).get(self.table_name, []):
+                        found[(item['PK'], item['SK'])] = item
+                    request = response.get('UnprocessedKeys')
+                    if not request:
+                        break
+                else:
+                    print(f"[WARN] DynamoDB batch_get_item: unprocessed keys remain after {BATCH_MAX_ATTEMPTS} attempts")
+        except self.ClientError as e:
+            print(f"DynamoDB batch_get_item error: {e}")
+        return [found.get(key) for key in keys]
+    
+    async def batch_put_items(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数のアイテムをまとめて保存（BatchWriteItem、25件ずつ。未処理のアイテムは再送）"""
+        try:
+            table = await self._get_table()
+            async with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+                for item in items:
+                    await batch.put_item(Item=item)
+            return {'success': True, 'count': len(items)}
+        except self.ClientError as e:
+            return {'success': False, 'error': str(e)}
+    
+    async def batch_delete_items(self, keys: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """複数のアイテムをまとめて削除（BatchWriteItem、25件ずつ。未処理のアイテムは再送）"""
+        try:
+            table = await self._get_table()
+            async with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+                for pk, sk in keys:
+                    await batch.delete_item(Key={'PK': pk, 'SK': sk})
+            return {'success': True, 'count': len(keys)}
+        except self.ClientError as e:
+            return {'success': False, 'error': str(e)}
+    
+    async def transact_write(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数の書き込みをアトミックに実行（TransactWriteItems）"""
+        from boto3.dynamodb.types import TypeSerializer
+        
+        _check_transaction(operations)
+        serializer = TypeSerializer()
+        
+        def serialize(values: Dict[str, Any]) -> Dict[str, Any]:
+            # 低レベルAPIのため型付きの属性値に変換
+            return {name: serializer.serialize(value) for name, value in values.items()}
+        
+        transact_items = []
+        for operation in operations:
+            action = operation['action']
+            if action == 'put':
+                transact_items.append({'Put': {'TableName': self.table_name, 'Item': serialize(operation['item'])}})
+                continue
+            
+            key = serialize({'PK': operation['pk'], 'SK': operation['sk']})
+            if action == 'update':
+                update_expression, condition_expression, names, values = self._update_expression(
+                    operation.get('updates', {}), operation.get('increments'), operation.get('expected')
+                )
+                transact_items.append({'Update': {
+                    'TableName': self.table_name,
+                    'Key': key,
+                    'UpdateExpression': update_expression,
+                    'ConditionExpression': condition_expression,
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': serialize(values)
+                }})
+            elif operation.get('expected') is not None:
+                names: Dict[str, str] = {}
+                values: Dict[str, Any] = {}
+                delete = {
+                    'TableName': self.table_name,
+                    'Key': key,
+                    'ConditionExpression': self._condition_expression(operation['expected'], names, values),
+                    'ExpressionAttributeNames': names
+                }
+                if values:
+                    delete['ExpressionAttributeValues'] = serialize(values)
+                transact_items.append({'Delete': delete})
+            else:
+                transact_items.append({'Delete': {'TableName': self.table_name, 'Key': key}})
+        
+        try:
+            await self._get_table()
+            await self._resource.meta.client.transact_write_items(TransactItems=transact_items)
+            return {'success': True}
+        except self.ClientError as e:
+            return {'success': False, 'error': str(e)}
 
 
 class CosmosDBService(KVMServiceBase):
-    """Azure Cosmos DB実装"""
+    """
+    Azure Cosmos DB実装（azure.cosmos.aio）
+    - クライアントは最初の呼び出しで作成し、全リクエストで共有する（接続プールの上限はKVM_MAX_CONNECTIONS）
+    - スレッドプールを使わないため、同時実行数はイベントループと接続数だけで決まる
+    """
     
     def __init__(self):
         try:
-            from azure.cosmos import CosmosClient, PartitionKey
-            from azure.cosmos.exceptions import CosmosResourceNotFoundError
-            
-            endpoint = os.getenv('COSMOS_ENDPOINT')
-            key = os.getenv('COSMOS_KEY')
-            database_name = os.getenv('COSMOS_DATABASE_NAME', 'makoto-db')
-            container_name = os.getenv('COSMOS_CONTAINER_NAME', 'metadata')
+            import aiohttp
+            from azure.core import MatchConditions
+            from azure.core.pipeline.transport import AioHttpTransport
+            from azure.cosmos.aio import CosmosClient
+            from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosAccessConditionFailedError
             
-            if not endpoint or not key:
-                raise ValueError("COSMOS_ENDPOINTとCOSMOS_KEYが設定されていません")
-            
-            self.client = CosmosClient(endpoint, key)
-            self.database = self.client.get_database_client(database_name)
-            self.container = self.database.get_container_client(container_name)
+            self.aiohttp = aiohttp
+            self.AioHttpTransport = AioHttpTransport
+            self.CosmosClient = CosmosClient
             self.CosmosResourceNotFoundError = CosmosResourceNotFoundError
+            self.CosmosAccessConditionFailedError = CosmosAccessConditionFailedError
+            self.MatchConditions = MatchConditions
         except ImportError:
-            raise ImportError("azure-cosmosがインストールされていません。pip install azure-cosmosを実行してください。")
+            raise ImportError("azure-cosmos（非同期版）またはaiohttpがインストールされていません。pip install azure-cosmos aiohttpを実行してください。")
+        
+        self.endpoint = os.getenv('COSMOS_ENDPOINT')
+        self.key = os.getenv('COSMOS_KEY')
+        self.database_name = os.getenv('COSMOS_DATABASE_NAME', 'makoto-db')
+        self.container_name = os.getenv('COSMOS_CONTAINER_NAME', 'metadata')
+        self.max_connections = int(os.getenv('KVM_MAX_CONNECTIONS', '50'))
+        
+        if not self.endpoint or not self.key:
+            raise ValueError("COSMOS_ENDPOINTとCOSMOS_KEYが設定されていません")
+        
+        self.client = None
+        self._container = None
+        self._container_lock = asyncio.Lock()
+    
+    async def _get_container(self):
+        """共有のコンテナクライアントを取得（初回のみ作成）"""
+        if self._container is None:
+            async with self._container_lock:
+                if self._container is None:
+                    # 接続プールはイベントループ上で作成する必要がある
+                    session = self.aiohttp.ClientSession(connector=self.aiohttp.TCPConnector(limit=self.max_connections))
+                    self.client = self.CosmosClient(self.endpoint, self.key, transport=self.AioHttpTransport(session=session))
+                    self._container = (
+                        self.client.get_database_client(self.database_name)
+                        .get_container_client(self.container_name)
+                    )
+        return self._container
+    
+    async def close(self):
+        """共有のクライアント（接続プール）を閉じる"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self._container = None
     
     async def put_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
         """アイテムを保存"""
@@ -189,8 +628,8 @@ class CosmosDBService(KVMServiceBase):
             # idフィールドを追加（CosmosDBの要件）
             item['id'] = f"{item['PK']}#{item['SK']}"
             
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(None, self.container.create_item, item)
+            container = await self._get_container()
+            response = await container.create_item(item)
             return {'success': True, 'response': response}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -199,23 +638,18 @@ class CosmosDBService(KVMServiceBase):
         """アイテムを取得"""
         try:
             item_id = f"{pk}#{sk}"
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                self.container.read_item,
-                item_id, 
-                partition_key=pk
-            )
-            return response
+            container = await self._get_container()
+            return await container.read_item(item_id, partition_key=pk)
         except self.CosmosResourceNotFoundError:
             return None
         except Exception as e:
             print(f"CosmosDB get_item error: {e}")
             return None
     
-    async def query(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
-                   scan_forward: bool = False) -> List[Dict[str, Any]]:
-        """アイテムをクエリ"""
+    async def query_page(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
+                        scan_forward: bool = False, start_key: Optional[str] = None) -> Dict[str, Any]:
+        """アイテムを1ページ分クエリ（単一パーティション、続きは継続トークンで取得）"""
+        continuation = _decode_start_key(pk, start_key) if start_key else None
         try:
             if sk_prefix:
                 query = f"SELECT * FROM c WHERE c.PK = @pk AND STARTSWITH(c.SK, @sk_prefix)"
@@ -227,50 +661,65 @@ class CosmosDBService(KVMServiceBase):
                 query = f"SELECT * FROM c WHERE c.PK = @pk"
                 parameters = [{"name": "@pk", "value": pk}]
             
-            # ORDER BY追加
-            if not scan_forward:
-                query += " ORDER BY c.SK DESC"
+            # ORDER BY追加（継続トークンで続きを取得するため昇順も明示）
+            query += " ORDER BY c.SK " + ("ASC" if scan_forward else "DESC")
             
-            loop = asyncio.get_event_loop()
-            items = await loop.run_in_executor(
-                None,
-                lambda: list(self.container.query_items(
-                    query=query,
-                    parameters=parameters,
-                    max_item_count=page_size
-                ))
-            )
-            return items
+            # 1ページ分だけ読み込む（イテレータ全体を読み込まない）
+            container = await self._get_container()
+            pages = container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=pk,
+                max_item_count=page_size
+            ).by_page(continuation)
+            items = []
+            async for page in pages:
+                items = [item async for item in page]
+                break
+            token = pages.continuation_token
+            return {
+                'items': items,
+                'next_key': _encode_start_key(pk, token) if token else None
+            }
         except Exception as e:
             print(f"CosmosDB query error: {e}")
-            return []
+            return {'items': [], 'next_key': None}
     
-    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any]) -> Dict[str, Any]:
-        """アイテムを更新"""
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any],
+                          increments: Optional[Dict[str, Any]] = None,
+                          expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        アイテムを更新
+        - 条件がなく操作数が部分更新の上限以内の場合は、patch_itemの1回の呼び出しでサーバー側で更新（加算はincr）
+        - それ以外はETagを条件に読み込み・置き換えし、他の更新と競合した場合は読み込みからやり直す
+        """
+        _check_update(updates, increments)
+        item_id = f"{pk}#{sk}"
+        operations = self._patch_operations(updates, increments)
         try:
-            item_id = f"{pk}#{sk}"
-            
-            # 既存アイテムを取得
-            existing_item = await self.get_item(pk, sk)
-            if not existing_item:
-                return {'success': False, 'error': 'Item not found'}
+            container = await self._get_container()
+            if not expected and 0 < len(operations) <= COSMOS_PATCH_LIMIT:
+                response = await container.patch_item(item_id, partition_key=pk, patch_operations=operations)
+                return {'success': True, 'item': response}
             
-            # 更新を適用
-            for key, value in updates.items():
-                if key == 'message_count' and isinstance(value, int):
-                    # カウンターのインクリメント
-                    existing_item[key] = existing_item.get(key, 0) + value
-                else:
-                    existing_item[key] = value
-            
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                self.container.replace_item,
-                item_id,
-                existing_item
-            )
-            return {'success': True, 'item': response}
+            for _ in range(BATCH_MAX_ATTEMPTS):
+                existing_item = await container.read_item(item_id, partition_key=pk)
+                if not _matches(existing_item, expected):
+                    return {'success': False, 'error': 'Condition failed'}
+                etag = existing_item.get('_etag')
+                try:
+                    response = await container.replace_item(
+                        item_id,
+                        _apply_updates(existing_item, updates, increments),
+                        etag=etag,
+                        match_condition=self.MatchConditions.IfNotModified
+                    )
+                    return {'success': True, 'item': response}
+                except self.CosmosAccessConditionFailedError:
+                    continue  # 読み込み後に他の更新があったため、読み込みからやり直す
+            return {'success': False, 'error': 'Too many concurrent updates'}
+        except self.CosmosResourceNotFoundError:
+            return {'success': False, 'error': 'Item not found'}
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
@@ -278,16 +727,114 @@ class CosmosDBService(KVMServiceBase):
         """アイテムを削除"""
         try:
             item_id = f"{pk}#{sk}"
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                None,
-                self.container.delete_item,
-                item_id,
-                partition_key=pk
-            )
+            container = await self._get_container()
+            await container.delete_item(item_id, partition_key=pk)
             return {'success': True}
         except Exception as e:
             return {'success': False, 'error': str(e)}
+    
+    async def _execute_batches(self, operations_by_pk: Dict[str, List[Tuple[str, tuple]]]):
+        """パーティションごとのトランザクションバッチを100件ずつ並行して実行"""
+        container = await self._get_container()
+        await asyncio.gather(*[
+            container.execute_item_batch(batch_operations=chunk, partition_key=pk)
+            for pk, operations in operations_by_pk.items()
+            for chunk in _chunks(operations, TRANSACTION_LIMIT)
+        ])
+    
+    async def batch_put_items(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数のアイテムをまとめて保存（パーティションごとのトランザクションバッチでupsert）"""
+        try:
+            await self._execute_batches({
+                pk: [('upsert', ({**item, 'id': f"{item['PK']}#{item['SK']}"},)) for item in group]
+                for pk, group in _group_by_pk(items).items()
+            })
+            return {'success': True, 'count': len(items)}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    async def batch_delete_items(self, keys: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """複数のアイテムをまとめて削除（パーティションごとのトランザクションバッチ）"""
+        operations_by_pk: Dict[str, List[Tuple[str, tuple]]] = {}
+        for pk, sk in dict.fromkeys(keys):
+            operations_by_pk.setdefault(pk, []).append(('delete', (f"{pk}#{sk}",)))
+        try:
+            await self._execute_batches(operations_by_pk)
+            return {'success': True, 'count': len(keys)}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    @staticmethod
+    def _patch_operations(updates: Dict[str, Any], increments: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """更新内容を部分更新の操作に変換（加算する値はincr）"""
+        values, counters = _counter_increments(updates, increments)
+        return (
+            [{'op': 'set', 'path': f'/{key}', 'value': value} for key, value in values.items()] +
+            [{'op': 'incr', 'path': f'/{key}', 'value': value} for key, value in counters.items()]
+        )
+    
+    async def transact_write(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        複数の書き込みをアトミックに実行（トランザクションバッチ）
+        Cosmos DBのトランザクションは1パーティション内に限られるため、全操作のPKが同じである必要がある
+        条件（expected）のある操作は事前に読み込んで確認し、読み込んだ時点のETagを条件に実行する
+        """
+        _check_transaction(operations)
+        pks = {operation['item']['PK'] if operation['action'] == 'put' else operation['pk'] for operation in operations}
+        if len(pks) > 1:
+            raise ValueError("Cosmos DBのトランザクションは同じPKの操作に限られます")
+        if not operations:
+            return {'success': True}
+        
+        batch_operations = []
+        for operation in operations:
+            action = operation['action']
+            if action == 'put':
+                item = operation['item']
+                batch_operations.append(('upsert', ({**item, 'id': f"{item['PK']}#{item['SK']}"},)))
+                continue
+            
+            item_id = f"{operation['pk']}#{operation['sk']}"
+            options = {}
+            if operation.get('expected') is not None:
+                # 読み込んだ時点から変更されていない場合のみ実行（ETagを条件にする）
+                try:
+                    options['if_match_etag'] = await self._condition_etag(item_id, operation['pk'], operation['expected'])
+                except _ItemNotFound:
+                    return {'success': False, 'error': f'Item not found: {item_id}'}
+                except _ConditionFailed:
+                    return {'success': False, 'error': f'Condition failed: {item_id}'}
+                except Exception as e:
+                    return {'success': False, 'error': str(e)}
+            if action == 'update':
+                patch_operations = self._patch_operations(operation.get('updates', {}), operation.get('increments'))
+                batch_operations.append(('patch', (item_id, patch_operations), options))
+            else:
+                batch_operations.append(('delete', (item_id,), options))
+        
+        try:
+            container = await self._get_container()
+            await container.execute_item_batch(batch_operations=batch_operations, partition_key=pks.pop())
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    async def _condition_etag(self, item_id: str, pk: str, expected: Dict[str, Any]) -> str:
+        """
+        トランザクションの条件を確認し、アイテムのETagを返す
+        
+        Raises:
+            _ItemNotFound: アイテムが存在しない場合
+            _ConditionFailed: 条件を満たさない場合
+        """
+        container = await self._get_container()
+        try:
+            existing_item = await container.read_item(item_id, partition_key=pk)
+        except self.CosmosResourceNotFoundError:
+            raise _ItemNotFound(item_id)
+        if not _matches(existing_item, expected):
+            raise _ConditionFailed(item_id)
+        return existing_item.get('_etag')
 
 
 class TinyDBKVMService(KVMServiceBase):
@@ -332,10 +879,11 @@ class TinyDBKVMService(KVMServiceBase):
         )
         return results[0] if results else None
     
-    async def query(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
-                   scan_forward: bool = False) -> List[Dict[str, Any]]:
-        """アイテムをクエリ"""
+    async def query_page(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
+                        scan_forward: bool = False, start_key: Optional[str] = None) -> Dict[str, Any]:
+        """アイテムを1ページ分クエリ（続きは最後のSKの次から）"""
         Query = self.Query
+        last_sk = _decode_sk_start_key(pk, start_key) if start_key else None
         
         if sk_prefix:
             # SKプレフィックスでフィルタ
@@ -350,31 +898,39 @@ class TinyDBKVMService(KVMServiceBase):
         # ソート
         results.sort(key=lambda x: x.get('SK', ''), reverse=not scan_forward)
         
+        # 前のページの最後のSKより後から
+        if last_sk is not None:
+            results = [
+                item for item in results
+                if (item.get('SK', '') > last_sk if scan_forward else item.get('SK', '') < last_sk)
+            ]
+        
         # limit適用
-        return results[:page_size]
+        items = results[:page_size]
+        has_more = len(results) > page_size
+        return {
+            'items': items,
+            'next_key': _encode_start_key(pk, items[-1]['SK']) if has_more else None
+        }
     
-    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any]) -> Dict[str, Any]:
-        """アイテムを更新"""
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any],
+                          increments: Optional[Dict[str, Any]] = None,
+                          expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """アイテムを更新（読み込みと書き込みの間にawaitを挟まないため、プロセス内ではアトミック）"""
+        _check_update(updates, increments)
         Query = self.Query
+        condition = (Query.PK == pk) & (Query.SK == sk)
         
         # 既存のアイテムを取得
-        existing = await self.get_item(pk, sk)
-        if not existing:
+        results = self.db.search(condition)
+        if not results:
             return {'success': False, 'error': 'Item not found'}
+        if not _matches(results[0], expected):
+            return {'success': False, 'error': 'Condition failed'}
         
-        # 更新を適用
-        for update_key, value in updates.items():
-            if update_key == 'message_count' and isinstance(value, int):
-                # カウンターのインクリメント
-                existing[update_key] = existing.get(update_key, 0) + value
-            else:
-                existing[update_key] = value
-        
-        # DBを更新
-        self.db.update(
-            existing,
-            (Query.PK == pk) & (Query.SK == sk)
-        )
+        # 更新を適用してDBを更新
+        existing = _apply_updates(dict(results[0]), updates, increments)
+        self.db.update(existing, condition)
         
         return {'success': True, 'item': existing}
     
@@ -394,6 +950,248 @@ class TinyDBKVMService(KVMServiceBase):
         return {'success': True}
 
 
+class SQLiteKVMService(KVMServiceBase):
+    """
+    ローカル環境用のSQLite実装（単一ノード・オンプレミス・CIの負荷試験用）
+    - (PK, SK) を主キーとするテーブルのため、get_itemは主キー検索、queryはSKの範囲走査になる
+    - WALモードのため読み込みは書き込みを待たず、書き込みは変更した行だけを記録する
+    - update_itemは1トランザクションで読み込み・更新するため、カウンターの加算は複数プロセスでもアトミック
+    - put_itemはDynamoDBと同じくアイテム全体を置き換える
+    - SQLiteの呼び出しはブロッキングのため、専用の1スレッドのエグゼキューターで直列に実行する
+      （ディスクI/Oや他プロセスのロック待ちでイベントループを止めない）
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        import sqlite3
+        from pathlib import Path
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.path = path or os.getenv('KVM_SQLITE_PATH', 'data/kvm.sqlite3')
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        
+        # 自動コミット（トランザクションは明示的に開始する）。接続はエグゼキューターのスレッドだけが使う
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "pk TEXT NOT NULL, sk TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (pk, sk)"
+            ") WITHOUT ROWID"
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kvm-sqlite')
+        self._import_tinydb()
+    
+    def _import_tinydb(self, tinydb_path: str = 'data/kvm_tinydb.json'):
+        """空のDBで起動した場合、TinyDB実装のデータを取り込む（初回のみ）"""
+        if not os.path.exists(tinydb_path):
+            return
+        if self.conn.execute("SELECT 1 FROM items LIMIT 1").fetchone():
+            return
+        try:
+            with open(tinydb_path, encoding='utf-8') as f:
+                tables = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Failed to read {tinydb_path}: {str(e)}")
+            return
+        rows = [
+            (item['PK'], item['SK'], self._encode(item))
+            for table in tables.values()
+            for item in table.values()
+            if 'PK' in item and 'SK' in item
+        ]
+        if rows:
+            with self._transaction():
+                self.conn.executemany("INSERT OR REPLACE INTO items (pk, sk, data) VALUES (?, ?, ?)", rows)
+            print(f"[INFO] Imported {len(rows)} items from {tinydb_path}")
+    
+    async def _run(self, func, *args):
+        """SQLiteの処理をエグゼキューターのスレッドで実行"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    @contextmanager
+    def _transaction(self):
+        """書き込みトランザクションを実行（例外時はロールバック）"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+    
+    @staticmethod
+    def _encode(item: Dict[str, Any]) -> str:
+        return json.dumps(item, ensure_ascii=False)
+    
+    @staticmethod
+    def _prefix_upper_bound(prefix: str) -> Optional[str]:
+        """
+        前方一致の範囲の上限（この文字列未満が前方一致）
+        UTF-8のバイト順はコードポイント順と同じなので、末尾の文字を1つ進めればよい
+        """
+        chars = list(prefix)
+        while chars:
+            code = ord(chars.pop()) + 1
+            if code == 0xD800:
+                code = 0xE000  # サロゲートはUTF-8で表せないため飛ばす
+            if code <= 0x10FFFF:
+                return ''.join(chars) + chr(code)
+        return None  # 最大のコードポイントだけの場合は上限なし
+    
+    async def put_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """アイテムを保存（同じキーのアイテムは置き換え）"""
+        await self._run(
+            self.conn.execute,
+            "INSERT OR REPLACE INTO items (pk, sk, data) VALUES (?, ?, ?)",
+            (item['PK'], item['SK'], self._encode(item))
+        )
+        return {'success': True, 'response': item}
+    
+    async def get_item(self, pk: str, sk: str) -> Optional[Dict[str, Any]]:
+        """アイテムを取得"""
+        row = await self._run(self._fetch_row, pk, sk)
+        return json.loads(row[0]) if row else None
+    
+    def _fetch_row(self, pk: str, sk: str) -> Optional[Tuple[str]]:
+        return self.conn.execute("SELECT data FROM items WHERE pk = ? AND sk = ?", (pk, sk)).fetchone()
+    
+    async def query_page(self, pk: str, sk_prefix: str = None, page_size: int = 100, 
+                        scan_forward: bool = False, start_key: Optional[str] = None) -> Dict[str, Any]:
+        """アイテムを1ページ分クエリ（SKプレフィックスと続きの位置は主キーの範囲走査）"""
+        sql = "SELECT sk, data FROM items WHERE pk = ?"
+        params: List[Any] = [pk]
+        if start_key:
+            sql += " AND sk > ?" if scan_forward else " AND sk < ?"
+            params.append(_decode_sk_start_key(pk, start_key))
+        if sk_prefix:
+            sql += " AND sk >= ?"
+            params.append(sk_prefix)
+            upper = self._prefix_upper_bound(sk_prefix)
+            if upper is not None:
+                sql += " AND sk < ?"
+                params.append(upper)
+        # 次のページの有無を判定するため1件多く読む
+        sql += " ORDER BY sk " + ("ASC" if scan_forward else "DESC") + " LIMIT ?"
+        params.append(page_size + 1)
+        
+        rows = await self._run(lambda: self.conn.execute(sql, params).fetchall())
+        page = rows[:page_size]
+        return {
+            'items': [json.loads(data) for _, data in page],
+            'next_key': _encode_start_key(pk, page[-1][0]) if len(rows) > page_size else None
+        }
+    
+    def _update_row(self, pk: str, sk: str, updates: Dict[str, Any],
+                    increments: Optional[Dict[str, Any]] = None,
+                    expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """トランザクション内でアイテムを読み込んで更新"""
+        existing = _apply_updates(self._read_row(pk, sk, expected), updates, increments)
+        self.conn.execute(
+            "UPDATE items SET data = ? WHERE pk = ? AND sk = ?",
+            (self._encode(existing), pk, sk)
+        )
+        return existing
+    
+    def _read_row(self, pk: str, sk: str, expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """トランザクション内でアイテムを読み込み、条件を確認"""
+        row = self._fetch_row(pk, sk)
+        if not row:
+            raise _ItemNotFound(f"{pk}/{sk}")
+        existing = json.loads(row[0])
+        if not _matches(existing, expected):
+            raise _ConditionFailed(f"{pk}/{sk}")
+        return existing
+    
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any],
+                          increments: Optional[Dict[str, Any]] = None,
+                          expected: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """アイテムを更新（条件の確認・加算を含めて読み込みから書き込みまで1トランザクション）"""
+        _check_update(updates, increments)
+        
+        def update():
+            with self._transaction():
+                return self._update_row(pk, sk, updates, increments, expected)
+        
+        try:
+            existing = await self._run(update)
+        except _ItemNotFound:
+            return {'success': False, 'error': 'Item not found'}
+        except _ConditionFailed:
+            return {'success': False, 'error': 'Condition failed'}
+        return {'success': True, 'item': existing}
+    
+    async def delete_item(self, pk: str, sk: str) -> Dict[str, Any]:
+        """アイテムを削除"""
+        deleted = await self._run(
+            lambda: self.conn.execute("DELETE FROM items WHERE pk = ? AND sk = ?", (pk, sk)).rowcount
+        )
+        if not deleted:
+            return {'success': False, 'error': 'Item not found'}
+        return {'success': True}
+    
+    async def batch_get_items(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """複数のアイテムをまとめて取得（エグゼキューターへの1回の受け渡しで主キー検索）"""
+        rows = await self._run(lambda: [self._fetch_row(pk, sk) for pk, sk in keys])
+        return [json.loads(row[0]) if row else None for row in rows]
+    
+    async def batch_put_items(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数のアイテムを1トランザクションで保存"""
+        rows = [(item['PK'], item['SK'], self._encode(item)) for item in items]
+        
+        def put():
+            with self._transaction():
+                self.conn.executemany("INSERT OR REPLACE INTO items (pk, sk, data) VALUES (?, ?, ?)", rows)
+        
+        await self._run(put)
+        return {'success': True, 'count': len(items)}
+    
+    async def batch_delete_items(self, keys: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """複数のアイテムを1トランザクションで削除"""
+        keys = list(keys)
+        
+        def delete():
+            with self._transaction():
+                self.conn.executemany("DELETE FROM items WHERE pk = ? AND sk = ?", keys)
+        
+        await self._run(delete)
+        return {'success': True, 'count': len(keys)}
+    
+    async def transact_write(self, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数の書き込みを1トランザクションで実行（更新対象が存在しない場合は全体をロールバック）"""
+        _check_transaction(operations)
+        
+        def write():
+            with self._transaction():
+                for operation in operations:
+                    action = operation['action']
+                    if action == 'put':
+                        item = operation['item']
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO items (pk, sk, data) VALUES (?, ?, ?)",
+                            (item['PK'], item['SK'], self._encode(item))
+                        )
+                    elif action == 'update':
+                        self._update_row(
+                            operation['pk'], operation['sk'], operation.get('updates', {}),
+                            operation.get('increments'), operation.get('expected')
+                        )
+                    else:
+                        if operation.get('expected') is not None:
+                            self._read_row(operation['pk'], operation['sk'], operation['expected'])
+                        self.conn.execute(
+                            "DELETE FROM items WHERE pk = ? AND sk = ?", (operation['pk'], operation['sk'])
+                        )
+        
+        try:
+            await self._run(write)
+        except _ItemNotFound as e:
+            return {'success': False, 'error': f'Item not found: {e}'}
+        except _ConditionFailed as e:
+            return {'success': False, 'error': f'Condition failed: {e}'}
+        return {'success': True}
+
+
 # KVMサービスのシングルトンインスタンス
 def get_kvm_service() -> KVMServiceBase:
     """環境変数に基づいてKVMサービスを取得"""
@@ -403,9 +1201,11 @@ def get_kvm_service() -> KVMServiceBase:
         return DynamoDBService()
     elif kvm_type == 'cosmosdb':
         return CosmosDBService()
-    else:
-        # 開発環境ではTinyDBを使用（永続化）
+    elif kvm_type == 'tinydb':
         return TinyDBKVMService()
+    else:
+        # 開発環境・単一ノードではSQLiteを使用（永続化）
+        return SQLiteKVMService()
 
 
 # グローバルインスタンス
@@ -36,6 +36,7 @@ class LibraryService:
         name: str,
         description: str = "",
         metadata: Optional[Dict[str, Any]] = None,
+        embedding_dimension: Optional[int] = None,
         tenant_id: str = "default_tenant",
         user_id: str = "default_user"
     ) -> Dict[str, Any]:
@@ -46,6 +47,7 @@ class LibraryService:
             name: ライブラリ名
             description: 説明
             metadata: メタデータ
+            embedding_dimension: エンベディングの次元数（Noneの場合はモデルの次元数）
             tenant_id: テナントID
             user_id: ユーザーID
             
@@ -68,7 +70,8 @@ class LibraryService:
             'updated_at': datetime.utcnow().isoformat(),
             'metadata': metadata or {},
             'embedding_status': 'idle',  # idle, processing, completed, failed
-            'vector_count': 0
+            'vector_count': 0,
+            'embedding_dimension': embedding_dimension
         }
         
         await kvm_service.put_item(library_item)
@@ -81,7 +84,8 @@ class LibraryService:
             'total_size': 0,
             'created_at': library_item['created_at'],
             'updated_at': library_item['updated_at'],
-            'metadata': metadata or {}
+            'metadata': metadata or {},
+            'embedding_dimension': embedding_dimension
         }
     
     @staticmethod
@@ -119,7 +123,8 @@ class LibraryService:
                 'created_at': item.get('created_at'),
                 'updated_at': item.get('updated_at'),
                 'embedding_status': item.get('embedding_status', 'idle'),
-                'vector_count': item.get('vector_count', 0)
+                'vector_count': item.get('vector_count', 0),
+                'embedding_dimension': item.get('embedding_dimension')
             })
         
         return libraries
@@ -179,7 +184,8 @@ class LibraryService:
             'updated_at': library_item.get('updated_at'),
             'metadata': library_item.get('metadata', {}),
             'embedding_status': library_item.get('embedding_status', 'idle'),
-            'vector_count': library_item.get('vector_count', 0)
+            'vector_count': library_item.get('vector_count', 0),
+            'embedding_dimension': library_item.get('embedding_dimension')
         }
     
     @staticmethod
@@ -188,6 +194,7 @@ class LibraryService:
         name: Optional[str] = None,
         description: Optional[str] = None,
         metadata: Optional[Dict[str, Any]] = None,
+        embedding_dimension: Optional[int] = None,
         tenant_id: str = "default_tenant",
         user_id: str = "default_user"
     ) -> Optional[Dict[str, Any]]:
@@ -199,6 +206,7 @@ class LibraryService:
             name: 新しい名前
             description: 新しい説明
             metadata: 新しいメタデータ
+            embedding_dimension: 新しいエンベディング次元数
             tenant_id: テナントID
             user_id: ユーザーID
             
@@ -218,6 +226,8 @@ class LibraryService:
             updates['description'] = description
         if metadata is not None:
             updates['metadata'] = metadata
+        if embedding_dimension is not None:
+            updates['embedding_dimension'] = embedding_dimension
         
         result = await kvm_service.update_item(pk, sk, updates)
         
@@ -253,21 +263,19 @@ class LibraryService:
             page_size=1000
         )
         
-        deleted_files = 0
+        deleted_keys = []
         for file_item in file_items:
             filename = file_item.get('filename')
             if filename:
-                # S3/BlobStorageからファイルを削除
-                storage_key = f"{tenant_id}/library/{library_id}/{filename}"
+                # S3/BlobStorageからファイルを削除（保存時のストレージキーを使用）
+                storage_key = file_item.get('storage_key') or f"{tenant_id}/library/{library_id}/{filename}"
                 await storage_service.delete_object(storage_key)
-                
-                # KVMからファイル情報を削除
-                await kvm_service.delete_item(pk, file_item['SK'])
-                deleted_files += 1
+                deleted_keys.append((pk, file_item['SK']))
         
-        # ライブラリメタデータを削除
+        # KVMからファイル情報とライブラリメタデータをまとめて削除
         sk = f"LIBRARY#{library_id}"
-        await kvm_service.delete_item(pk, sk)
+        await kvm_service.batch_delete_items(deleted_keys + [(pk, sk)])
+        deleted_files = len(deleted_keys)
         
         # エンベディングも削除（将来実装）
         # TODO: vector_db.delete_library_embeddings(library_id)
@@ -353,18 +361,29 @@ class LibraryService:
             'embedding_status': 'pending',  # エンベディング待ち
             'chunk_count': 0
         }
-        await kvm_service.put_item(file_item)
-        
-        # ライブラリのファイル数とサイズを更新
-        updates = {
-            'file_count': library_item.get('file_count', 0) + 1,
-            'total_size': library_item.get('total_size', 0) + file_size,
-            'updated_at': datetime.utcnow().isoformat()
-        }
-        await kvm_service.update_item(pk, library_sk, updates)
         
-        # 自動エンベディング開始（非同期タスクとして）
-        # TODO: asyncio.create_task(start_embedding(library_id, filename))
+        # ファイル情報の保存とライブラリのファイル数・サイズの加算を1回のトランザクションで
+        result = await kvm_service.transact_write([
+            {'action': 'put', 'item': file_item},
+            {
+                'action': 'update',
+                'pk': pk,
+                'sk': library_sk,
+                'updates': {'updated_at': datetime.utcnow().isoformat()},
+                'increments': {'file_count': 1, 'total_size': file_size}
+            }
+        ])
+        if not result.get('success'):
+            raise Exception(f"Failed to save file metadata: {result.get('error')}")
+        
+        # 自動エンベディング（バックグラウンドのジョブとして投入）
+        embedding_status = 'pending'
+        job_id = None
+        if os.getenv('EMBEDDING_AUTO_ON_UPLOAD', 'true').lower() == 'true':
+            from services.embedding_job_service import embedding_job_service
+            job = await embedding_job_service.enqueue(library_id, filename, tenant_id, user_id)
+            embedding_status = job['status']
+            job_id = job['job_id']
         
         return {
             'filename': filename,
@@ -372,7 +391,8 @@ class LibraryService:
             'content_type': content_type,
             'uploaded_at': file_item['uploaded_at'],
             'library_id': library_id,
-            'embedding_status': 'pending'
+            'embedding_status': embedding_status,
+            'embedding_job_id': job_id
         }
     
     @staticmethod
@@ -398,6 +418,7 @@ class LibraryService:
         
         # ファイル情報を取得
         file_sk = f"LIBRARY#{library_id}#FILE#{filename}"
+        library_sk = f"LIBRARY#{library_id}"
         file_item = await kvm_service.get_item(pk, file_sk)
         if not file_item:
             raise ValueError(f"File {filename} not found in library {library_id}")
@@ -408,22 +429,26 @@ class LibraryService:
             raise ValueError(f"Storage key not found for file {filename}")
         await storage_service.delete_object(storage_key)
         
-        # KVMからファイル情報を削除
-        await kvm_service.delete_item(pk, file_sk)
-        
-        # ライブラリのファイル数とサイズを更新
-        library_sk = f"LIBRARY#{library_id}"
-        library_item = await kvm_service.get_item(pk, library_sk)
-        if library_item:
-            updates = {
-                'file_count': max(0, library_item.get('file_count', 1) - 1),
-                'total_size': max(0, library_item.get('total_size', 0) - file_item.get('size', 0)),
-                'updated_at': datetime.utcnow().isoformat()
+        # KVMからファイル情報を削除し、ライブラリのファイル数とサイズを減算（1回のトランザクション）
+        # 読み込んだファイル情報が残っている場合のみ削除するため、並行した削除では1回だけ減算される
+        delete_file_item = {'action': 'delete', 'pk': pk, 'sk': file_sk, 'expected': {'storage_key': storage_key}}
+        result = await kvm_service.transact_write([
+            delete_file_item,
+            {
+                'action': 'update',
+                'pk': pk,
+                'sk': library_sk,
+                'updates': {'updated_at': datetime.utcnow().isoformat()},
+                'increments': {'file_count': -1, 'total_size': -file_item.get('size', 0)}
             }
-            await kvm_service.update_item(pk, library_sk, updates)
-        
-        # エンベディングも削除（将来実装）
-        # TODO: vector_db.delete_file_embeddings(library_id, filename)
+        ])
+        if not result.get('success'):
+            # ライブラリの情報がない場合もファイル情報は削除する（他の削除で削除済みの場合は何もしない）
+            await kvm_service.transact_write([delete_file_item])
+        
+        # エンベディングも削除（墓標を記録し、ロード済みインデックスからも削除）
+        from services.embedding_service import embedding_service
+        await embedding_service.delete_file_embeddings(library_id, filename, tenant_id)
         
         return {
             'message': 'File deleted successfully',
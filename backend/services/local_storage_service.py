@@ -97,6 +97,27 @@ class LocalStorageService:
             "ContentLength": len(content) if is_binary else len(content.encode('utf-8'))
         }
     
+    async def get_object_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        """
+        オブジェクトの一部をバイト範囲で取得（S3のRange指定を模倣）
+        
+        Args:
+            key: オブジェクトキー
+            start: 開始バイト位置
+            length: 取得するバイト数
+            
+        Returns:
+            バイト列（存在しない場合はNone）
+        """
+        file_path = self._get_full_path(key)
+        
+        if not file_path.exists():
+            return None
+        
+        async with aiofiles.open(file_path, 'rb') as f:
+            await f.seek(start)
+            return await f.read(length)
+    
     async def delete_object(self, key: str) -> bool:
         """
         オブジェクトを削除（S3のdelete_objectを模倣）
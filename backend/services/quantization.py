@@ -0,0 +1,200 @@
+"""
+ベクトル量子化コーデック
+ライブラリインデックスのメモリ使用量を削減する
+
+- ScalarInt8Codec: 次元ごとの最小値・幅でint8に量子化（1次元 = 1バイト）
+- ProductQuantizer: 部分空間ごとに256個のセントロイドで符号化（1部分空間 = 1バイト）
+
+検索時はクエリを量子化せずに距離を計算する（非対称距離計算, ADC）
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+# ADCで一度に展開する行数（一時配列のサイズを抑える）
+SCORE_BLOCK_ROWS = 16384
+
+
+def _kmeans(
+    points: np.ndarray,
+    k: int,
+    iterations: int = 15,
+    rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    """
+    ユークリッド距離のk-means
+
+    Args:
+        points: (N, D) 学習点
+        k: クラスタ数
+        iterations: 反復回数
+        rng: 乱数生成器
+
+    Returns:
+        (k, D) セントロイド
+    """
+    rng = rng or np.random.default_rng(0)
+    k = min(k, len(points))
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        # ||x - c||^2 = ||x||^2 - 2x·c + ||c||^2（||x||^2は比較に不要）
+        distances = -2 * points @ centroids.T + np.sum(centroids ** 2, axis=1)
+        assignments = np.argmin(distances, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        counts = np.bincount(assignments, minlength=k)
+
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+
+    return centroids.astype(np.float32)
+
+
+class ScalarInt8Codec:
+    """次元ごとのスカラー量子化（float32 → int8）"""
+
+    name = "int8"
+
+    def __init__(self):
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def train(self, vectors: np.ndarray):
+        """学習データから次元ごとの値域を決定"""
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        self.scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+        self.offset = low.astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """(N, D) → (N, D) int8"""
+        codes = np.rint((vectors - self.offset) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """(N, D) int8 → (N, D) float32（近似）"""
+        return (codes.astype(np.float32) + 128) * self.scale + self.offset
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        非対称内積: q · (offset + (code + 128) * scale)
+
+        Args:
+            codes: (N, D) int8
+            query: (D,) float32
+
+        Returns:
+            (N,) 近似内積
+        """
+        weighted = query * self.scale
+        bias = float(query @ self.offset) + 128.0 * float(weighted.sum())
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weighted + bias
+        return scores
+
+    def bytes_per_vector(self, dimension: int) -> int:
+        return dimension
+
+
+class ProductQuantizer:
+    """直積量子化（部分空間ごとに256セントロイド）"""
+
+    name = "pq"
+
+    def __init__(self, subspaces: int = 96):
+        self.subspaces = subspaces
+        self.codebooks: Optional[np.ndarray] = None  # (M, 256, D/M)
+
+    @staticmethod
+    def subspace_count(dimension: int, requested: int) -> int:
+        """次元数を割り切れる最大の部分空間数（requested以下）"""
+        for m in range(min(requested, dimension), 0, -1):
+            if dimension % m == 0:
+                return m
+        return 1
+
+    def train(self, vectors: np.ndarray, max_training_points: int = 32768, iterations: int = 15):
+        """部分空間ごとにk-meansでコードブックを学習"""
+        rng = np.random.default_rng(0)
+        dimension = vectors.shape[1]
+        self.subspaces = self.subspace_count(dimension, self.subspaces)
+        width = dimension // self.subspaces
+
+        if len(vectors) > max_training_points:
+            vectors = vectors[rng.choice(len(vectors), max_training_points, replace=False)]
+
+        codebooks = np.zeros((self.subspaces, 256, width), dtype=np.float32)
+        for m in range(self.subspaces):
+            centroids = _kmeans(vectors[:, m * width:(m + 1) * width], 256, iterations, rng)
+            codebooks[m, :len(centroids)] = centroids
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """(N, D) → (N, M) uint8"""
+        width = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            sub = vectors[:, m * width:(m + 1) * width]
+            book = self.codebooks[m]
+            distances = -2 * sub @ book.T + np.sum(book ** 2, axis=1)
+            codes[:, m] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """(N, M) uint8 → (N, D) float32（近似）"""
+        parts = [self.codebooks[m][codes[:, m]] for m in range(self.subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        非対称内積: 部分空間ごとの内積テーブルを引いて合計
+
+        Args:
+            codes: (N, M) uint8
+            query: (D,) float32
+
+        Returns:
+            (N,) 近似内積
+        """
+        width = self.codebooks.shape[2]
+        # (M, 256) クエリ部分ベクトルと各セントロイドの内積
+        table = np.einsum('mkw,mw->mk', self.codebooks, query.reshape(self.subspaces, width))
+        subspace_index = np.arange(self.subspaces)
+
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = table[subspace_index, block].sum(axis=1)
+        return scores
+
+    def bytes_per_vector(self, dimension: int) -> int:
+        return self.subspaces
+
+
+def create_codec(name: str, pq_subspaces: int = 96):
+    """
+    名前からコーデックを生成
+
+    Args:
+        name: none / int8 / pq
+        pq_subspaces: PQの部分空間数
+
+    Returns:
+        コーデック（noneの場合はNone）
+    """
+    if name in (None, "", "none"):
+        return None
+    if name == "int8":
+        return ScalarInt8Codec()
+    if name == "pq":
+        return ProductQuantizer(pq_subspaces)
+    raise ValueError(f"Unknown quantization: {name}")
@@ -0,0 +1,160 @@
+"""
+検索結果の多様化と重複除去
+- MMR（Maximal Marginal Relevance）: 関連度と既選択結果との類似度のバランスで選び直す
+- 隣接チャンクの結合: 同じファイルの連続したチャンクをオーバーラップを除いて1つのパッセージにまとめる
+
+チャンク化のオーバーラップにより上位結果に隣接チャンクが並びやすく、
+そのままRAGのプロンプトに入れると同じ文章を重複して送ることになる
+"""
+
+import dataclasses
+from typing import List, Any, Optional
+
+import numpy as np
+
+
+def mmr_select(
+    vectors: np.ndarray,
+    relevance: np.ndarray,
+    k: int,
+    lambda_: float = 0.5
+) -> List[int]:
+    """
+    MMRで候補からk件を選択
+
+    Args:
+        vectors: (N, D) 正規化済みの候補ベクトル
+        relevance: (N,) 候補の関連度（大きいほど関連が高い）
+        k: 選択する件数
+        lambda_: 関連度の重み（1.0で関連度順そのまま、小さいほど多様性を重視）
+
+    Returns:
+        選択した候補の位置（選択順）
+    """
+    count = len(relevance)
+    k = min(k, count)
+    if k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    redundancy = np.zeros(count, dtype=np.float32)  # 既選択結果との最大類似度
+    available = np.ones(count, dtype=bool)
+    selected = []
+    for _ in range(k):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        # 選んだ候補との類似度で全候補の冗長度を一括更新
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+def normalize_scores(scores: np.ndarray) -> np.ndarray:
+    """スコアを0〜1に線形変換（MMRで類似度と尺度を揃えるため。全て同じ値なら1）"""
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(scores) == 0:
+        return scores
+    low, high = float(scores.min()), float(scores.max())
+    if high - low <= 0:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def join_overlapping(head: str, tail: str, max_overlap: Optional[int] = None) -> str:
+    """
+    前のチャンクの末尾と次のチャンクの先頭の重なりを除いて連結
+
+    Args:
+        head: 前のチャンクのテキスト
+        tail: 次のチャンクのテキスト
+        max_overlap: 重なりとして探す最大文字数（Noneの場合は短い方の長さ）
+
+    Returns:
+        連結したテキスト
+    """
+    limit = min(len(head), len(tail))
+    if max_overlap is not None:
+        limit = min(limit, max_overlap)
+    for size in range(limit, 0, -1):
+        if head.endswith(tail[:size]):
+            return head + tail[size:]
+    return head + tail
+
+
+def merge_adjacent(results: List[Any], max_overlap: Optional[int] = None) -> List[Any]:
+    """
+    同じファイルの連続したチャンク（chunk_indexが連番）を1つの結果に結合
+
+    結合後のスコアは構成チャンクの最大値で、順位は最上位のチャンクの位置になる。
+    chunk_idは先頭チャンクのもので、metadataのmerged_chunk_idsに構成チャンクを記録する
+
+    Args:
+        results: スコア降順の検索結果（SearchResult）
+        max_overlap: 重なりとして探す最大文字数（チャンクの位置情報がない場合に使用）
+
+    Returns:
+        結合後の検索結果（スコア降順）
+    """
+    groups = {}
+    for rank, result in enumerate(results):
+        index = result.metadata.get('chunk_index')
+        if index is None:
+            continue
+        groups.setdefault((result.library_id, result.filename), []).append((index, rank))
+
+    merged_into = {}  # 結合されて消える結果の順位 -> 代表の順位
+    passages = {}  # 代表の順位 -> 結合後の結果
+    for members in groups.values():
+        members.sort()
+        run = [members[0]]
+        for member in members[1:] + [None]:
+            if member is not None and member[0] == run[-1][0] + 1:
+                run.append(member)
+                continue
+            if len(run) > 1:
+                leader = min(rank for _, rank in run)
+                passages[leader] = _merge_run([results[rank] for _, rank in run], max_overlap)
+                for _, rank in run:
+                    if rank != leader:
+                        merged_into[rank] = leader
+            run = [member]
+
+    return [
+        passages.get(rank, result)
+        for rank, result in enumerate(results)
+        if rank not in merged_into
+    ]
+
+
+def _merge_run(run: List[Any], max_overlap: Optional[int]) -> Any:
+    """chunk_index順に並んだ連続チャンクを1つの結果にまとめる"""
+    text = run[0].text
+    for previous, result in zip(run, run[1:]):
+        # 元テキスト上の位置が分かれば重なりの長さの上限に使う
+        limit = max_overlap
+        end, start = previous.metadata.get('end_position'), result.metadata.get('start_position')
+        if end is not None and start is not None:
+            limit = max(end - start, 0)
+        text = join_overlapping(text, result.text, limit)
+
+    def best(values):
+        values = [value for value in values if value is not None]
+        return max(values) if values else None
+
+    first, last = run[0].metadata, run[-1].metadata
+    metadata = dict(
+        first,
+        end_position=last.get('end_position', first.get('end_position')),
+        merged_chunk_ids=[result.chunk_id for result in run]
+    )
+    return dataclasses.replace(
+        run[0],
+        text=text,
+        score=max(result.score for result in run),
+        metadata=metadata,
+        vector_score=best(result.vector_score for result in run),
+        keyword_score=best(result.keyword_score for result in run)
+    )
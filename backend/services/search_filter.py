@@ -0,0 +1,113 @@
+"""
+検索のメタデータフィルタ
+ファイル名・アップロード日時・コンテンツタイプで検索対象のファイルを絞り込む
+
+ファイル属性はファイル単位の列（配列）として評価し、インデックス側で行ごとの
+ファイルID列からブールマスクに展開してスコアリングの前に適用する
+"""
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+
+# マニフェストに保存するファイル属性（library_service のファイル情報から取得）
+FILE_ATTRIBUTE_KEYS = ("uploaded_at", "content_type")
+
+
+@dataclass
+class SearchFilter:
+    """検索フィルタ（指定した条件はすべて満たす必要がある）"""
+    filenames: Optional[List[str]] = None  # いずれかに一致
+    content_types: Optional[List[str]] = None  # いずれかに一致（"text/*" のような前方一致も可）
+    uploaded_after: Optional[str] = None  # この日時以降（ISO形式）
+    uploaded_before: Optional[str] = None  # この日時より前（ISO形式）
+
+    def is_empty(self) -> bool:
+        return (
+            self.filenames is None
+            and self.content_types is None
+            and self.uploaded_after is None
+            and self.uploaded_before is None
+        )
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """
+    ISO形式の日時をUNIX時刻に変換（タイムゾーンなしはUTCとみなす）
+
+    Args:
+        value: ISO形式の日時
+
+    Returns:
+        UNIX時刻（未設定・不正な値はNaN）
+    """
+    if not value:
+        return math.nan
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return math.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def file_attributes(item: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """ファイル情報から検索フィルタ用の属性を取り出す"""
+    item = item or {}
+    return {key: item.get(key) for key in FILE_ATTRIBUTE_KEYS}
+
+
+class FileColumns:
+    """
+    ファイル属性の列
+    - ファイルの並び（ファイルID順）で名前・アップロード時刻・コンテンツタイプの配列を保持
+    - 属性が変わるまでインデックス側でキャッシュして使い回す
+    """
+
+    def __init__(self, names: List[str], attributes: Dict[str, Dict[str, Any]]):
+        self.names = np.array(names, dtype=object)
+        self.uploaded_at = np.array(
+            [parse_timestamp((attributes.get(name) or {}).get("uploaded_at")) for name in names],
+            dtype=np.float64
+        )
+        self.content_types = np.array(
+            [((attributes.get(name) or {}).get("content_type") or "").lower() for name in names],
+            dtype=object
+        )
+
+    def mask(self, search_filter: SearchFilter) -> np.ndarray:
+        """
+        フィルタに一致するファイルのマスクを作成
+
+        Args:
+            search_filter: 検索フィルタ
+
+        Returns:
+            ファイルID順のブール配列（日時・タイプが未設定のファイルは該当条件で不一致）
+        """
+        mask = np.ones(len(self.names), dtype=bool)
+        if len(mask) == 0:
+            return mask
+
+        if search_filter.filenames is not None:
+            mask &= np.isin(self.names, np.array(search_filter.filenames, dtype=object))
+
+        if search_filter.uploaded_after is not None:
+            mask &= self.uploaded_at >= parse_timestamp(search_filter.uploaded_after)
+        if search_filter.uploaded_before is not None:
+            mask &= self.uploaded_at < parse_timestamp(search_filter.uploaded_before)
+
+        if search_filter.content_types is not None:
+            exact = [value.lower() for value in search_filter.content_types if not value.endswith("*")]
+            prefixes = tuple(value[:-1].lower() for value in search_filter.content_types if value.endswith("*"))
+            matched = np.isin(self.content_types, np.array(exact, dtype=object))
+            if prefixes:
+                matched |= np.array([value.startswith(prefixes) for value in self.content_types], dtype=bool)
+            mask &= matched
+
+        return mask
@@ -0,0 +1,127 @@
+"""
+検索結果のスニペット
+チャンク全文の代わりに、クエリの語が最も多く含まれる短い範囲と強調位置を返す
+
+- クエリはキーワード検索と同じトークン化（NFKC・小文字化、日本語は文字bigram）で語に分ける
+- 語の一致はチャンクテキストを同じ正規化をした上で探し、位置は元のテキストに戻して返す
+"""
+
+import unicodedata
+from typing import List, Dict, Any, Tuple
+
+from services.keyword_index import tokenize
+
+
+DEFAULT_SNIPPET_CHARS = 160
+
+
+def _normalize_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """
+    tokenizeと同じ正規化をしたテキストと、正規化後の各文字の元の位置
+
+    Args:
+        text: 元のテキスト
+
+    Returns:
+        (正規化後のテキスト, 正規化後の位置 -> 元の位置)
+    """
+    normalized = unicodedata.normalize('NFKC', text).lower()
+    if len(normalized) == len(text) and unicodedata.is_normalized('NFKC', text):
+        return normalized, list(range(len(text)))  # 文字数が変わらない場合は位置もそのまま
+
+    # 合字などで文字数が変わる場合は1文字ずつ正規化して対応付ける
+    parts = []
+    offsets = []
+    for position, char in enumerate(text):
+        converted = unicodedata.normalize('NFKC', char).lower()
+        parts.append(converted)
+        offsets.extend([position] * len(converted))
+    return ''.join(parts), offsets
+
+
+def _find_matches(text: str, terms: List[str]) -> List[Tuple[int, int, str]]:
+    """正規化済みテキスト内の語の出現位置 (開始, 終了, 語) を開始位置順に取得"""
+    matches = []
+    for term in terms:
+        start = text.find(term)
+        while start != -1:
+            matches.append((start, start + len(term), term))
+            start = text.find(term, start + 1)
+    matches.sort()
+    return matches
+
+
+def _best_window(matches: List[Tuple[int, int, str]], max_chars: int) -> Tuple[int, int]:
+    """
+    max_chars以内に収まり、異なる語を最も多く含む出現の範囲（同数なら出現数の多い方）
+
+    Returns:
+        matches内の (先頭, 末尾+1) の位置
+    """
+    best = (0, 1)
+    best_score = (0, 0)
+    counts: Dict[str, int] = {}
+    left = 0
+    for right, (_, end, term) in enumerate(matches):
+        counts[term] = counts.get(term, 0) + 1
+        # 範囲の長さが上限を超える間は左端を進める（尺取り法）
+        while end - matches[left][0] > max_chars:
+            left_term = matches[left][2]
+            counts[left_term] -= 1
+            if counts[left_term] == 0:
+                del counts[left_term]
+            left += 1
+        score = (len(counts), right - left + 1)
+        if score > best_score:
+            best, best_score = (left, right + 1), score
+    return best
+
+
+def make_snippet(text: str, query: str, max_chars: int = DEFAULT_SNIPPET_CHARS) -> Dict[str, Any]:
+    """
+    クエリの語の周辺を切り出したスニペットを作成
+
+    Args:
+        text: チャンクのテキスト
+        query: 検索クエリ
+        max_chars: スニペットの最大文字数
+
+    Returns:
+        text（スニペット）/ highlights（スニペット内の [開始, 終了] の強調位置）/
+        start, end（チャンク内の範囲）の辞書。語が見つからない場合は先頭を返す
+    """
+    max_chars = max(int(max_chars), 1)
+    terms = list(dict.fromkeys(tokenize(query)))
+    normalized, offsets = _normalize_with_offsets(text)
+    matches = _find_matches(normalized, terms) if terms else []
+
+    if not matches:
+        end = min(len(text), max_chars)
+        return {"text": text[:end], "highlights": [], "start": 0, "end": end}
+
+    # 一致範囲を元の位置に戻し、前後の余白を均等に付けて窓を決める
+    first, last = _best_window(matches, max_chars)
+    window = matches[first:last]
+    match_start = offsets[window[0][0]]
+    match_end = max(offsets[end - 1] for _, end, _ in window) + 1
+    margin = max(max_chars - (match_end - match_start), 0)
+    start = max(min(match_start - margin // 2, len(text) - max_chars), 0)
+    end = min(start + max_chars, len(text))
+
+    # 窓内の一致を強調位置にまとめる（bigramの重なりは1つの範囲に結合）
+    highlights: List[List[int]] = []
+    for match_begin, match_finish, _ in matches:
+        begin, finish = offsets[match_begin], offsets[match_finish - 1] + 1
+        if begin < start or finish > end:
+            continue
+        if highlights and begin <= highlights[-1][1]:
+            highlights[-1][1] = max(highlights[-1][1], finish)
+        else:
+            highlights.append([begin, finish])
+
+    return {
+        "text": text[start:end],
+        "highlights": [[begin - start, finish - start] for begin, finish in highlights],
+        "start": start,
+        "end": end
+    }
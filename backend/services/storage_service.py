@@ -1,7 +1,7 @@
 # 統一ストレージサービス
 import os
 import json
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Union, List, Tuple
 from abc import ABC, abstractmethod
 from enum import Enum
 
@@ -198,6 +198,82 @@ class StorageService:
                         return content
             return None
     
+    async def get_object_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        """
+        オブジェクトの一部をバイト範囲で取得
+        
+        Args:
+            key: オブジェクトキー
+            start: 開始バイト位置
+            length: 取得するバイト数
+            
+        Returns:
+            バイト列（存在しない場合・取得に失敗した場合はNone）
+        """
+        return (await self.get_object_ranges(key, [(start, length)]))[0]
+    
+    async def get_object_ranges(self, key: str, ranges: List[Tuple[int, int]]) -> List[Optional[bytes]]:
+        """
+        オブジェクトの複数のバイト範囲を1つのクライアントで取得
+        
+        Args:
+            key: オブジェクトキー
+            ranges: (開始バイト位置, バイト数) のリスト
+            
+        Returns:
+            範囲と同じ順序のバイト列のリスト（存在しない場合・取得に失敗した場合はNone）
+        """
+        if self.storage_type == StorageType.S3:
+            # S3を使用
+            import aioboto3
+            from botocore.exceptions import ClientError
+            results: List[Optional[bytes]] = []
+            try:
+                async with aioboto3.Session().client('s3') as s3:
+                    for start, length in ranges:
+                        response = await s3.get_object(
+                            Bucket=self.bucket_name,
+                            Key=key,
+                            Range=f"bytes={start}-{start + length - 1}"
+                        )
+                        results.append(await response['Body'].read())
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    print(f"[ERROR] Failed to read ranges of {key} from S3: {str(e)}")
+            except Exception as e:
+                print(f"[ERROR] Failed to read ranges of {key} from S3: {str(e)}")
+            return results + [None] * (len(ranges) - len(results))
+        
+        elif self.storage_type == StorageType.AZURE:
+            # Azure Blob Storageを使用
+            from azure.core.exceptions import ResourceNotFoundError
+            from azure.storage.blob.aio import BlobServiceClient
+            
+            blob_service_client = BlobServiceClient.from_connection_string(
+                self.connection_string
+            )
+            
+            results = []
+            try:
+                blob_client = blob_service_client.get_blob_client(
+                    container=self.container_name,
+                    blob=key
+                )
+                for start, length in ranges:
+                    download_stream = await blob_client.download_blob(offset=start, length=length)
+                    results.append(await download_stream.readall())
+            except ResourceNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[ERROR] Failed to read ranges of {key} from Azure Blob Storage: {str(e)}")
+            finally:
+                await blob_service_client.close()
+            return results + [None] * (len(ranges) - len(results))
+        
+        else:
+            # ローカルストレージを使用
+            return [await self.local_storage.get_object_range(key, start, length) for start, length in ranges]
+    
     async def get_object_from_url(self, url: str, return_bytes: bool = False) -> Optional[Union[str, bytes]]:
         """
         URLからオブジェクトを取得
@@ -349,7 +425,7 @@ class StorageService:
         
         else:
             # ローカルストレージを使用
-            result = await self.local_storage.list_objects(prefix=prefix, page_size=page_size)
+            result = await self.local_storage.list_objects(prefix=prefix, limit=page_size)
             return result
     
     async def delete_object(self, key: str) -> Dict[str, Any]:
@@ -397,8 +473,8 @@ class StorageService:
         
         else:
             # ローカルストレージを使用
-            # TODO: local_storage_serviceにdelete_objectメソッドを実装
-            return {'success': True, 'message': 'Local delete not implemented'}
+            deleted = await self.local_storage.delete_object(key)
+            return {'success': True, 'deleted': deleted}
 
 # シングルトンインスタンス
 storage_service = StorageService()
\ No newline at end of file
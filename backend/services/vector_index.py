@@ -0,0 +1,419 @@
+"""
+ライブラリ単位のインメモリベクトルインデックス
+正規化済みfloat32行列を保持し、行列ベクトル積で一括スコアリングする
+"""
+
+import sys
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from services import ann_index
+from services.search_filter import SearchFilter, FileColumns
+
+
+class LibraryVectorIndex:
+    """
+    ライブラリベクトルインデックス
+    - 全チャンクのベクトルを連続したfloat32行列として保持
+    - 行は事前に正規化（内積 = コサイン類似度）
+    - top-kはargpartitionで選択
+    - 量子化（int8 / PQ）時はfloat32行列の代わりにコードを保持
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+
+        # 行ごとの付随情報（vectorsと同じ並び）
+        self.chunk_ids: List[str] = []
+        self.texts: List[str] = []
+        self.filenames: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.file_rows = np.zeros(0, dtype=np.int32)  # 保存ファイル内の行番号
+        self.file_ids = np.zeros(0, dtype=np.int32)  # ファイルID（file_namesの位置）
+
+        # ファイルID -> ファイル名（削除後もIDは再利用のため残す）
+        self.file_names: List[str] = []
+        self._file_id_by_name: Dict[str, int] = {}
+
+        # ファイル属性（アップロード日時・コンテンツタイプ。検索フィルタ用）
+        self.file_attributes: Dict[str, Dict[str, Any]] = {}
+        self._file_columns: Optional[FileColumns] = None
+
+        # 保存ファイルのレイアウト（再ランキング時のレンジ読み込み用）
+        self.file_layouts: Dict[str, Dict[str, Any]] = {}
+
+        # 量子化コーデック（量子化時はvectorsをNoneにしてcodesを保持）
+        self.codec = None
+        self.codes: Optional[np.ndarray] = None
+
+        # IVFインデックス（未構築の場合はNone、list_idsは行ごとのリスト番号）
+        self.centroids: Optional[np.ndarray] = None
+        self.list_ids = np.zeros(0, dtype=np.int32)
+        self._list_order: Optional[np.ndarray] = None
+        self._list_bounds: Optional[np.ndarray] = None
+
+        # (ファイル名, チャンクID) -> 行番号（キーワード検索の候補を行に対応付ける際に構築）
+        self._row_lookup: Optional[Dict[Tuple[str, str], int]] = None
+
+        self.loaded_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def build(
+        cls,
+        dimension: int,
+        files: Dict[str, Tuple[List[str], List[str], List[Dict[str, Any]], np.ndarray]]
+    ) -> "LibraryVectorIndex":
+        """
+        複数ファイル分の行から一括でインデックスを構築（行列の連結は1回のみ）
+
+        Args:
+            dimension: ベクトル次元数
+            files: ファイル名 -> (chunk_ids, texts, metadatas, vectors)
+
+        Returns:
+            構築したインデックス
+        """
+        index = cls(dimension)
+        blocks = []
+        rows = []
+        ids = []
+        for filename, (chunk_ids, texts, metadatas, vectors) in files.items():
+            if len(chunk_ids) == 0:
+                continue
+            blocks.append(np.asarray(vectors, dtype=np.float32).reshape(len(chunk_ids), dimension))
+            rows.append(np.arange(len(chunk_ids), dtype=np.int32))
+            ids.append(np.full(len(chunk_ids), index._file_id(filename), dtype=np.int32))
+            index.chunk_ids.extend(chunk_ids)
+            index.texts.extend(texts)
+            index.filenames.extend([filename] * len(chunk_ids))
+            index.metadatas.extend(metadatas)
+
+        if blocks:
+            index.vectors = np.ascontiguousarray(cls.normalize(np.concatenate(blocks)))
+            index.file_rows = np.concatenate(rows)
+            index.file_ids = np.concatenate(ids)
+        index.list_ids = np.full(len(index), -1, dtype=np.int32)
+        return index
+
+    def _file_id(self, filename: str) -> int:
+        """ファイル名のIDを取得（未登録なら採番）"""
+        file_id = self._file_id_by_name.get(filename)
+        if file_id is None:
+            file_id = len(self.file_names)
+            self.file_names.append(filename)
+            self._file_id_by_name[filename] = file_id
+            self._file_columns = None
+        return file_id
+
+    @staticmethod
+    def normalize(matrix: np.ndarray) -> np.ndarray:
+        """
+        行ごとにL2正規化（ゼロベクトルはゼロのまま）
+
+        Args:
+            matrix: (N, D) または (D,) の配列
+
+        Returns:
+            正規化済みfloat32配列
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def add_file(
+        self,
+        filename: str,
+        chunk_ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        vectors: np.ndarray
+    ):
+        """
+        ファイル単位で行を追加（同名ファイルの既存行は置き換え）
+
+        Args:
+            filename: ファイル名
+            chunk_ids: チャンクIDのリスト
+            texts: チャンクテキストのリスト
+            metadatas: チャンクメタデータのリスト
+            vectors: (N, D) のベクトル行列
+        """
+        self.remove_file(filename)
+        if len(chunk_ids) == 0:
+            return
+
+        vectors = self.normalize(vectors).reshape(len(chunk_ids), self.dimension)
+        if self.codec is not None:
+            self.codes = np.concatenate([self.codes, self.codec.encode(vectors)])
+        else:
+            self.vectors = np.ascontiguousarray(np.vstack([self.vectors, vectors]))
+        self.file_rows = np.concatenate([self.file_rows, np.arange(len(chunk_ids), dtype=np.int32)])
+        self.file_ids = np.concatenate([
+            self.file_ids, np.full(len(chunk_ids), self._file_id(filename), dtype=np.int32)
+        ])
+        self.chunk_ids.extend(chunk_ids)
+        self.texts.extend(texts)
+        self.filenames.extend([filename] * len(chunk_ids))
+        self.metadatas.extend(metadatas)
+
+        # IVF構築済みなら新しい行だけを割り当て
+        if self.centroids is not None:
+            new_ids = ann_index.assign_lists(vectors, self.centroids)
+        else:
+            new_ids = np.full(len(chunk_ids), -1, dtype=np.int32)
+        self.list_ids = np.concatenate([self.list_ids, new_ids])
+        self._list_order = None
+        self._row_lookup = None
+
+    def remove_file(self, filename: str) -> int:
+        """
+        ファイルの行を削除
+
+        Args:
+            filename: ファイル名
+
+        Returns:
+            削除した行数
+        """
+        self.set_file_attributes(filename, None)
+        file_id = self._file_id_by_name.get(filename)
+        if file_id is None:
+            return 0
+        keep = np.flatnonzero(self.file_ids != file_id)
+        removed = len(self.file_ids) - len(keep)
+        if removed == 0:
+            return 0
+
+        if self.codec is not None:
+            self.codes = self.codes[keep]
+        else:
+            self.vectors = np.ascontiguousarray(self.vectors[keep])
+        self.file_rows = self.file_rows[keep]
+        self.file_ids = self.file_ids[keep]
+        self.file_layouts.pop(filename, None)
+        self.chunk_ids = [self.chunk_ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.filenames = [self.filenames[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self.list_ids = self.list_ids[keep]
+        self._list_order = None
+        self._row_lookup = None
+        return removed
+
+    def set_file_attributes(self, filename: str, attributes: Optional[Dict[str, Any]]):
+        """
+        ファイル属性を設定（Noneの場合は削除）
+
+        Args:
+            filename: ファイル名
+            attributes: search_filter.file_attributes の辞書
+        """
+        if attributes is None:
+            if self.file_attributes.pop(filename, None) is None:
+                return
+        else:
+            self.file_attributes[filename] = attributes
+        self._file_columns = None
+
+    def filter_rows(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """
+        フィルタに一致する行番号を取得
+        ファイル単位の属性列でマスクを作り、行ごとのファイルID列で行に展開する
+
+        Args:
+            search_filter: 検索フィルタ
+
+        Returns:
+            行番号の配列（昇順。フィルタなしの場合はNone）
+        """
+        if search_filter is None or search_filter.is_empty():
+            return None
+        if self._file_columns is None:
+            self._file_columns = FileColumns(self.file_names, self.file_attributes)
+        file_mask = self._file_columns.mask(search_filter)
+        return np.flatnonzero(file_mask[self.file_ids]) if len(file_mask) else np.zeros(0, dtype=np.int64)
+
+    def set_ivf(self, centroids: np.ndarray, list_ids: Optional[np.ndarray] = None):
+        """
+        IVFインデックスを設定（list_ids省略時は全行を割り当て）
+
+        Args:
+            centroids: (nlist, D) 正規化済みセントロイド
+            list_ids: 行ごとのリスト番号
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        if list_ids is None:
+            # 量子化時に全行を一度に復元しないようブロック単位で割り当て
+            list_ids = np.empty(len(self), dtype=np.int32)
+            for start in range(0, len(self), 8192):
+                rows = np.arange(start, min(start + 8192, len(self)))
+                list_ids[rows] = ann_index.assign_lists(self.reconstruct(rows), self.centroids)
+        self.list_ids = np.asarray(list_ids, dtype=np.int32)
+        self._list_order = None
+
+    def quantize(self, codec):
+        """
+        float32行列をコーデックで量子化して置き換え
+
+        Args:
+            codec: quantization.create_codec で生成したコーデック
+        """
+        if codec is None or self.codec is not None or len(self) == 0:
+            return
+        codec.train(self.vectors)
+        self.codes = codec.encode(self.vectors)
+        self.codec = codec
+        self.vectors = None
+
+    def reconstruct(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        行のベクトルを取得（量子化時は近似値に復元）
+
+        Args:
+            rows: 行番号（Noneの場合は全行）
+
+        Returns:
+            (N, D) float32
+        """
+        if self.codec is None:
+            return self.vectors if rows is None else self.vectors[rows]
+        codes = self.codes if rows is None else self.codes[rows]
+        return self.codec.decode(codes)
+
+    def memory_bytes(self) -> int:
+        """ベクトル部分のメモリ使用量（バイト）"""
+        if self.codec is not None:
+            return int(self.codes.nbytes)
+        return int(self.vectors.nbytes)
+
+    def resident_bytes(self) -> int:
+        """インデックス全体のメモリ使用量の概算（ベクトル・IVF・テキスト）"""
+        total = self.memory_bytes() + self.file_rows.nbytes + self.file_ids.nbytes + self.list_ids.nbytes
+        if self.centroids is not None:
+            total += self.centroids.nbytes
+        return int(total + sum(sys.getsizeof(text) for text in self.texts))
+
+    def _score(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """クエリとの内積（量子化時は非対称距離計算）"""
+        if self.codec is not None:
+            codes = self.codes if rows is None else self.codes[rows]
+            return self.codec.score(codes, query)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return vectors @ query
+
+    def rows_for(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        (ファイル名, チャンクID) に対応する行番号を取得（存在しないキーは無視）
+
+        Args:
+            keys: (ファイル名, チャンクID) のリスト
+
+        Returns:
+            行番号の配列（昇順）
+        """
+        rows = self.lookup_rows(keys)
+        return np.unique(rows[rows >= 0])
+
+    def lookup_rows(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        (ファイル名, チャンクID) に対応する行番号をキーと同じ順で取得
+
+        Args:
+            keys: (ファイル名, チャンクID) のリスト
+
+        Returns:
+            行番号の配列（存在しないキーは-1）
+        """
+        if self._row_lookup is None:
+            self._row_lookup = {
+                (filename, chunk_id): row
+                for row, (filename, chunk_id) in enumerate(zip(self.filenames, self.chunk_ids))
+            }
+        return np.array([self._row_lookup.get(key, -1) for key in keys], dtype=np.int64)
+
+    def ivf_assignments_by_file(self) -> Dict[str, np.ndarray]:
+        """永続化用にファイル別のリスト番号を取得"""
+        rows_by_file: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.filenames):
+            rows_by_file.setdefault(name, []).append(i)
+        return {name: self.list_ids[rows] for name, rows in rows_by_file.items()}
+
+    def _probe_candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """nprobe個のリストに含まれる行番号を取得"""
+        # 割り当て漏れの行（-1）は常に候補に含める
+        if self._list_order is None:
+            self._list_order = np.argsort(self.list_ids, kind='stable')
+            self._list_bounds = np.searchsorted(
+                self.list_ids[self._list_order], np.arange(-1, len(self.centroids) + 1)
+            )
+
+        probes = ann_index.probe_lists(query, self.centroids, nprobe)
+        blocks = [self._list_order[self._list_bounds[0]:self._list_bounds[1]]]
+        for list_id in probes:
+            blocks.append(self._list_order[self._list_bounds[list_id + 1]:self._list_bounds[list_id + 2]])
+        return np.sort(np.concatenate(blocks))
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        threshold: Optional[float] = None,
+        nprobe: Optional[int] = None,
+        candidate_rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        コサイン類似度で上位top_k件を検索
+
+        Args:
+            query_vector: クエリベクトル
+            top_k: 返す結果の最大数
+            threshold: 類似度の閾値（Noneの場合は閾値なし）
+            nprobe: IVFで走査するリスト数（Noneまたは未構築の場合は全件走査）
+            candidate_rows: スコアリングする行番号（キーワード検索・メタデータフィルタによる事前絞り込み。
+                            指定時はIVFを使わず候補行だけを全件走査）
+
+        Returns:
+            (行番号, スコア) のリスト（スコア降順）
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        query = self.normalize(query_vector)
+
+        if candidate_rows is not None:
+            rows = np.asarray(candidate_rows, dtype=np.int64)
+            scores = self._score(query, rows)
+        elif nprobe is not None and self.centroids is not None:
+            # IVF: 近いリストの行だけをスコアリング
+            rows = self._probe_candidates(query, nprobe)
+            scores = self._score(query, rows)
+        else:
+            rows = None
+            scores = self._score(query)
+
+        # 閾値で候補を絞り込み
+        if threshold is not None:
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            candidates = np.arange(len(scores))
+
+        if len(candidates) == 0:
+            return []
+
+        candidate_scores = scores[candidates]
+        if rows is not None:
+            candidates = rows[candidates]
+        if len(candidates) > top_k:
+            top = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+            candidates = candidates[top]
+            candidate_scores = candidate_scores[top]
+
+        order = np.argsort(-candidate_scores, kind='stable')
+        return [(int(candidates[i]), float(candidate_scores[i])) for i in order]
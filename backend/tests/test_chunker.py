@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+テキストのチャンク化のテスト
+APIキー不要（トークン数による分割・句読点での区切り・ストリーミングの動作確認）
+"""
+
+import sys
+import random
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.chunker import StreamingChunker, TextSegment, iter_chunks, estimate_tokens, chunk_location
+
+
+def sample_text(seed: int = 0, sentences: int = 400) -> str:
+    """日本語と英文が混ざったテスト用テキスト"""
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(sentences):
+        if rng.random() < 0.5:
+            parts.append(''.join(rng.choice('会議室予約手順申請承認文書') for _ in range(rng.randint(5, 60))))
+        else:
+            parts.append(' '.join(rng.choice(['quick', 'brown', 'fox', 'jumps', 'lazy']) for _ in range(rng.randint(3, 30))))
+        parts.append(rng.choice(['。', '！', '\n', '\n\n', '.\n']))
+    return ''.join(parts)
+
+
+def test_chunks_fit_token_budget():
+    """各チャンクが推定トークン数の上限に収まり、句読点で区切られること"""
+    text = sample_text()
+    chunks = list(iter_chunks(text, "doc.txt", chunk_tokens=120, overlap_tokens=20))
+
+    assert len(chunks) > 1
+    for chunk in chunks[:-1]:
+        # 区切り文字ちょうどの位置で分割による端数の1トークンのみ許容
+        assert estimate_tokens(chunk.text) <= 120 + 1
+        end = chunk.metadata["end_position"]
+        assert text[end - 1] in "。．！？\n" or text[end - 2:end] == "\n\n"
+    assert [chunk.position for chunk in chunks] == list(range(len(chunks)))
+    # 位置情報は元テキストと対応し、チャンク間に抜けがない
+    for chunk in chunks:
+        start, end = chunk.metadata["start_position"], chunk.metadata["end_position"]
+        assert text[start:end].strip() == chunk.text
+    assert all(b.metadata["start_position"] <= a.metadata["end_position"] for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1].metadata["end_position"] == len(text)
+    print("✅ トークン数の上限と区切り位置を確認")
+
+
+def test_cjk_and_ascii_window_sizes():
+    """日本語は約1文字/トークン、英文は約4文字/トークンで窓が決まること"""
+    japanese = "あ" * 250
+    english = "a" * 1000
+    assert [len(chunk.text) for chunk in iter_chunks(japanese, "ja.txt", 100, 0)] == [100, 100, 50]
+    assert [len(chunk.text) for chunk in iter_chunks(english, "en.txt", 100, 0)] == [400, 400, 200]
+    # オーバーラップもトークン数で戻る
+    chunks = list(iter_chunks(japanese, "ja.txt", 100, 10))
+    assert [chunk.metadata["start_position"] for chunk in chunks[:3]] == [0, 90, 180]
+    print("✅ 文字種ごとの窓の大きさを確認")
+
+
+def test_streaming_matches_whole_text():
+    """断片の分け方に関係なく同じチャンクになり、確定したものから順に返ること"""
+    text = sample_text(seed=1)
+    whole = [(chunk.chunk_id, chunk.text, chunk.metadata) for chunk in iter_chunks(text, "doc.txt", 80, 15)]
+
+    rng = random.Random(2)
+    chunker = StreamingChunker("doc.txt", 80, 15)
+    streamed = []
+    first_output_at = None
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 300)
+        produced = list(chunker.feed(text[position:position + size]))
+        if produced and first_output_at is None:
+            first_output_at = position + size
+        streamed.extend(produced)
+        position += size
+    streamed.extend(chunker.finish())
+
+    assert [(chunk.chunk_id, chunk.text, chunk.metadata) for chunk in streamed] == whole
+    assert first_output_at is not None and first_output_at < len(text) // 2
+    # 確定済みの部分はバッファから捨てられている
+    assert len(chunker._buffer) < len(text)
+    print("✅ ストリーミングと一括の一致を確認")
+
+
+def test_segments_are_not_straddled():
+    """構造単位をまたぐチャンクを作らず、各チャンクに単位の位置が記録されること"""
+    segments = [
+        TextSegment("--- スライド 1 ---\n" + "会議室の予約手順。" * 3, location={"slide": 1}),
+        TextSegment("\n\n--- スライド 2 ---\n" + "承認フロー。" * 40, location={"slide": 2}),
+        TextSegment("続きの説明。" * 5),  # 直前のスライドの続き
+        TextSegment("\n\n=== シート: 予算 ===", location={"sheet": "予算"}),
+        TextSegment("\n項目 | 金額"),
+    ]
+    text = "".join(segment.text for segment in segments)
+    chunker = StreamingChunker("deck.pptx", 60, 10)
+    chunks = []
+    for segment in segments:
+        chunks.extend(chunker.feed_segment(segment))
+    chunks.extend(chunker.finish())
+
+    locations = [chunk_location(chunk.metadata) for chunk in chunks]
+    assert locations[0] == {"slide": 1}
+    assert locations[-1] == {"sheet": "予算"}
+    assert locations.count({"slide": 1}) == 1 and locations.count({"slide": 2}) > 1
+    # 単位の境界（各単位の先頭の断片の開始位置）をまたぐチャンクはない
+    boundaries = [len("".join(segment.text for segment in segments[:i])) for i in (1, 3)]
+    for chunk in chunks:
+        start, end = chunk.metadata["start_position"], chunk.metadata["end_position"]
+        assert text[start:end].strip() == chunk.text
+        assert not any(start < boundary < end for boundary in boundaries)
+    assert "スライド 1" not in "".join(chunk.text for chunk in chunks[1:])
+    # 位置のないテキストは従来通り
+    assert chunk_location(next(iter_chunks("本文。", "a.txt", 60, 10)).metadata) is None
+    print("✅ 構造単位ごとのチャンク化を確認")
+
+
+if __name__ == "__main__":
+    test_chunks_fit_token_budget()
+    test_cjk_and_ascii_window_sizes()
+    test_streaming_matches_whole_text()
+    test_segments_are_not_straddled()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+ドキュメント抽出のテスト
+APIキー不要（逐次抽出の取り消しの動作確認）
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.chunker import TextSegment
+from services.document_extractor import DocumentExtractor
+
+
+def test_cancel_waits_for_running_parse():
+    """抽出中に取り消すと、CancelledErrorになり残りのページは解析しないこと"""
+    parsed = []
+    closed = []
+
+    def slow_parts(content: bytes, ext: str):
+        try:
+            for page in range(20):
+                time.sleep(0.05)
+                parsed.append(page)
+                yield TextSegment(f"page {page}\n", {"page": page + 1})
+        finally:
+            closed.append(True)
+
+    async def consume():
+        async for _ in DocumentExtractor.iter_segments(b"", "slow.txt"):
+            await asyncio.sleep(0)
+
+    async def run():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.12)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return "cancelled"
+        return "finished"
+
+    original = DocumentExtractor._iter_segments
+    DocumentExtractor._iter_segments = staticmethod(slow_parts)
+    try:
+        outcome = asyncio.run(run())
+    finally:
+        DocumentExtractor._iter_segments = original
+    parsed_at_cancel = len(parsed)
+    time.sleep(0.2)
+    assert outcome == "cancelled"
+    assert closed == [True]
+    assert len(parsed) == parsed_at_cancel < 20
+    print("✅ 抽出の取り消しを確認")
+
+
+if __name__ == "__main__":
+    test_cancel_waits_for_running_parse()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+エンベディングのバッチ化・リトライ・同時実行数制御のテスト
+APIキー不要（ローカルのエンベディング実装でレート制限を注入して動作確認）
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+# APIを呼ばないローカル実装と一時ディレクトリのKVMを使用
+os.environ['EMBEDDING_PROVIDER'] = 'local'
+os.environ.setdefault('KVM_SQLITE_PATH', str(Path(tempfile.mkdtemp()) / "kvm.sqlite3"))
+
+from services.embedding_service import EmbeddingService, AdaptiveConcurrencyLimiter
+from services.embedding_provider import LocalEmbeddingProvider, SimulatedRateLimitError
+from services.chunker import ChunkResult
+
+
+def make_service(**provider_options) -> EmbeddingService:
+    """ローカル実装とキャッシュなしのサービス"""
+    service = EmbeddingService()
+    service.provider = LocalEmbeddingProvider(dimension=64, **provider_options)
+    service.embedding_model = service.provider.model
+    service.embedding_dimension = service.provider.dimension
+    service.cache_enabled = False
+    return service
+
+
+def without_backoff(run):
+    """リトライ間の待機を省略して実行（待機した秒数を返す）"""
+    original_sleep = asyncio.sleep
+    delays = []
+
+    async def fast_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        return await original_sleep(0)
+
+    asyncio.sleep = fast_sleep
+    try:
+        return asyncio.run(run()), delays
+    finally:
+        asyncio.sleep = original_sleep
+
+
+def test_limiter_halves_and_recovers():
+    """レート制限で上限が半減し（下限1）、連続成功で1ずつ回復すること"""
+    async def run():
+        limiter = AdaptiveConcurrencyLimiter(8, recovery_successes=2)
+        limits = []
+        for rate_limited in [True, True, True, True, False, False, False, False]:
+            await limiter.acquire()
+            await limiter.release(rate_limited=rate_limited)
+            limits.append(limiter.limit)
+        return limits
+
+    assert asyncio.run(run()) == [4, 2, 1, 1, 1, 2, 2, 3]
+    print("✅ 上限の半減と回復を確認")
+
+
+def test_limiter_bounds_in_flight():
+    """同時に実行される数が上限を超えないこと"""
+    async def run():
+        limiter = AdaptiveConcurrencyLimiter(3)
+        state = {"in_flight": 0, "peak": 0}
+
+        async def task():
+            await limiter.acquire()
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+            await asyncio.sleep(0.01)
+            state["in_flight"] -= 1
+            await limiter.release()
+
+        await asyncio.gather(*(task() for _ in range(10)))
+        return state["peak"]
+
+    assert asyncio.run(run()) == 3
+    print("✅ 同時実行数の上限を確認")
+
+
+def test_make_batches_respects_token_budget_and_input_cap():
+    """トークン予算と入力数上限でバッチを区切り、上限を超える1件は単独のバッチになること"""
+    service = make_service()
+    service.batch_max_tokens = 30
+    service.batch_max_inputs = 3
+    # "あ" × 9 は推定10トークン
+    texts = ["あ" * 9] * 4 + ["あ" * 49] + ["あ" * 9] * 2 + ["a"] * 5
+    batches = service._make_batches(texts)
+
+    assert batches == [[0, 1, 2], [3], [4], [5, 6, 7], [8, 9, 10], [11]]
+    for batch in batches:
+        tokens = sum(service.estimate_tokens(texts[i]) for i in batch)
+        assert len(batch) <= 3 and (tokens <= 30 or len(batch) == 1)
+    print("✅ トークン予算と入力数上限によるバッチ分割を確認")
+
+
+def test_retry_gives_up_after_max_retries():
+    """レート制限が続く場合は max_retries 回で諦め、同時実行数の上限を下げること"""
+    service = make_service(rate_limit_rate=1.0)
+    service.max_retries = 2
+
+    async def run():
+        try:
+            await service._embed_batch_with_retry(["会議室の予約"], 64)
+        except SimulatedRateLimitError:
+            return True
+        return False
+
+    raised, delays = without_backoff(run)
+    assert raised
+    assert service.provider.calls == 3  # 初回 + リトライ2回
+    assert len(delays) == 2
+    assert service._limiter.limit == 1 and service._limiter._in_flight == 0
+    print("✅ リトライ回数の上限を確認")
+
+
+def test_embed_chunks_keeps_order_under_rate_limits():
+    """レート制限を受けても、結果は入力順で、リクエスト数はバッチ数 + リトライ数になること"""
+    service = make_service(rate_limit_rate=0.3, seed=7)
+    service.batch_max_tokens = 40
+    service.max_retries = 20
+    texts = [f"第{i}条 会議室{i}の予約手順" for i in range(40)]
+    chunks = [ChunkResult(chunk_id=f"c{i}", text=text, position=i, metadata={}) for i, text in enumerate(texts)]
+    batches = service._make_batches(texts)
+    assert len(batches) > 1
+
+    results, delays = without_backoff(lambda: service.embed_chunks(chunks, tenant_id="test", dimension=64))
+
+    assert [result.chunk_id for result in results] == [chunk.chunk_id for chunk in chunks]
+    for result, text in zip(results, texts):
+        assert result.embedding == service.provider.vector(text).tolist()
+    assert len(delays) > 0
+    assert service.provider.calls == len(batches) + len(delays)
+    assert service.provider.inputs >= len(texts)
+    print("✅ レート制限下での出力順とリクエスト数を確認")
+
+
+if __name__ == "__main__":
+    test_limiter_halves_and_recovers()
+    test_limiter_bounds_in_flight()
+    test_make_batches_respects_token_budget_and_input_cap()
+    test_retry_gives_up_after_max_retries()
+    test_embed_chunks_keeps_order_under_rate_limits()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+エンベディングキャッシュのテスト
+APIキー不要（TTL・LRU・同時要求の集約、ローカルストレージへの永続化の動作確認）
+"""
+
+import sys
+import uuid
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import services.embedding_cache as embedding_cache_module
+from services.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from services.kvm_service import SQLiteKVMService
+from services.storage_service import storage_service
+
+
+def creator(calls: list, delay: float = 0.0):
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return [float(len(calls)), 0.0]
+    return create
+
+
+def test_query_cache_hits_and_keys():
+    """正規化後に同じクエリはヒットし、テナント・次元数が違えば別エントリになること"""
+    async def run():
+        cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+        calls = []
+        first = await cache.get_or_create("会議室 の予約", "m", 8, creator(calls))
+        again = await cache.get_or_create("  会議室　の予約 ", "m", 8, creator(calls))
+        await cache.get_or_create("会議室 の予約", "m", 4, creator(calls))
+        await cache.get_or_create("会議室 の予約", "m", 8, creator(calls), tenant_id="other")
+        return cache, calls, first, again
+
+    cache, calls, first, again = asyncio.run(run())
+    assert first == again
+    assert len(calls) == 3
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3
+    # 上限2件のため最初のエントリはLRUで破棄されている
+    assert stats["entries"] == 2
+    print("✅ クエリキャッシュのキーとLRUを確認")
+
+
+def test_query_cache_ttl_and_single_flight():
+    """期限切れのエントリは作り直し、同時の同一クエリは1回だけ作成すること"""
+    async def run():
+        cache = QueryEmbeddingCache(ttl_seconds=0.02)
+        calls = []
+        results = await asyncio.gather(*[
+            cache.get_or_create("q", "m", 8, creator(calls, delay=0.01)) for _ in range(4)
+        ])
+        assert len(calls) == 1 and all(result == results[0] for result in results)
+        await asyncio.sleep(0.03)
+        await cache.get_or_create("q", "m", 8, creator(calls))
+        return cache, calls
+
+    cache, calls = asyncio.run(run())
+    assert len(calls) == 2
+    stats = cache.get_stats()
+    assert stats["coalesced"] == 3 and stats["expired"] == 1
+    print("✅ TTLと同時要求の集約を確認")
+
+
+def test_query_cache_does_not_store_failures():
+    """作成に失敗したクエリはキャッシュされないこと"""
+    async def failing():
+        raise RuntimeError("api error")
+
+    async def run():
+        cache = QueryEmbeddingCache()
+        try:
+            await cache.get_or_create("q", "m", 8, failing)
+        except RuntimeError:
+            pass
+        return cache, await cache.get_or_create("q", "m", 8, creator([]))
+
+    cache, vector = asyncio.run(run())
+    assert vector == [1.0, 0.0]
+    assert cache.get_stats()["misses"] == 2
+    print("✅ 失敗時にキャッシュしないことを確認")
+
+
+def test_chunk_cache_persists_per_batch():
+    """put_many 1回につきパック1つを保存し、別プロセス相当のキャッシュからパック単位で読めること"""
+    tenant_id = f"test_cache_{uuid.uuid4().hex[:8]}"
+    calls = {"put": 0, "get": 0}
+    original_put, original_get = storage_service.put_object, storage_service.get_object
+    original_kvm = embedding_cache_module.kvm_service
+
+    async def counting_put(*args, **kwargs):
+        calls["put"] += 1
+        return await original_put(*args, **kwargs)
+
+    async def counting_get(*args, **kwargs):
+        calls["get"] += 1
+        return await original_get(*args, **kwargs)
+
+    async def run(kvm):
+        embedding_cache_module.kvm_service = kvm
+        storage_service.put_object = counting_put
+        storage_service.get_object = counting_get
+        texts = ["第1条 総則", "第2条 定義", "第3条 適用範囲"]
+        vectors = [[1.0, 0.0], [0.0, 1.0], [0.5, 0.5]]
+        await EmbeddingCache().put_many(texts, vectors, "m", 2, tenant_id)
+        assert calls["put"] == 1
+
+        fresh = EmbeddingCache()
+        results = await fresh.get_many(
+            ["第1条 総則", "新しい条文", "第3条 適用範囲", " 第1条　総則 "], "m", 2, tenant_id
+        )
+        assert results == [[1.0, 0.0], None, [0.5, 0.5], [1.0, 0.0]]
+        assert calls["get"] == 1
+        stats = fresh.get_stats()
+        assert stats["storage_hits"] == 3 and stats["misses"] == 1
+
+        # 2回目はローカル層のみで解決する
+        await fresh.get_many(["第3条 適用範囲"], "m", 2, tenant_id)
+        assert calls["get"] == 1 and fresh.get_stats()["local_hits"] == 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            asyncio.run(run(SQLiteKVMService(str(Path(directory) / "kvm.sqlite3"))))
+        finally:
+            embedding_cache_module.kvm_service = original_kvm
+            storage_service.put_object = original_put
+            storage_service.get_object = original_get
+            shutil.rmtree(backend_dir / "data" / "local_storage" / tenant_id, ignore_errors=True)
+    print("✅ バッチ単位の永続化とパック単位の読み込みを確認")
+
+
+if __name__ == "__main__":
+    test_chunk_cache_persists_per_batch()
+    test_query_cache_hits_and_keys()
+    test_query_cache_ttl_and_single_flight()
+    test_query_cache_does_not_store_failures()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+エンベディング保存フォーマットのテスト
+.npy + サイドカー形式の往復変換と旧形式JSONの読み込みを確認
+"""
+
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services import embedding_format
+
+
+def _encode(vectors, dtype="float32"):
+    rows = len(vectors)
+    return embedding_format.encode_embeddings(
+        filename="test.txt",
+        chunk_ids=[f"chunk_{i}" for i in range(rows)],
+        texts=[f"テキスト{i}" for i in range(rows)],
+        metadatas=[{"chunk_index": i} for i in range(rows)],
+        vectors=vectors,
+        embedding_model="text-embedding-3-large",
+        created_at="2025-08-13T00:00:00",
+        dtype=dtype
+    )
+
+
+def test_roundtrip_and_offsets():
+    """往復変換とオフセット表によるレンジ読み込み"""
+    vectors = np.random.default_rng(0).normal(size=(5, 16)).astype(np.float32)
+    matrix_bytes, meta_content = _encode(vectors)
+
+    meta, matrix = embedding_format.decode_embeddings(matrix_bytes, meta_content)
+    assert meta["format_version"] == embedding_format.FORMAT_VERSION
+    assert meta["chunk_count"] == 5
+    assert np.array_equal(matrix, vectors)
+
+    # オフセット表だけで3行目を切り出せること
+    chunk = meta["chunks"][3]
+    row = np.frombuffer(matrix_bytes[chunk["offset"]:chunk["offset"] + meta["row_bytes"]], dtype=meta["dtype"])
+    assert np.array_equal(row, vectors[3])
+
+    # 標準の .npy としても読めること
+    assert np.array_equal(np.load(io.BytesIO(matrix_bytes)), vectors)
+    print("✅ 往復変換・オフセット表を確認")
+
+
+def test_float16_and_legacy():
+    """float16保存と旧形式JSONの読み込み"""
+    vectors = np.random.default_rng(1).normal(size=(3, 16)).astype(np.float32)
+    matrix_bytes, meta_content = _encode(vectors, dtype="float16")
+    meta, matrix = embedding_format.decode_embeddings(matrix_bytes, meta_content)
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix, vectors, atol=1e-2)
+
+    legacy = json.dumps({
+        "filename": "old.txt",
+        "embedding_model": "text-embedding-3-large",
+        "embedding_dimension": 16,
+        "chunk_count": 3,
+        "created_at": "2025-08-13T00:00:00",
+        "chunks": [
+            {"chunk_id": f"c{i}", "text": "t", "embedding": vectors[i].tolist(), "metadata": {}}
+            for i in range(3)
+        ]
+    }, indent=2)
+    meta, matrix = embedding_format.decode_legacy_embeddings(legacy)
+    assert meta["filename"] == "old.txt"
+    assert [c["row"] for c in meta["chunks"]] == [0, 1, 2]
+    assert np.allclose(matrix, vectors)
+    print("✅ float16・旧形式の読み込みを確認")
+
+
+def test_segment_manifest():
+    """セグメントのマニフェストから1ファイル分にまとめ、行の保存位置を引けること"""
+    vectors = np.random.default_rng(2).normal(size=(7, 16)).astype(np.float32)
+    generation = embedding_format.new_generation()
+
+    parts = []
+    segments = []
+    for number, (start, stop) in enumerate([(0, 4), (4, 7)]):
+        name = embedding_format.segment_name("test.txt", generation, number)
+        assert embedding_format.parse_segment_name(name) == ("test.txt", generation, number)
+        matrix_bytes, meta_content = _encode(vectors[start:stop])
+        parts.append((matrix_bytes, embedding_format.decode_embeddings(matrix_bytes, meta_content)))
+        segments.append({
+            "name": name,
+            "chunk_count": stop - start,
+            "data_offset": embedding_format.decode_meta(meta_content)["data_offset"]
+        })
+    assert embedding_format.parse_segment_name("test.txt") is None
+
+    manifest = embedding_format.decode_meta(embedding_format.encode_manifest(
+        filename="test.txt",
+        generation=generation,
+        segments=segments,
+        embedding_model="text-embedding-3-large",
+        dimension=16,
+        dtype="float32",
+        created_at="2025-08-13T00:00:00"
+    ))
+    assert embedding_format.is_manifest(manifest)
+    meta, matrix = embedding_format.merge_segments(manifest, [part for _, part in parts])
+    assert np.array_equal(matrix, vectors)
+    assert [c["row"] for c in meta["chunks"]] == list(range(7))
+    assert all(c["metadata"]["total_chunks"] == 7 for c in meta["chunks"])
+
+    # 2つ目のセグメントの行をレンジ読み込みできること
+    layout = embedding_format.layout_from_meta(manifest)
+    name, offset = embedding_format.locate_row(layout, "test.txt", 5)
+    assert name == segments[1]["name"]
+    row = np.frombuffer(parts[1][0][offset:offset + layout["row_bytes"]], dtype=layout["dtype"])
+    assert np.array_equal(row, vectors[5])
+    print("✅ セグメントのマニフェストを確認")
+
+
+def test_change_log_entries():
+    """変更ログのエントリ名が時刻順に並び、内容を復元できること"""
+    first = embedding_format.log_entry_name()
+    second = embedding_format.log_entry_name()
+    assert first < second
+    assert first.endswith(embedding_format.LOG_SUFFIX)
+    assert abs(embedding_format.log_entry_time(first) - time.time()) < 60
+
+    # 旧形式JSON（.json）として読み込まれないこと
+    assert not first.endswith(embedding_format.LEGACY_SUFFIX)
+
+    entry = embedding_format.decode_log_entry(embedding_format.encode_log_entry("delete", "資料.pdf"))
+    assert entry == {"op": "delete", "filename": "資料.pdf", "generation": None}
+    print("✅ 変更ログのエントリを確認")
+
+
+def test_coalesce_ranges():
+    """近い行は1つのレンジにまとまり、離れた行は別のレンジになること"""
+    ranges = embedding_format.coalesce_ranges([300, 100, 200, 100, 1000], length=100, max_gap=50)
+    assert ranges == [(100, 300, [100, 200, 300]), (1000, 100, [1000])]
+    # 間隔が上限を超える行は連続していても分ける
+    assert embedding_format.coalesce_ranges([0, 151], length=100, max_gap=50) == [(0, 100, [0]), (151, 100, [151])]
+    assert embedding_format.coalesce_ranges([], length=100, max_gap=50) == []
+    print("✅ レンジの統合を確認")
+
+
+if __name__ == "__main__":
+    test_roundtrip_and_offsets()
+    test_float16_and_legacy()
+    test_segment_manifest()
+    test_change_log_entries()
+    test_coalesce_ranges()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+エンベディングジョブのテスト
+APIキー不要（失敗したジョブのファイルの状態・再投入・テナント上限・ジョブの確保の動作確認）
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import services.embedding_job_service as embedding_job_module
+from services.embedding_job_service import EmbeddingJobService, LocalJobQueue, PENDING_JOBS_PK
+
+
+class MemoryKVM:
+    """テスト用のメモリ上のKVM（ジョブの実行で使う操作のみ）"""
+
+    def __init__(self):
+        self.items: Dict[tuple, Dict[str, Any]] = {}
+        self.reads = 0
+
+    async def put_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        self.items[(item['PK'], item['SK'])] = dict(item)
+        return {'success': True, 'response': item}
+
+    async def get_item(self, pk: str, sk: str) -> Optional[Dict[str, Any]]:
+        self.reads += 1
+        item = self.items.get((pk, sk))
+        return dict(item) if item else None
+
+    async def update_item(self, pk: str, sk: str, updates: Dict[str, Any], increments=None, expected=None) -> Dict[str, Any]:
+        if (pk, sk) not in self.items:
+            return {'success': False, 'error': 'Item not found'}
+        if any(self.items[(pk, sk)].get(key) != value for key, value in (expected or {}).items()):
+            return {'success': False, 'error': 'Condition failed'}
+        self.items[(pk, sk)].update(updates)
+        return {'success': True, 'response': self.items[(pk, sk)]}
+
+    async def delete_item(self, pk: str, sk: str) -> Dict[str, Any]:
+        self.items.pop((pk, sk), None)
+        return {'success': True}
+
+    async def query(self, pk: str, sk_prefix: Optional[str] = None, **kwargs) -> List[Dict[str, Any]]:
+        return [dict(item) for (item_pk, item_sk), item in sorted(self.items.items())
+                if item_pk == pk and item_sk.startswith(sk_prefix or "")]
+
+
+class RecordingQueue(LocalJobQueue):
+    """ack・releaseを記録するプロセス内キュー"""
+
+    def __init__(self):
+        super().__init__()
+        self.acked: List[Any] = []
+        self.released: List[float] = []
+
+    async def ack(self, receipt: Any):
+        self.acked.append(receipt)
+
+    async def release(self, receipt: Any, message: Dict[str, Any], delay: float = 0):
+        self.released.append(delay)
+
+
+def run_with_kvm(test):
+    """メモリ上のKVMに差し替えて test(kvm, service) を実行"""
+    kvm = MemoryKVM()
+    original = embedding_job_module.kvm_service
+    embedding_job_module.kvm_service = kvm
+    service = EmbeddingJobService()
+    service.queue = RecordingQueue()
+    try:
+        return asyncio.run(test(kvm, service))
+    finally:
+        embedding_job_module.kvm_service = original
+
+
+def run_failed_job(process_file):
+    """process_fileを差し替えてジョブを実行し、(ジョブ, ファイル) のKVMのアイテムを返す"""
+    kvm = MemoryKVM()
+    original = embedding_job_module.kvm_service
+    embedding_job_module.kvm_service = kvm
+    service = EmbeddingJobService()
+    service.process_file = process_file
+
+    pk, sk = service._job_key("lib", "empty.txt", "tenant", "user")
+    file_sk = "LIBRARY#lib#FILE#empty.txt"
+    job = {'PK': pk, 'SK': sk, 'job_id': "job-1", 'library_id': "lib", 'filename': "empty.txt",
+           'tenant_id': "tenant", 'user_id': "user", 'status': "queued", 'attempts': 0}
+
+    async def run():
+        await kvm.put_item(job)
+        await kvm.put_item({'PK': pk, 'SK': file_sk, 'filename': "empty.txt", 'embedding_status': "queued"})
+        await service._run(pk, sk, job)
+        return await kvm.get_item(pk, sk), await kvm.get_item(pk, file_sk)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        embedding_job_module.kvm_service = original
+
+
+def test_failed_job_without_exception_marks_file_failed():
+    """テキストが抽出できず例外なしで失敗した場合も、ファイルが処理中のまま残らないこと"""
+    async def no_text(**kwargs):
+        # process_fileが抽出結果なしの場合に返す結果
+        return {"filename": kwargs['filename'], "status": "failed", "reason": "Text extraction failed"}
+
+    job, file_item = run_failed_job(no_text)
+    assert job['status'] == "failed" and job['error'] == "Text extraction failed"
+    assert file_item['embedding_status'] == "failed"
+    assert file_item['embedding_error'] == "Text extraction failed"
+    print("✅ テキストなしの失敗でファイルの状態を確認")
+
+
+def test_failed_job_with_exception_marks_file_failed():
+    """例外で失敗した場合もファイルの状態とエラーが記録されること"""
+    async def crash(**kwargs):
+        raise RuntimeError("boom")
+
+    job, file_item = run_failed_job(crash)
+    assert job['status'] == "failed"
+    assert file_item['embedding_status'] == "failed" and file_item['embedding_error'] == "boom"
+    print("✅ 例外での失敗でファイルの状態を確認")
+
+
+
+def test_enqueue_supersedes_running_job():
+    """待機中のジョブは再利用し、実行中のジョブは新しいジョブで置き換えること"""
+    async def test(kvm, service):
+        async def no_workers():
+            pass
+
+        # ワーカーは起動せず、ジョブレコードだけを確認
+        service.start = no_workers
+        queued = await service.enqueue("lib", "a.txt", "tenant", "user")
+        again = await service.enqueue("lib", "a.txt", "tenant", "user")
+        assert again['job_id'] == queued['job_id']
+
+        pk, sk = service._job_key("lib", "a.txt", "tenant", "user")
+        await kvm.update_item(pk, sk, {'status': "running"})
+        replaced = await service.enqueue("lib", "a.txt", "tenant", "user")
+        return queued, replaced, await kvm.get_item(pk, sk)
+
+    queued, replaced, job = run_with_kvm(test)
+    assert replaced['job_id'] != queued['job_id']
+    assert job['job_id'] == replaced['job_id'] and job['status'] == "queued"
+    print("✅ 実行中のジョブの置き換えを確認")
+
+
+def test_tenant_cap_parks_jobs_without_requeue():
+    """テナント上限を超えたジョブはキューに戻さず保留し、枠が空いたら実行すること"""
+    async def test(kvm, service):
+        service.tenant_concurrency = 1
+        gate = asyncio.Event()
+        order = []
+
+        async def slow(**kwargs):
+            order.append(kwargs['filename'])
+            await gate.wait()
+            return {"filename": kwargs['filename'], "status": "success", "chunk_count": 1}
+
+        service.process_file = slow
+        for filename in ("a.txt", "b.txt", "c.txt"):
+            await service.enqueue("lib", filename, "tenant", "user")
+        await asyncio.sleep(0.2)
+        reads = kvm.reads
+        await asyncio.sleep(0.2)
+        parked = len(service._deferred.get("tenant", []))
+        busy_reads = kvm.reads - reads
+
+        gate.set()
+        for _ in range(100):
+            jobs = await service.get_library_jobs("lib", "tenant", "user")
+            if all(job['status'] == "completed" for job in jobs):
+                break
+            await asyncio.sleep(0.01)
+        await service.stop()
+        return order, parked, busy_reads, jobs, service.queue, await kvm.query(pk=PENDING_JOBS_PK)
+
+    order, parked, busy_reads, jobs, queue, pending = run_with_kvm(test)
+    assert order == ["a.txt", "b.txt", "c.txt"]
+    assert parked == 2 and busy_reads == 0
+    assert queue.released == [] and len(queue.acked) == 3
+    assert [job['status'] for job in jobs] == ["completed"] * 3 and pending == []
+    print("✅ テナント上限のジョブの保留を確認")
+
+
+def test_handle_acks_when_run_fails():
+    """_runが例外で終わってもメッセージを処理済みにすること"""
+    async def test(kvm, service):
+        job = await service.enqueue("lib", "a.txt", "tenant", "user")
+        await service.stop()
+
+        async def broken_run(pk, sk, job):
+            raise RuntimeError("KVM unavailable")
+
+        service._run = broken_run
+        entry = {'receipt': "receipt-1", 'message': service._message(job)}
+        try:
+            await service._handle(entry)
+        except RuntimeError:
+            pass
+        return service.queue.acked, await kvm.query(pk=PENDING_JOBS_PK), service._running
+
+    acked, pending, running = run_with_kvm(test)
+    assert acked == ["receipt-1"] and pending == [] and running == {"tenant": 0}
+    print("✅ 失敗したジョブのメッセージの削除を確認")
+
+
+def test_running_job_is_not_claimed_twice():
+    """他のワーカーが実行中のジョブは実行せず、ハートビートが止まったジョブは引き継ぐこと"""
+    async def test(kvm, service):
+        job = await service.enqueue("lib", "a.txt", "tenant", "user")
+        await service.stop()
+        pk, sk = service._job_key("lib", "a.txt", "tenant", "user")
+        runs = []
+
+        async def run(pk, sk, job):
+            runs.append(job['job_id'])
+
+        service._run = run
+        message = service._message(job)
+
+        # 他のワーカーが実行中（再配信されたメッセージ）
+        await kvm.update_item(pk, sk, {'status': "running", 'attempts': 1,
+                                       'heartbeat_at': datetime.utcnow().isoformat()})
+        await service._handle({'receipt': "receipt-1", 'message': message})
+        owned_runs = list(runs)
+
+        # ハートビートが止まったワーカーのジョブ
+        await kvm.update_item(pk, sk, {'heartbeat_at': "2000-01-01T00:00:00"})
+        await service._handle({'receipt': "receipt-2", 'message': message})
+        return owned_runs, runs, service.queue, await kvm.get_item(pk, sk)
+
+    owned_runs, runs, queue, job = run_with_kvm(test)
+    assert owned_runs == [] and queue.released == [EmbeddingJobService().heartbeat_seconds * 3]
+    assert len(runs) == 1 and queue.acked == ["receipt-2"] and job['attempts'] == 2
+    print("✅ 実行中のジョブの二重実行の防止を確認")
+
+
+if __name__ == "__main__":
+    test_failed_job_without_exception_marks_file_failed()
+    test_failed_job_with_exception_marks_file_failed()
+    test_enqueue_supersedes_running_job()
+    test_tenant_cap_parks_jobs_without_requeue()
+    test_handle_acks_when_run_fails()
+    test_running_job_is_not_claimed_twice()
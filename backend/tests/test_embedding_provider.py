@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+ローカルのエンベディング実装のテスト
+APIキー不要（決定性・次元の切り詰め・遅延とエラーの注入の動作確認）
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.embedding_provider import (
+    LocalEmbeddingProvider,
+    SimulatedRateLimitError,
+    SimulatedTransientError,
+)
+
+
+def test_local_vectors_are_deterministic_and_topical():
+    """同じテキストは同じベクトルになり、語を共有するテキストほど近いこと"""
+    provider = LocalEmbeddingProvider(dimension=512)
+    texts = ["会議室の予約手順", "会議室の予約方法", "経費精算の締め日"]
+    first = np.array(asyncio.run(provider.embed(texts)))
+    second = np.array(asyncio.run(LocalEmbeddingProvider(dimension=512).embed(texts)))
+
+    assert first.shape == (3, 512)
+    assert np.array_equal(first, second)
+    assert np.allclose(np.linalg.norm(first, axis=1), 1.0)
+    assert first[0] @ first[1] > first[0] @ first[2]
+    print("✅ ローカル実装の決定性を確認")
+
+
+def test_local_dimensions_are_prefixes():
+    """縮小した次元のベクトルは、元のベクトルの先頭を再正規化したものと一致すること"""
+    provider = LocalEmbeddingProvider(dimension=256)
+    full = asyncio.run(provider.embed(["製品コードABC-123の保守手順"]))
+    reduced = asyncio.run(provider.embed(["製品コードABC-123の保守手順"], dimensions=64))
+    prefix = np.array(full[0][:64])
+    assert len(reduced[0]) == 64
+    assert np.allclose(reduced[0], prefix / np.linalg.norm(prefix))
+    print("✅ 次元の切り詰めを確認")
+
+
+def test_local_latency_and_error_injection():
+    """設定した遅延が入り、エラーは設定した確率で発生すること"""
+    provider = LocalEmbeddingProvider(dimension=8, latency_seconds=0.01, latency_per_input_seconds=0.005)
+    began = time.perf_counter()
+    asyncio.run(provider.embed(["a", "b"]))
+    assert time.perf_counter() - began >= 0.02
+
+    provider = LocalEmbeddingProvider(dimension=8, error_rate=0.3, rate_limit_rate=0.2, seed=1)
+
+    async def run():
+        outcomes = {"ok": 0, "rate_limited": 0, "error": 0}
+        for _ in range(500):
+            try:
+                await provider.embed(["a"])
+                outcomes["ok"] += 1
+            except SimulatedRateLimitError:
+                outcomes["rate_limited"] += 1
+            except SimulatedTransientError:
+                outcomes["error"] += 1
+        return outcomes
+
+    outcomes = asyncio.run(run())
+    assert 60 <= outcomes["rate_limited"] <= 140 and 100 <= outcomes["error"] <= 200
+    assert provider.calls == 500 and provider.inputs == 500
+    assert all(issubclass(error, provider.transient_errors) for error in (SimulatedRateLimitError, SimulatedTransientError))
+    print("✅ 遅延とエラーの注入を確認")
+
+
+if __name__ == "__main__":
+    test_local_vectors_are_deterministic_and_topical()
+    test_local_dimensions_are_prefixes()
+    test_local_latency_and_error_injection()
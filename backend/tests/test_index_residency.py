@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+インデックス常駐マネージャーのテスト
+APIキー不要（メモリ予算による破棄・同時ロードの集約の動作確認）
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.index_residency import IndexResidencyManager
+
+
+class DummyIndex:
+    """resident_bytes() だけを持つテスト用インデックス"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def resident_bytes(self) -> int:
+        return self.size
+
+
+def loader_for(size: int, calls: list, delay: float = 0.0):
+    async def load():
+        calls.append(size)
+        await asyncio.sleep(delay)
+        return DummyIndex(size)
+    return load
+
+
+def test_lru_and_lfu_eviction():
+    """予算超過時にLRUでは最も古いもの、LFUでは使用回数の少ないものが破棄されること"""
+    async def run(policy):
+        manager = IndexResidencyManager(budget_bytes=250, policy=policy)
+        evicted = []
+        manager.on_evict = lambda kind, key: evicted.append(key[1])
+        calls = []
+        await manager.get_or_load("vector", ("t", "a"), loader_for(100, calls))
+        await manager.get_or_load("vector", ("t", "b"), loader_for(100, calls))
+        # a を2回使う（LRUではbより新しく、LFUではbより多い）
+        await asyncio.sleep(0.01)
+        await manager.get_or_load("vector", ("t", "a"), loader_for(100, calls))
+        await manager.get_or_load("vector", ("t", "c"), loader_for(100, calls))
+        return manager, evicted, calls
+
+    manager, evicted, calls = asyncio.run(run("lru"))
+    assert evicted == ["b"]
+    assert sorted(key[1] for key in manager.keys("vector")) == ["a", "c"]
+    assert manager.resident_bytes == 200
+    assert len(calls) == 3
+    stats = manager.get_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3 and stats["evictions"] == 1
+
+    _, evicted, _ = asyncio.run(run("lfu"))
+    assert evicted == ["b"]
+    print("✅ メモリ予算による破棄を確認")
+
+
+def test_single_flight_and_oversized_index():
+    """同時の要求でもロードは1回で、予算を超える単体インデックスは保持されること"""
+    async def run():
+        manager = IndexResidencyManager(budget_bytes=50)
+        calls = []
+        results = await asyncio.gather(*[
+            manager.get_or_load("keyword", ("t", "big"), loader_for(80, calls, delay=0.02))
+            for _ in range(5)
+        ])
+        return manager, calls, results
+
+    manager, calls, results = asyncio.run(run())
+    assert calls == [80]
+    assert all(result is results[0] for result in results)
+    assert manager.peek("keyword", ("t", "big")) is results[0]
+    assert manager.get_stats()["coalesced"] == 4
+
+    # サイズが変わったら再計測される
+    results[0].size = 30
+    manager.refresh_size("keyword", ("t", "big"))
+    assert manager.resident_bytes == 30
+    print("✅ 同時ロードの集約を確認")
+
+
+def test_failed_load_is_not_cached():
+    """ロード失敗は待機中の要求にも伝わり、次回の要求で再ロードされること"""
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("load failed")
+
+    async def run():
+        manager = IndexResidencyManager(budget_bytes=100)
+        results = await asyncio.gather(
+            manager.get_or_load("vector", ("t", "a"), failing),
+            manager.get_or_load("vector", ("t", "a"), failing),
+            return_exceptions=True
+        )
+        index = await manager.get_or_load("vector", ("t", "a"), loader_for(10, []))
+        return manager, results, index
+
+    manager, results, index = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert manager.peek("vector", ("t", "a")) is index
+    assert manager.get_stats()["load_failures"] == 1
+    print("✅ ロード失敗時の挙動を確認")
+
+
+if __name__ == "__main__":
+    test_lru_and_lfu_eviction()
+    test_single_flight_and_oversized_index()
+    test_failed_load_is_not_cached()
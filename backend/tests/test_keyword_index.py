@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+ライブラリキーワードインデックスのテスト
+APIキー不要（BM25・RRFの動作確認）
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.keyword_index import (
+    LibraryKeywordIndex,
+    FileTerms,
+    tokenize,
+    reciprocal_rank_fusion,
+)
+from services.vector_index import LibraryVectorIndex
+from services.search_filter import SearchFilter
+
+
+TEXTS = [
+    "製品コードABC-123の保守手順について説明します。",
+    "東京都の会議室予約システムの使い方",
+    "ＡＢＣ１２３ではなくXYZ-999の仕様書です。",
+    "会議の議事録テンプレート",
+]
+
+
+def test_tokenize():
+    """日本語は文字bigram、英数字は語単位（全角は正規化）になること"""
+    assert tokenize("東京都") == ["東京", "京都"]
+    assert tokenize("ＡＢＣ-１２３") == ["abc-123", "abc", "123"]
+    assert tokenize("会") == ["会"]
+    assert tokenize("、。！") == []
+    print("✅ トークン化を確認")
+
+
+def test_bm25_search_and_file_updates():
+    """完全一致するコードが上位になり、ファイル単位の追加・削除が反映されること"""
+    index = LibraryKeywordIndex.build({
+        "a.txt": (["a0", "a1"], TEXTS[:2], [{}, {}], FileTerms.from_texts(TEXTS[:2])),
+        "b.txt": (["b0", "b1"], TEXTS[2:], [{}, {}], FileTerms.from_texts(TEXTS[2:])),
+    })
+    assert len(index) == 4
+    assert index.chunk_ids[index.search("abc-123")[0][0]] == "a0"
+    assert index.chunk_ids[index.search("xyz-999")[0][0]] == "b0"
+    assert {index.chunk_ids[row] for row, _ in index.search("会議")} == {"a1", "b1"}
+    assert index.search("存在しない語句") == []
+
+    # 先頭ファイルを削除しても後続ファイルの行が正しく引ける
+    assert index.remove_file("a.txt") == 2
+    assert index.chunk_ids[index.search("議事録")[0][0]] == "b1"
+
+    index.add_file("c.txt", ["c0"], ["議事録の書き方"], [{}])
+    assert {index.chunk_ids[row] for row, _ in index.search("議事録")} == {"b1", "c0"}
+
+    # フィルタで対象ファイルを絞ってもスコア（IDF）は変わらない
+    index.set_file_attributes("c.txt", {"uploaded_at": "2024-05-01", "content_type": "text/plain"})
+    files = index.filter_files(SearchFilter(content_types=["text/plain"]))
+    assert files == {"c.txt"}
+    filtered = index.search("議事録", filenames=files)
+    assert [index.chunk_ids[row] for row, _ in filtered] == ["c0"]
+    assert filtered[0] in index.search("議事録")
+    print("✅ BM25検索・ファイル更新を確認")
+
+
+def test_file_terms_encode_and_concat():
+    """転置リストの保存・読み込みとセグメント結合が元の作成結果と一致すること"""
+    whole = FileTerms.from_texts(TEXTS)
+    restored = FileTerms.decode(whole.encode())
+    assert restored.terms == whole.terms
+    assert np.array_equal(restored.rows, whole.rows)
+    assert np.array_equal(restored.tfs, whole.tfs)
+
+    merged = FileTerms.concat([FileTerms.from_texts(TEXTS[:3]), FileTerms.from_texts(TEXTS[3:])])
+    assert merged.terms == whole.terms
+    assert np.array_equal(merged.indptr, whole.indptr)
+    assert np.array_equal(merged.rows, whole.rows)
+    assert np.array_equal(merged.lengths, whole.lengths)
+
+    empty = FileTerms.decode(FileTerms.from_texts([]).encode())
+    assert len(empty) == 0 and empty.terms == []
+    print("✅ 転置リストの保存・結合を確認")
+
+
+def test_rrf_and_prefilter_rows():
+    """RRFで両方の上位にある候補が先頭になり、候補行の絞り込みが効くこと"""
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]], k=60)
+    assert fused[0][0] == "y"
+    assert {key for key, _ in fused} == {"x", "y", "z", "w"}
+
+    rng = np.random.default_rng(0)
+    index = LibraryVectorIndex.build(8, {
+        "a.txt": (["a0", "a1", "a2"], ["", "", ""], [{}, {}, {}], rng.normal(size=(3, 8)))
+    })
+    rows = index.rows_for([("a.txt", "a2"), ("a.txt", "a0"), ("b.txt", "a1")])
+    assert rows.tolist() == [0, 2]
+    hits = index.search(index.vectors[1], top_k=3, candidate_rows=rows)
+    assert {row for row, _ in hits} == {0, 2}
+    print("✅ RRF・候補の絞り込みを確認")
+
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_bm25_search_and_file_updates()
+    test_file_terms_encode_and_concat()
+    test_rrf_and_prefilter_rows()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+SQLiteのKVM実装のテスト
+APIキー不要（主キー検索・前方一致の範囲走査・アトミックな更新・条件付き削除・ロック待ちの動作確認）
+"""
+
+import sys
+import time
+import sqlite3
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.kvm_service import SQLiteKVMService, _decode_start_key
+
+
+def test_sqlite_prefix_query_is_a_range_scan():
+    """前方一致は範囲走査で、正規表現の特殊文字やプレフィックスの隣の値を含まないこと"""
+    assert SQLiteKVMService._prefix_upper_bound("FILE#") == "FILE$"
+    assert SQLiteKVMService._prefix_upper_bound("a\U0010ffff") == "b"
+    assert SQLiteKVMService._prefix_upper_bound("\ud7ff") == "\ue000"
+
+    with tempfile.TemporaryDirectory() as directory:
+        kvm = SQLiteKVMService(str(Path(directory) / "kvm.sqlite3"))
+
+        async def run():
+            for sk in ["LIBRARY#a.b#FILE#1", "LIBRARY#a.b#FILE#2", "LIBRARY#axb#FILE#3", "LIBRARY#a.c#FILE#4"]:
+                await kvm.put_item({"PK": "USER#1", "SK": sk, "name": sk[-1]})
+            await kvm.put_item({"PK": "USER#2", "SK": "LIBRARY#a.b#FILE#5", "name": "5"})
+
+            descending = await kvm.query("USER#1", "LIBRARY#a.b#")
+            ascending = await kvm.query("USER#1", "LIBRARY#a.b#", scan_forward=True)
+            limited = await kvm.query("USER#1", page_size=2, scan_forward=True)
+            return descending, ascending, limited
+
+        descending, ascending, limited = asyncio.run(run())
+        assert [item["name"] for item in descending] == ["2", "1"]
+        assert [item["name"] for item in ascending] == ["1", "2"]
+        assert [item["name"] for item in limited] == ["1", "2"]
+        kvm.conn.close()
+    print("✅ 前方一致の範囲走査を確認")
+
+
+def test_sqlite_put_update_delete_and_persistence():
+    """putは置き換え、updateはカウンターを加算し、再接続後も値が残ること"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "kvm.sqlite3")
+        kvm = SQLiteKVMService(path)
+
+        async def run():
+            await kvm.put_item({"PK": "P", "SK": "S", "old": True, "message_count": 0})
+            await kvm.put_item({"PK": "P", "SK": "S", "message_count": 0})
+            await asyncio.gather(*[kvm.update_item("P", "S", {"message_count": 1, "title": "t"}) for _ in range(50)])
+            missing = await kvm.update_item("P", "missing", {"title": "t"})
+            return missing
+
+        missing = asyncio.run(run())
+        assert missing == {"success": False, "error": "Item not found"}
+        kvm.conn.close()
+
+        reopened = SQLiteKVMService(path)
+        item = asyncio.run(reopened.get_item("P", "S"))
+        assert item == {"PK": "P", "SK": "S", "message_count": 50, "title": "t"}
+        assert asyncio.run(reopened.delete_item("P", "S")) == {"success": True}
+        assert asyncio.run(reopened.delete_item("P", "S"))["success"] is False
+        assert asyncio.run(reopened.get_item("P", "S")) is None
+        reopened.conn.close()
+    print("✅ 保存・更新・削除と永続化を確認")
+
+
+def test_sqlite_query_page_cursor():
+    """next_keyで全件を重複・欠落なく辿れ、最後のページのnext_keyはNoneになること"""
+    with tempfile.TemporaryDirectory() as directory:
+        kvm = SQLiteKVMService(str(Path(directory) / "kvm.sqlite3"))
+
+        async def walk(scan_forward):
+            seen = []
+            start_key = None
+            while True:
+                page = await kvm.query_page("P", "CHAT#", page_size=4, scan_forward=scan_forward, start_key=start_key)
+                seen.extend(item["SK"] for item in page["items"])
+                start_key = page["next_key"]
+                if start_key is None:
+                    return seen
+
+        async def run():
+            for i in range(12):
+                await kvm.put_item({"PK": "P", "SK": f"CHAT#{i:03d}"})
+            await kvm.put_item({"PK": "P", "SK": "USER#1"})
+            return await walk(True), await walk(False)
+
+        ascending, descending = asyncio.run(run())
+        expected = [f"CHAT#{i:03d}" for i in range(12)]
+        assert ascending == expected
+        assert descending == expected[::-1]
+
+        # 別のPKのキーや壊れたキーは受け付けない
+        first = asyncio.run(kvm.query_page("P", page_size=1))
+        assert _decode_start_key("P", first["next_key"]) == "USER#1"
+        for start_key in (first["next_key"], "not-a-key"):
+            try:
+                asyncio.run(kvm.query_page("Q", start_key=start_key))
+                assert False, "ValueErrorが発生しませんでした"
+            except ValueError:
+                pass
+        kvm.conn.close()
+    print("✅ カーソルによるページ送りを確認")
+
+
+def test_sqlite_batch_and_transaction():
+    """バッチ操作はキーの順序で返し、トランザクションは更新対象がなければ全体を取り消すこと"""
+    with tempfile.TemporaryDirectory() as directory:
+        kvm = SQLiteKVMService(str(Path(directory) / "kvm.sqlite3"))
+
+        async def run():
+            await kvm.batch_put_items([{"PK": "P", "SK": f"FILE#{i}", "size": i} for i in range(5)])
+            fetched = await kvm.batch_get_items([("P", "FILE#3"), ("P", "missing"), ("P", "FILE#0")])
+
+            await kvm.put_item({"PK": "P", "SK": "LIBRARY", "file_count": 5})
+            committed = await kvm.transact_write([
+                {"action": "put", "item": {"PK": "P", "SK": "FILE#5", "size": 5}},
+                {"action": "update", "pk": "P", "sk": "LIBRARY", "updates": {"file_count": 6}},
+                {"action": "delete", "pk": "P", "sk": "FILE#0"},
+            ])
+            rolled_back = await kvm.transact_write([
+                {"action": "delete", "pk": "P", "sk": "FILE#1"},
+                {"action": "update", "pk": "P", "sk": "missing", "updates": {"file_count": 1}},
+            ])
+            await kvm.batch_delete_items([("P", "FILE#2"), ("P", "FILE#4"), ("P", "missing")])
+            remaining = await kvm.query("P", "FILE#", scan_forward=True)
+            library = await kvm.get_item("P", "LIBRARY")
+            return fetched, committed, rolled_back, remaining, library
+
+        fetched, committed, rolled_back, remaining, library = asyncio.run(run())
+        assert [item and item["size"] for item in fetched] == [3, None, 0]
+        assert committed == {"success": True}
+        assert rolled_back["success"] is False
+        assert [item["SK"] for item in remaining] == ["FILE#1", "FILE#3", "FILE#5"]
+        assert library["file_count"] == 6
+
+        # 不正な操作と上限を超える操作は実行前に拒否する
+        for operations in ([{"action": "upsert", "item": {}}], [{"action": "delete", "pk": "P", "sk": "x"}] * 101):
+            try:
+                asyncio.run(kvm.transact_write(operations))
+                assert False, "ValueErrorが発生しませんでした"
+            except ValueError:
+                pass
+        # 空の更新はトランザクションと同じく拒否する
+        try:
+            asyncio.run(kvm.update_item("P", "LIBRARY", {}))
+            assert False, "ValueErrorが発生しませんでした"
+        except ValueError:
+            pass
+        kvm.conn.close()
+    print("✅ バッチ操作とトランザクションを確認")
+
+
+def test_sqlite_atomic_increments_and_conditions():
+    """別の接続からの同時の加算が失われず、条件付きの更新・削除は条件を満たす場合のみ反映されること"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "kvm.sqlite3")
+        connections = [SQLiteKVMService(path) for _ in range(4)]
+        asyncio.run(connections[0].put_item({"PK": "P", "SK": "LIBRARY", "status": "idle"}))
+
+        def add(kvm):
+            for _ in range(50):
+                asyncio.run(kvm.update_item("P", "LIBRARY", {"updated_at": "t"}, increments={"file_count": 1, "total_size": 10}))
+
+        threads = [threading.Thread(target=add, args=(kvm,)) for kvm in connections]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        kvm = connections[0]
+        item = asyncio.run(kvm.get_item("P", "LIBRARY"))
+        assert item["file_count"] == 200 and item["total_size"] == 2000
+
+        # 条件付き更新（同じ状態から2回更新しても1回だけ成功する）
+        first = asyncio.run(kvm.update_item("P", "LIBRARY", {"status": "processing"}, expected={"status": "idle"}))
+        second = asyncio.run(kvm.update_item("P", "LIBRARY", {"status": "processing"}, expected={"status": "idle"}))
+        assert first["success"] and second == {"success": False, "error": "Condition failed"}
+
+        # 互換性: updatesのmessage_countは加算、incrementsは負の値で減算
+        result = asyncio.run(kvm.update_item("P", "LIBRARY", {"message_count": 2}, increments={"file_count": -1}))
+        assert result["item"]["message_count"] == 2 and result["item"]["file_count"] == 199
+
+        # 条件付き削除（同じファイルの削除を2回行っても減算は1回だけ）
+        asyncio.run(kvm.put_item({"PK": "P", "SK": "FILE#a", "storage_key": "k1"}))
+        operations = [
+            {"action": "delete", "pk": "P", "sk": "FILE#a", "expected": {"storage_key": "k1"}},
+            {"action": "update", "pk": "P", "sk": "LIBRARY", "increments": {"file_count": -1}},
+        ]
+        first = asyncio.run(kvm.transact_write(operations))
+        second = asyncio.run(kvm.transact_write(operations))
+        assert first == {"success": True} and second["success"] is False
+        assert asyncio.run(kvm.get_item("P", "LIBRARY"))["file_count"] == 198
+        for connection in connections:
+            connection.conn.close()
+    print("✅ アトミックな加算と条件付き更新を確認")
+
+
+def test_sqlite_lock_wait_does_not_block_event_loop():
+    """他の接続が書き込み中でも、ロック待ちの間にイベントループの他の処理が進むこと"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "kvm.sqlite3")
+        kvm = SQLiteKVMService(path)
+        other = sqlite3.connect(path, isolation_level=None)
+
+        async def run():
+            other.execute("BEGIN IMMEDIATE")
+            ticks = []
+
+            async def ticker():
+                for _ in range(5):
+                    ticks.append(time.perf_counter())
+                    await asyncio.sleep(0.01)
+                other.execute("COMMIT")
+
+            began = time.perf_counter()
+            _, result = await asyncio.gather(ticker(), kvm.put_item({"PK": "P", "SK": "S"}))
+            return ticks, result, time.perf_counter() - began
+
+        ticks, result, elapsed = asyncio.run(run())
+        assert len(ticks) == 5 and result["success"]
+        assert elapsed < 2.0  # busy_timeout（5秒）まで待たずに、ロックの解放後に書き込める
+        assert asyncio.run(kvm.get_item("P", "S")) == {"PK": "P", "SK": "S"}
+        other.close()
+        kvm.conn.close()
+    print("✅ ロック待ちでイベントループが止まらないことを確認")
+
+
+if __name__ == "__main__":
+    test_sqlite_prefix_query_is_a_range_scan()
+    test_sqlite_put_update_delete_and_persistence()
+    test_sqlite_query_page_cursor()
+    test_sqlite_batch_and_transaction()
+    test_sqlite_atomic_increments_and_conditions()
+    test_sqlite_lock_wait_does_not_block_event_loop()
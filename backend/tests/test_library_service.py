@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+ライブラリサービスのテスト
+APIキー不要（ファイル削除時のライブラリのカウンタの動作確認）
+"""
+
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+# エンベディングはローカル、アップロード時のジョブは登録しない
+os.environ.setdefault('EMBEDDING_PROVIDER', 'local')
+os.environ['EMBEDDING_AUTO_ON_UPLOAD'] = 'false'
+
+temp_dir = tempfile.mkdtemp()
+os.environ.setdefault('KVM_SQLITE_PATH', str(Path(temp_dir) / "kvm.sqlite3"))
+
+import services.library_service as library_module
+from services.library_service import LibraryService
+from services.kvm_service import SQLiteKVMService
+
+TENANT_ID = "test_library_service_tenant"
+USER_ID = "test_user"
+
+
+def test_concurrent_deletes_decrement_once():
+    """同じファイルを同時に削除しても、ライブラリのファイル数とサイズは1回だけ減算されること"""
+    kvm = SQLiteKVMService(str(Path(temp_dir) / "library.sqlite3"))
+    original = library_module.kvm_service
+    library_module.kvm_service = kvm
+    storage = library_module.storage_service
+    delete_object = storage.delete_object
+
+    async def slow_delete_object(key: str):
+        # S3などの遅延で、両方の削除がファイル情報を読み込んだ後にKVMを更新する
+        await asyncio.sleep(0.05)
+        return await delete_object(key)
+
+    storage.delete_object = slow_delete_object
+
+    async def run():
+        library = await LibraryService.create_library(
+            "カウンタのテスト", tenant_id=TENANT_ID, user_id=USER_ID
+        )
+        library_id = library['id']
+        for filename in ("memo.txt", "notes.txt"):
+            await LibraryService.upload_file(
+                library_id, filename, "会議室の予約".encode('utf-8'), "text/plain",
+                tenant_id=TENANT_ID, user_id=USER_ID
+            )
+
+        await asyncio.gather(*[
+            LibraryService.delete_file(library_id, "memo.txt", tenant_id=TENANT_ID, user_id=USER_ID)
+            for _ in range(2)
+        ])
+        pk = f"TENANT#{TENANT_ID}#USER#{USER_ID}"
+        return await kvm.get_item(pk, f"LIBRARY#{library_id}")
+
+    try:
+        library_item = asyncio.run(run())
+        assert library_item['file_count'] == 1
+        assert library_item['total_size'] == len("会議室の予約".encode('utf-8'))
+        print("✅ 同時のファイル削除の減算を確認")
+    finally:
+        library_module.kvm_service = original
+        storage.delete_object = delete_object
+        kvm.conn.close()
+        shutil.rmtree(Path("data/local_storage") / TENANT_ID, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_concurrent_deletes_decrement_once()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+量子化インデックスの再ランキングのテスト
+APIキー不要（ローカルのエンベディング実装で、セグメント単位のレンジ読み込みと再スコアリングの動作確認）
+"""
+
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+# APIを呼ばないローカル実装と一時ディレクトリのKVMを使用
+os.environ['EMBEDDING_PROVIDER'] = 'local'
+os.environ.setdefault('KVM_SQLITE_PATH', str(Path(tempfile.mkdtemp()) / "kvm.sqlite3"))
+
+from services.embedding_service import EmbeddingService
+from services.embedding_provider import LocalEmbeddingProvider
+from services.storage_service import storage_service
+
+TENANT_ID = "test_rerank_tenant"
+LIBRARY_ID = "lib_rerank"
+DIMENSION = 256
+
+
+def test_rerank_reads_ranges_per_segment():
+    """再ランキングは候補をセグメントごとにまとめて読み込み、元のベクトルのスコアで並べること"""
+    service = EmbeddingService()
+    service.provider = LocalEmbeddingProvider(dimension=DIMENSION)
+    service.embedding_model = service.provider.model
+    service.embedding_dimension = DIMENSION
+    service.cache_enabled = False
+    service.quantization = "int8"
+    service.chunk_tokens = 40
+    service.chunk_overlap_tokens = 0
+    service.batch_max_inputs = 4
+    service.stream_segment_chunks = 8
+    service.rerank_factor = 10
+    calls = []
+    original_ranges = storage_service.get_object_ranges
+
+    async def counting_ranges(key, ranges):
+        calls.append((key, len(ranges)))
+        return await original_ranges(key, ranges)
+
+    async def run():
+        async def parts():
+            yield "".join(f"会議室{i % 5}の予約手順{i}。\n" for i in range(120))
+
+        await service.process_file_stream(
+            library_id=LIBRARY_ID, filename="rooms.txt", parts=parts(),
+            tenant_id=TENANT_ID, user_id=None, dimension=DIMENSION
+        )
+        storage_service.get_object_ranges = counting_ranges
+        return await service.search(
+            library_id=LIBRARY_ID, query="会議室 予約", top_k=5, threshold=0.0,
+            tenant_id=TENANT_ID, rerank=True, dimension=DIMENSION
+        )
+
+    async def cleanup():
+        result = await storage_service.list_objects(prefix=f"{TENANT_ID}/")
+        for obj in result.get('objects', []):
+            await storage_service.delete_object(obj['key'])
+        service.drop_library_index(LIBRARY_ID, TENANT_ID)
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        storage_service.get_object_ranges = original_ranges
+        asyncio.run(cleanup())
+        shutil.rmtree(Path("data/local_storage") / TENANT_ID, ignore_errors=True)
+
+    # 候補（50件まで）を、候補を含むセグメント（8チャンクずつ）ごとに1回の読み込みで再スコアリング
+    segments = {key for key, _ in calls}
+    assert len(segments) >= 3 and len(calls) == len(segments)
+    assert all(range_count == 1 for _, range_count in calls)
+    query = service.provider.vector("会議室 予約", DIMENSION)
+    for result in results:
+        exact = float(service.provider.vector(result.text, DIMENSION) @ query)
+        assert np.isclose(result.score, exact, atol=1e-5)
+    scores = [result.score for result in results]
+    assert len(results) == 5 and scores == sorted(scores, reverse=True)
+    print("✅ セグメント単位のレンジ読み込みによる再ランキングを確認")
+
+
+if __name__ == "__main__":
+    test_rerank_reads_ranges_per_segment()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+検索結果の多様化・隣接チャンク結合のテスト
+APIキー不要（MMR選択とオーバーラップ除去の動作確認）
+"""
+
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.result_diversity import (
+    mmr_select,
+    normalize_scores,
+    join_overlapping,
+    merge_adjacent,
+)
+
+
+@dataclass
+class Result:
+    """SearchResultと同じ属性を持つテスト用の結果"""
+    chunk_id: str
+    text: str
+    score: float
+    filename: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    vector_score: Optional[float] = None
+    keyword_score: Optional[float] = None
+    library_id: Optional[str] = None
+
+
+def test_mmr_prefers_distinct_candidates():
+    """ほぼ同じ候補が並んでいても、2件目には別方向の候補が選ばれること"""
+    vectors = np.array([[1.0, 0.0], [0.999, 0.045], [0.0, 1.0]], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    relevance = normalize_scores(np.array([0.9, 0.89, 0.6]))
+
+    assert mmr_select(vectors, relevance, k=2, lambda_=0.5) == [0, 2]
+    # lambda=1は関連度順のまま
+    assert mmr_select(vectors, relevance, k=3, lambda_=1.0) == [0, 1, 2]
+    assert mmr_select(vectors, relevance, k=10) == [0, 2, 1]
+    assert mmr_select(vectors[:0], relevance[:0], k=3) == []
+    assert normalize_scores(np.array([0.5, 0.5])).tolist() == [1.0, 1.0]
+    print("✅ MMR選択を確認")
+
+
+def test_join_overlapping():
+    """重なり部分を1回だけ含めて連結すること"""
+    assert join_overlapping("会議室の予約。手順は次の通り", "手順は次の通り。まず申請") == "会議室の予約。手順は次の通り。まず申請"
+    assert join_overlapping("abc", "xyz") == "abcxyz"
+    assert join_overlapping("aaaa", "aaab") == "aaaab"
+    assert join_overlapping("aaaa", "aaab", max_overlap=2) == "aaaaab"
+    print("✅ オーバーラップの除去を確認")
+
+
+def test_merge_adjacent_chunks():
+    """同じファイルの連番チャンクだけが結合され、最上位の位置とスコアを引き継ぐこと"""
+    def chunk(chunk_id, text, score, filename, index, start, end, library_id="lib"):
+        return Result(
+            chunk_id=chunk_id, text=text, score=score, filename=filename, library_id=library_id,
+            metadata={"chunk_index": index, "start_position": start, "end_position": end},
+            vector_score=score
+        )
+
+    results = [
+        chunk("a2", "CCDD", 0.9, "a.txt", 2, 20, 30),
+        chunk("b0", "other", 0.8, "b.txt", 0, 0, 10),
+        chunk("a1", "BBCC", 0.7, "a.txt", 1, 10, 22),
+        chunk("a3", "DDEE", 0.6, "a.txt", 3, 28, 40),
+        chunk("a5", "GG", 0.5, "a.txt", 5, 50, 60),
+        chunk("x1", "same index", 0.4, "a.txt", 4, 40, 50, library_id="other"),
+    ]
+    merged = merge_adjacent(results)
+
+    assert [result.chunk_id for result in merged] == ["a1", "b0", "a5", "x1"]
+    passage = merged[0]
+    assert passage.text == "BBCCDDEE"
+    assert passage.score == 0.9 and passage.vector_score == 0.9
+    assert passage.metadata["merged_chunk_ids"] == ["a1", "a2", "a3"]
+    assert passage.metadata["start_position"] == 10 and passage.metadata["end_position"] == 40
+    # 元の結果は変更しない
+    assert "merged_chunk_ids" not in results[2].metadata
+    print("✅ 隣接チャンクの結合を確認")
+
+
+if __name__ == "__main__":
+    test_mmr_prefers_distinct_candidates()
+    test_join_overlapping()
+    test_merge_adjacent_chunks()
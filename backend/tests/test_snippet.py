@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+検索結果のスニペットのテスト
+APIキー不要（クエリ周辺の切り出しと強調位置の動作確認）
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.snippet import make_snippet
+
+
+def test_snippet_window_and_highlights():
+    """語が最も集まる範囲を切り出し、強調位置が元のテキスト（全角のまま）を指すこと"""
+    text = "前置き。" * 30 + "東京都の会議室予約では、ＡＢＣ－１２３の申請が必要です。" + "後書き。" * 30 + "会議室"
+    snippet = make_snippet(text, "会議室 abc-123", max_chars=40)
+
+    assert len(snippet["text"]) == 40
+    assert text[snippet["start"]:snippet["end"]] == snippet["text"]
+    highlighted = [snippet["text"][start:end] for start, end in snippet["highlights"]]
+    # bigramの重なり（会議・議室）は1つの範囲にまとまる
+    assert highlighted == ["会議室", "ＡＢＣ－１２３"]
+    print("✅ スニペットの範囲と強調位置を確認")
+
+
+def test_snippet_edge_cases():
+    """一致しない場合は先頭、正規化で文字数が変わる文字があっても位置がずれないこと"""
+    assert make_snippet("短い本文です。", "存在しない語") == {
+        "text": "短い本文です。", "highlights": [], "start": 0, "end": 7
+    }
+    snippet = make_snippet("㍿の会議室", "会議")
+    assert [snippet["text"][start:end] for start, end in snippet["highlights"]] == ["会議"]
+    # 語が窓の末尾にある場合も窓はテキスト内に収まる
+    snippet = make_snippet("あ" * 100 + "会議室", "会議室", max_chars=20)
+    assert snippet["end"] == 103 and snippet["text"].endswith("会議室")
+    print("✅ スニペットの境界条件を確認")
+
+
+if __name__ == "__main__":
+    test_snippet_window_and_highlights()
+    test_snippet_edge_cases()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+ライブラリベクトルインデックスのテスト
+APIキー不要（ランダムベクトルで動作確認）
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトのルートをPythonパスに追加
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.vector_index import LibraryVectorIndex
+from services import ann_index
+from services import quantization
+from services.search_filter import SearchFilter
+
+
+def _make_files(rng, file_count=3, rows=50, dimension=32):
+    """テスト用のファイル別ベクトルを作成"""
+    files = {}
+    for i in range(file_count):
+        files[f"file_{i}.txt"] = (
+            [f"chunk_{i}_{j}" for j in range(rows)],
+            [f"text {i} {j}" for j in range(rows)],
+            [{"chunk_index": j} for j in range(rows)],
+            rng.normal(size=(rows, dimension))
+        )
+    return files
+
+
+def test_search_matches_brute_force():
+    """行列積による検索結果が総当たりのコサイン類似度と一致すること"""
+    rng = np.random.default_rng(0)
+    files = _make_files(rng)
+    index = LibraryVectorIndex.build(32, files)
+
+    query = rng.normal(size=32)
+    hits = index.search(query, top_k=5)
+
+    all_vectors = np.concatenate([f[3] for f in files.values()])
+    expected = (all_vectors @ query) / (np.linalg.norm(all_vectors, axis=1) * np.linalg.norm(query))
+    expected_rows = list(np.argsort(-expected)[:5])
+
+    assert [row for row, _ in hits] == expected_rows
+    assert abs(hits[0][1] - expected[expected_rows[0]]) < 1e-5
+    print("✅ 総当たり検索と一致")
+
+
+def test_threshold_and_file_updates():
+    """閾値・ファイル単位の追加/削除が反映されること"""
+    rng = np.random.default_rng(1)
+    index = LibraryVectorIndex.build(32, _make_files(rng))
+    assert len(index) == 150
+
+    # ファイル削除
+    assert index.remove_file("file_1.txt") == 50
+    assert len(index) == 100
+    assert "file_1.txt" not in index.filenames
+
+    # 同一ベクトルを追加すると類似度1.0で最上位になる
+    target = rng.normal(size=(1, 32))
+    index.add_file("new.txt", ["new_0"], ["new text"], [{}], target)
+    hits = index.search(target[0], top_k=3, threshold=0.99)
+    assert len(hits) == 1
+    assert index.chunk_ids[hits[0][0]] == "new_0"
+
+    # 同名ファイルの再追加は置き換え
+    index.add_file("new.txt", ["new_1"], ["new text"], [{}], target)
+    assert index.chunk_ids.count("new_0") == 0
+    assert len(index) == 101
+    print("✅ 閾値・ファイル更新の反映を確認")
+
+
+def test_ivf_search_and_persistence():
+    """IVF検索の再現率と、保存・読み込み後の割り当ての一致"""
+    rng = np.random.default_rng(2)
+    centers = rng.normal(size=(20, 32))
+    files = {}
+    for i in range(4):
+        vectors = centers[rng.integers(0, 20, 300)] + 0.2 * rng.normal(size=(300, 32))
+        files[f"file_{i}.txt"] = ([f"c{i}_{j}" for j in range(300)], ["t"] * 300, [{}] * 300, vectors)
+    index = LibraryVectorIndex.build(32, files)
+
+    centroids = ann_index.train_centroids(index.vectors, ann_index.default_list_count(len(index)))
+    index.set_ivf(centroids)
+
+    query = centers[5] + 0.2 * rng.normal(size=32)
+    exact = {row for row, _ in index.search(query, top_k=10)}
+    approx = {row for row, _ in index.search(query, top_k=10, nprobe=4)}
+    assert len(exact & approx) >= 9
+
+    # 追加ファイルは既存セントロイドに割り当てられる
+    index.add_file("extra.txt", ["x"], ["t"], [{}], centers[5:6])
+    assert index.list_ids[-1] >= 0
+
+    # 保存・読み込みで割り当てが保持される
+    restored_centroids, restored = ann_index.decode_ivf(
+        ann_index.encode_ivf(index.centroids, index.ivf_assignments_by_file())
+    )
+    assert np.array_equal(restored_centroids, index.centroids)
+    assert np.array_equal(restored["file_2.txt"], index.ivf_assignments_by_file()["file_2.txt"])
+    print("✅ IVF検索・永続化を確認")
+
+
+def test_quantized_search():
+    """int8 / PQ量子化後も上位結果が概ね保たれ、メモリが削減されること"""
+    rng = np.random.default_rng(3)
+    files = _make_files(rng, file_count=4, rows=300, dimension=64)
+    query = rng.normal(size=64)
+    exact = {row for row, _ in LibraryVectorIndex.build(64, files).search(query, top_k=10)}
+
+    for name, min_overlap in (("int8", 9), ("pq", 4)):
+        index = LibraryVectorIndex.build(64, files)
+        full_bytes = index.memory_bytes()
+        index.quantize(quantization.create_codec(name, pq_subspaces=16))
+        assert index.vectors is None
+        assert index.memory_bytes() * 4 <= full_bytes
+
+        # 上位40件の候補には正解のほとんどが含まれる（再ランキングの前提）
+        candidates = {row for row, _ in index.search(query, top_k=40)}
+        assert len(exact & candidates) >= min_overlap, name
+
+        # 量子化後の追加も検索対象になる
+        index.add_file("extra.txt", ["x"], ["t"], [{}], query.reshape(1, -1))
+        assert index.chunk_ids[index.search(query, top_k=1)[0][0]] == "x"
+    print("✅ 量子化検索を確認")
+
+
+def test_metadata_filter():
+    """フィルタに一致するファイルの行だけがスコアリングされ、ファイル更新後も正しく絞り込めること"""
+    rng = np.random.default_rng(3)
+    index = LibraryVectorIndex.build(32, _make_files(rng))
+    index.set_file_attributes("file_0.txt", {"uploaded_at": "2024-01-10T00:00:00", "content_type": "application/pdf"})
+    index.set_file_attributes("file_1.txt", {"uploaded_at": "2024-03-01T09:00:00+09:00", "content_type": "text/plain"})
+    index.set_file_attributes("file_2.txt", {"uploaded_at": None, "content_type": "text/markdown"})
+
+    def files_for(**conditions):
+        rows = index.filter_rows(SearchFilter(**conditions))
+        return sorted({index.filenames[row] for row in rows})
+
+    assert index.filter_rows(None) is None and index.filter_rows(SearchFilter()) is None
+    assert files_for(filenames=["file_2.txt", "missing.txt"]) == ["file_2.txt"]
+    assert files_for(content_types=["text/*"]) == ["file_1.txt", "file_2.txt"]
+    assert files_for(content_types=["APPLICATION/PDF"]) == ["file_0.txt"]
+    # 日時が未設定のファイルは日時の条件に一致しない
+    assert files_for(uploaded_after="2024-02-01") == ["file_1.txt"]
+    assert files_for(uploaded_before="2024-02-29T23:59:59Z", content_types=["text/*"]) == []
+
+    query = rng.normal(size=32)
+    rows = index.filter_rows(SearchFilter(content_types=["text/plain"]))
+    hits = index.search(query, top_k=100, candidate_rows=rows)
+    assert len(hits) == 50 and {index.filenames[row] for row, _ in hits} == {"file_1.txt"}
+
+    # 置き換えたファイルは属性を設定し直すまでフィルタに一致しない
+    index.add_file("file_1.txt", ["new"], ["t"], [{}], query.reshape(1, -1))
+    assert files_for(content_types=["text/plain"]) == []
+    index.set_file_attributes("file_1.txt", {"uploaded_at": "2024-04-01", "content_type": "text/plain"})
+    rows = index.filter_rows(SearchFilter(content_types=["text/plain"]))
+    assert [index.chunk_ids[row] for row in rows] == ["new"]
+    index.remove_file("file_0.txt")
+    assert files_for(content_types=["application/pdf"]) == []
+    assert len(index.filter_rows(SearchFilter(content_types=["text/*"]))) == 51
+    print("✅ メタデータフィルタを確認")
+
+
+if __name__ == "__main__":
+    test_search_matches_brute_force()
+    test_threshold_and_file_updates()
+    test_ivf_search_and_persistence()
+    test_quantized_search()
+    test_metadata_filter()